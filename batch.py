@@ -0,0 +1,231 @@
+"""
+    batch.py
+
+    Scrapes the decompilations of several builds at once, one per worker
+    process, and reports what changed between them: functions, type methods,
+    global values and datablock fields that were added or removed, along with
+    those whose address, argument counts, description or type changed.
+
+    Entries are matched by name first, case insensitively as Torque Script
+    doesn't care about case, within their type or datablock. Entries left
+    over on both sides are then matched by address, which catches functions
+    that were renamed between builds.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import sys
+import json
+import argparse
+import multiprocessing
+
+import cache
+import export
+import scraper
+
+diff_categories = ("global_functions", "type_methods", "global_values", "datablocks")
+
+diff_fields = {
+    "global_functions": ("address", "min_args", "max_args", "description"),
+    "type_methods": ("address", "min_args", "max_args", "description"),
+    "global_values": ("address", "type_name"),
+    "datablocks": ("address", "type_name"),
+}
+"""
+    The fields compared between matched entries of every category.
+"""
+
+class BuildDiff(object):
+    """
+        The differences between the scrapes of two builds. Every category holds a dictionary
+        with lists of "added", "removed" and "changed" entries. Entries are dictionaries of
+        their scope (type or datablock, None for globals), name and compared fields. Changed
+        entries hold the scope and name in the new build and a dictionary of field to
+        [old value, new value], including the name if they were matched by address.
+    """
+    old_name = None
+    new_name = None
+    categories = None
+
+    def __init__(self, old, new, old_name=None, new_name=None):
+        self.old_name = old_name
+        self.new_name = new_name
+
+        self.categories = { }
+        for category in diff_categories:
+            self.categories[category] = _diff_records(category, list(_records(old, category)), list(_records(new, category)))
+
+    def is_empty(self):
+        for category in diff_categories:
+            for change_type in ("added", "removed", "changed"):
+                if (len(self.categories[category][change_type]) != 0):
+                    return False
+        return True
+
+    def as_dict(self):
+        return {
+            "old": self.old_name,
+            "new": self.new_name,
+            "categories": self.categories,
+        }
+
+    def summary(self):
+        lines = ["%s -> %s" % (self.old_name, self.new_name)]
+
+        for category in diff_categories:
+            changes = self.categories[category]
+            lines.append("    %-18s %6u added %6u removed %6u changed" % (category, len(changes["added"]), len(changes["removed"]), len(changes["changed"])))
+
+        return "\n".join(lines)
+
+def scrape_builds(filenames, processes=None, cache_directory=None, **scraper_options):
+    """
+        Scrapes every file in a pool of worker processes, returning the scrapes in the same
+        order. The scraper options are used for every file, but can't ask for parallel
+        scraping of their own as pool workers aren't allowed child processes.
+    """
+    if (scraper_options.get("processes") is not None):
+        raise ValueError("Builds are already scraped in parallel; the scraper can't use processes of its own")
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_scrape_build, [(filename, cache_directory, scraper_options) for filename in filenames], 1)
+    finally:
+        pool.close()
+        pool.join()
+
+def diff_builds(filenames, scrapes):
+    """
+        Diffs every build against the one before it, so builds are expected oldest first.
+    """
+    return [BuildDiff(scrapes[index - 1], scrapes[index], filenames[index - 1], filenames[index]) for index in range(1, len(scrapes))]
+
+# Helper Functions
+def _scrape_build(build):
+    filename, cache_directory, scraper_options = build
+
+    if (cache_directory is None):
+        return scraper.Scraper(filename, **scraper_options)
+    return cache.ScrapeCache(cache_directory).scrape(filename, **scraper_options)
+
+def _records(scrape, category):
+    """
+        Yields (scope, name, address, fields) for every entry of a category. Entries with an
+        address of None are only ever matched by name.
+    """
+    if (category == "global_functions"):
+        for global_function in scrape.global_functions:
+            yield (None, global_function.name, global_function.address, (global_function.address, global_function.min_args - 1, global_function.max_args - 1, global_function.description))
+    elif (category == "type_methods"):
+        for type_name in scrape.type_methods:
+            for type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs in scrape.type_methods[type_name]:
+                yield (type_name, type_method_name, type_method_address, (type_method_address, type_method_minargs - 1, type_method_maxargs - 1, type_method_description))
+    elif (category == "global_values"):
+        # Global values are built with their executable address as the name, so that is all they can be matched on
+        for global_value in scrape.global_values:
+            yield (None, global_value.name, None, (global_value.address, global_value.type_name))
+    else:
+        for datablock_type in scrape.datablocks:
+            for datablock_property in scrape.datablocks[datablock_type].properties.values():
+                yield (datablock_type, datablock_property.name, datablock_property.address, (datablock_property.address, datablock_property.type_name))
+
+def _diff_records(category, old_records, new_records):
+    result = { "added": [ ], "removed": [ ], "changed": [ ] }
+    pairs = [ ]
+
+    # Match by name within the same scope first
+    unmatched_old = { }
+    for index, record in enumerate(old_records):
+        unmatched_old.setdefault(_name_key(record), [])
+        unmatched_old[_name_key(record)].append(index)
+
+    unmatched_new = [ ]
+    for record in new_records:
+        candidates = unmatched_old.get(_name_key(record))
+        if (candidates):
+            pairs.append((old_records[candidates.pop(0)], record))
+        else:
+            unmatched_new.append(record)
+
+    remaining_old = sorted(index for indices in unmatched_old.values() for index in indices)
+
+    # Then fall back to matching whatever is left over by address
+    old_by_address = { }
+    for index in remaining_old:
+        if (old_records[index][2] is None):
+            result["removed"].append(_entry(category, old_records[index]))
+            continue
+
+        old_by_address.setdefault(_address_key(old_records[index]), [])
+        old_by_address[_address_key(old_records[index])].append(index)
+
+    for record in unmatched_new:
+        candidates = None
+        if (record[2] is not None):
+            candidates = old_by_address.get(_address_key(record))
+
+        if (candidates):
+            pairs.append((old_records[candidates.pop(0)], record))
+        else:
+            result["added"].append(_entry(category, record))
+
+    for indices in old_by_address.values():
+        for index in indices:
+            result["removed"].append(_entry(category, old_records[index]))
+
+    for old_record, new_record in pairs:
+        changes = { }
+        if (old_record[1] != new_record[1]):
+            changes["name"] = [old_record[1], new_record[1]]
+
+        for field, old_value, new_value in zip(diff_fields[category], old_record[3], new_record[3]):
+            if (old_value != new_value):
+                changes[field] = [old_value, new_value]
+
+        if (len(changes) != 0):
+            result["changed"].append({ "scope": new_record[0], "name": new_record[1], "changes": changes })
+
+    for change_type in ("added", "removed", "changed"):
+        result[change_type].sort(key=lambda entry: (entry["scope"] or "", entry["name"]))
+    return result
+
+def _name_key(record):
+    return (record[0], record[1].lower())
+
+def _address_key(record):
+    return (record[0], record[2])
+
+def _entry(category, record):
+    result = { "scope": record[0], "name": record[1] }
+    result.update(zip(diff_fields[category], record[3]))
+
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrapes several builds in parallel and reports the differences between them.")
+    parser.add_argument("inputs", nargs="+", help="The decompiled executables to scrape, oldest build first.")
+    parser.add_argument("-o", "--output", help="Write the JSON diff report here rather than to stdout. Strings in the report are decoded with the string_encoding it records.")
+    parser.add_argument("--engine", choices=scraper.Scraper.scan_engines, default="regex", help="The scan engine to scrape with.")
+    parser.add_argument("--mmap", action="store_true", help="Map the inputs into memory rather than reading them.")
+    parser.add_argument("--processes", type=int, help="Number of worker processes, one per CPU by default.")
+    parser.add_argument("--cache", metavar="DIRECTORY", help="Cache scrape results in this directory.")
+    arguments = parser.parse_args()
+
+    scrapes = scrape_builds(arguments.inputs, arguments.processes, arguments.cache, engine=arguments.engine, use_mmap=arguments.mmap)
+    diffs = diff_builds(arguments.inputs, scrapes)
+
+    # Names and descriptions are byte strings as scraped, which aren't always valid UTF-8
+    diff_dicts = [diff.as_dict() for diff in diffs]
+    encoding = export.string_encoding(diff_dicts)
+
+    report = json.dumps({ "builds": arguments.inputs, "string_encoding": encoding, "diffs": export.text_strings(diff_dicts, encoding) }, indent=4, sort_keys=True)
+    if (arguments.output is None):
+        print(report)
+    else:
+        with open(arguments.output, "w") as handle:
+            handle.write(report)
+
+    for diff in diffs:
+        sys.stderr.write(diff.summary() + "\n")
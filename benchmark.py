@@ -0,0 +1,274 @@
+"""
+    benchmark.py
+
+    A reproducible benchmark suite for the scraper and the DokuWiki renderer.
+    Rather than relying on the real (and unshipped) Tribes2.c, it generates
+    synthetic Hex-Rays style decompilations of configurable sizes and runs
+    them through t2src, reporting the stats of every phase along with overall
+    throughput and peak memory as JSON so runs can be compared against a
+    stored baseline in CI.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import multiprocessing
+
+import t2src
+import scraper
+
+class DecompilationGenerator(object):
+    """
+        Writes out a synthetic decompilation laid out the way Hex-Rays lays out the real
+        thing: a block of declarations the scraper skips, followed by functions each
+        starting with a //----- (ADDRESS) header. Registration calls are spread over the
+        functions at random, datablock fields are grouped into functions whose address is
+        a known datablock initialiser.
+    """
+    function_count = None
+    registration_count = None
+    datablock_field_count = None
+    seed = None
+
+    declaration_line_count = 33350
+    """
+        Has to match the number of lines the scraper skips at the start of its input.
+    """
+
+    filler_line_count = 6
+    """
+        Lines of unrelated code in every function.
+    """
+
+    name_prefixes = ["get", "set", "is", "alx", "m", "calc", "getAudio", "vector"]
+    name_nouns = ["Version", "Position", "Transform", "Damage", "Energy", "Velocity", "Matrix", "Listener"]
+
+    description_templates = [
+        "%s(%%obj, %%value)",
+        "%s();",
+        "%s: returns \\\"true\\\", or \\\"false\\\"",
+        "(string text, int count) %s, prints text; count times",
+    ]
+    """
+        Descriptions are C string literals, so quotes within them come out escaped. They
+        cover commas, semicolons and quotes in the places the scrapers have to cope with.
+    """
+
+    def __init__(self, function_count, registration_count, datablock_field_count=None, seed=0):
+        """
+            registration_count is the number of registration calls made to every registrar
+            address. datablock_field_count defaults to the same.
+        """
+        self.function_count = function_count
+        self.registration_count = registration_count
+        self.datablock_field_count = registration_count if datablock_field_count is None else datablock_field_count
+        self.seed = seed
+
+    def generate(self, filename):
+        with open(filename, "wb") as handle:
+            self.write(handle)
+
+    def write(self, handle):
+        generator = random.Random(self.seed)
+
+        for declaration in range(self.declaration_line_count):
+            handle.write("int dword_%X; // weak\r\n" % (0x7A0000 + declaration * 4))
+
+        function_calls = [[] for function in range(self.function_count)]
+        registrars = sorted(set(scraper.Scraper._global_function_registry)) + sorted(set(scraper.Scraper._type_function_registry)) + scraper.Scraper._global_value_registry
+
+        for registrar in registrars:
+            for registration in range(self.registration_count):
+                function_calls[generator.randrange(self.function_count)].append(self._registration(generator, registrar))
+
+        # Datablock fields go into their own initialiser functions after everything else
+        datablock_callers = self._datablock_callers(generator)
+        datablock_calls = { }
+        for field in range(self.datablock_field_count):
+            caller = datablock_callers[generator.randrange(len(datablock_callers))]
+
+            datablock_calls.setdefault(caller, [])
+            datablock_calls[caller].append(self._datablock_registration(generator, field))
+
+        for function in range(self.function_count):
+            self._write_function(handle, generator, "%08X" % (0x401000 + function * 0x40), function_calls[function])
+
+        for caller in sorted(datablock_calls.keys()):
+            self._write_function(handle, generator, "%08X" % int(caller, 16), datablock_calls[caller])
+
+    # Helper Functions
+    def _write_function(self, handle, generator, address, calls):
+        handle.write("//----- (%s) --------------------------------------------------------\r\n" % address)
+        handle.write("int __cdecl sub_%X(int a1, int a2)\r\n{\r\n" % int(address, 16))
+        handle.write("  int v1; // eax@1\r\n  int v2; // ecx@1\r\n\r\n")
+
+        for filler in range(self.filler_line_count):
+            if (filler % 3 == 2):
+                handle.write("  if ( v1 > %u ) sub_%X(v2, \"fmt; %%d, %%s\");\r\n" % (filler, 0x500000 + generator.randrange(0x10000)))
+            else:
+                handle.write("  v%u = sub_%X(a1, %u);\r\n" % (filler % 2 + 1, 0x500000 + generator.randrange(0x10000), filler))
+
+        for call in calls:
+            handle.write(call + "\r\n")
+
+        handle.write("  return v1;\r\n}\r\n\r\n")
+
+    def _datablock_callers(self, generator):
+        return sorted(scraper.Scraper._datablock_type_table.keys())
+
+    def _datablock_registration(self, generator, field):
+        return "  sub_%s(\"field%u\", %u, %u, 1, 0);" % (scraper.Scraper._datablock_property_registry[0], field, generator.randrange(12), field * 4)
+
+    def _registration(self, generator, registrar):
+        name = "%s%s%u" % (generator.choice(self.name_prefixes), generator.choice(self.name_nouns), generator.randrange(100000))
+        description = generator.choice(self.description_templates) % name
+        implementation = 0x500000 + generator.randrange(0x100000)
+
+        if (registrar in scraper.Scraper._global_function_registry):
+            return "  sub_%s(\"%s\", (int)sub_%X, (int)\"%s\", %u, %u);" % (registrar, name, implementation, description, 1, generator.randrange(1, 6))
+        elif (registrar in scraper.Scraper._type_function_registry):
+            type_name = generator.choice(sorted(scraper.Scraper.type_name_inheritance.keys()))
+            return "  sub_%s(v1, \"%s\", \"%s\", (int)sub_%X, (int)\"%s\", %u, %u);" % (registrar, type_name, name, implementation, description, 2, generator.randrange(2, 7))
+
+        return "  sub_%s(\"%s\", %u, &dword_%X);" % (registrar, name, generator.choice([1, 3, 5]), 0x7A0000 + generator.randrange(0x10000) * 4)
+
+class Benchmark(object):
+    """
+        Runs every case in a process of its own, so that peak memory figures belong to that
+        case alone.
+    """
+    sizes = None
+    registration_count = None
+    variants = None
+
+    variant_options = {
+        "regex": { "engine": "regex" },
+        "regex_mmap": { "engine": "regex", "use_mmap": True },
+        "regex_bytes": { "engine": "regex", "use_bytes": True },
+        "single_pass": { "engine": "single_pass" },
+        "single_pass_mmap": { "engine": "single_pass", "use_mmap": True },
+        "single_pass_bytes": { "engine": "single_pass", "use_bytes": True },
+        "call_index": { "engine": "call_index" },
+        "call_index_mmap": { "engine": "call_index", "use_mmap": True },
+        "call_index_bytes": { "engine": "call_index", "use_bytes": True },
+        "regex_stream": { "engine": "regex", "memory_limit": 64 << 20 },
+        "single_pass_stream": { "engine": "single_pass", "memory_limit": 64 << 20 },
+    }
+
+    def __init__(self, sizes, registration_count, variants):
+        self.sizes = sizes
+        self.registration_count = registration_count
+        self.variants = variants
+
+    def run(self):
+        results = [ ]
+        directory = tempfile.mkdtemp(prefix="t2bench")
+
+        try:
+            for size in self.sizes:
+                input_filename = os.path.join(directory, "bench_%u.c" % size)
+                DecompilationGenerator(size, self.registration_count).generate(input_filename)
+
+                for variant in self.variants:
+                    result = self._run_isolated(input_filename, os.path.join(directory, "out.txt"), variant)
+                    result.update({ "functions": size, "registrations_per_registrar": self.registration_count })
+                    results.append(result)
+        finally:
+            shutil.rmtree(directory)
+
+        return results
+
+    def _run_isolated(self, input_filename, output_filename, variant):
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_case, args=(queue, input_filename, output_filename, variant, self.variant_options[variant]))
+        process.start()
+
+        result = queue.get()
+        process.join()
+
+        if ("error" in result):
+            raise RuntimeError("Benchmark variant %s failed: %s" % (variant, result["error"]))
+        return result
+
+def _run_case(queue, input_filename, output_filename, variant, options):
+    try:
+        application = t2src.Application(options)
+        application.cache_directory = None
+        application.main(input_filename, output_filename)
+
+        # The scrape phase covers loading and scanning, but not rendering
+        stats = application.stats
+        scrape_time = stats.find_phase("scrape").wall_time
+        registrations = sum(stats.matches.values())
+        input_bytes = os.path.getsize(input_filename)
+
+        queue.put({
+            "variant": variant,
+            "input_bytes": input_bytes,
+            "registrations": registrations,
+            "phases": [phase.as_dict() for phase in stats.phases],
+            "rejected": stats.rejected,
+            "throughput_mb_s": input_bytes / (1024.0 * 1024.0) / max(scrape_time, 1e-9),
+            "registrations_per_s": registrations / max(scrape_time, 1e-9),
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        })
+    except Exception as error:
+        queue.put({ "error": repr(error) })
+
+def compare(results, baseline, tolerance):
+    """
+        Returns a list of descriptions of every case whose throughput dropped by more than
+        the given fraction compared to the baseline results.
+    """
+    baseline_cases = { }
+    for result in baseline:
+        baseline_cases[(result["functions"], result["registrations_per_registrar"], result["variant"])] = result
+
+    regressions = [ ]
+    for result in results:
+        key = (result["functions"], result["registrations_per_registrar"], result["variant"])
+        if (key not in baseline_cases):
+            continue
+
+        expected = baseline_cases[key]["throughput_mb_s"]
+        if (result["throughput_mb_s"] < expected * (1.0 - tolerance)):
+            regressions.append("%s with %u functions: %.2f MB/s, baseline %.2f MB/s" % (result["variant"], result["functions"], result["throughput_mb_s"], expected))
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the scraper against synthetic decompilations.")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma separated function counts to generate.")
+    parser.add_argument("--registrations", type=int, default=500, help="Registration calls per registrar address.")
+    parser.add_argument("--variants", default=",".join(sorted(Benchmark.variant_options.keys())), help="Comma separated scan variants to run.")
+    parser.add_argument("--output", help="Write the JSON results here rather than to stdout.")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to check for throughput regressions against.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed throughput drop against the baseline, as a fraction.")
+    arguments = parser.parse_args()
+
+    sizes = [int(size) for size in arguments.sizes.split(",")]
+    results = Benchmark(sizes, arguments.registrations, arguments.variants.split(",")).run()
+
+    if (arguments.output is None):
+        print(json.dumps(results, indent=4, sort_keys=True))
+    else:
+        with open(arguments.output, "w") as handle:
+            json.dump(results, handle, indent=4, sort_keys=True)
+
+    if (arguments.baseline is not None):
+        with open(arguments.baseline, "r") as handle:
+            regressions = compare(results, json.load(handle), arguments.tolerance)
+
+        for regression in regressions:
+            sys.stderr.write("Regression: %s\n" % regression)
+        if (len(regressions) != 0):
+            sys.exit(1)
@@ -0,0 +1,242 @@
+"""
+    cache.py
+
+    A persistent cache of scrape results so that unchanged decompilations never
+    have to be scraped twice. Entries are keyed by a hash of the input file
+    together with the registry and type table configuration of the scraper,
+    and hold the fully built scraper pickled to disk, with its results packed
+    into columns by the columnar module. The search index of a scrape is kept
+    next to it under the same key.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import gc
+import hashlib
+import tempfile
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import search
+import scraper
+import columnar
+
+def configuration_digest(scraper_type=scraper.Scraper, engine="regex", source_encoding=None):
+    """
+        Digest of everything besides the input that scrape results depend on: the engine and
+        source encoding along with the registry, argument layout and type tables of the scraper.
+    """
+    return scraper_type.configuration_digest(engine, source_encoding)
+
+class ScrapeCache(object):
+    """
+        A directory of pickled scrape results. Entries are named after the content
+        digest of their input followed by the configuration digest, and are evicted
+        least recently used first once the directory grows beyond max_bytes.
+    """
+    directory = None
+    max_bytes = None
+
+    entry_extension = ".scrape"
+
+    _stat_index_name = "stat_index"
+    """
+        Name of the file that maps input paths to their size, modification time and
+        content digest, so unchanged inputs don't have to be hashed on every run.
+    """
+
+    _hash_chunk_size = 1 << 20
+
+    def __init__(self, directory=".scrape_cache", max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+    def scrape(self, filename, scraper_type=scraper.Scraper, **scraper_options):
+        """
+            Returns the cached scrape of the given file if there is a valid one, otherwise
+            the file is scraped with the given options and the result is stored. When given a
+            ScrapeStats, the lookup is recorded in it as a cache_hit or cache_miss phase.
+        """
+        key = self.key(filename, scraper_type, scraper_options.get("engine", "regex"), scraper_options.get("source_encoding"))
+
+        # Hits never run the scraper, so the stats would otherwise show no sign of the scrape at all
+        stats = scraper_options.get("stats")
+        if (stats is None):
+            result = self.load(key)
+        else:
+            with stats.phase("cache_lookup") as phase:
+                result = self.load(key)
+
+            phase.name = "cache_miss" if result is None else "cache_hit"
+
+        if (result is None):
+            result = scraper_type(filename, **scraper_options)
+            self.store(key, result)
+
+        return result
+
+    def search_index(self, filename, scraper_type=scraper.Scraper, scrape=None, **scraper_options):
+        """
+            Returns the cached search index of the scrape of the given file. If there isn't one
+            it's built from the given scrape, or the cached scrape of the file if none is given.
+        """
+        key = self.key(filename, scraper_type, scraper_options.get("engine", "regex"), scraper_options.get("source_encoding"))
+
+        payload = self._load_entry(key + search.SearchIndex.extension)
+        if (payload is not None):
+            try:
+                return search.SearchIndex.from_payload(payload)
+            except (ValueError, KeyError, AttributeError):
+                pass
+
+        if (scrape is None):
+            scrape = self.scrape(filename, scraper_type, **scraper_options)
+
+        result = search.SearchIndex.from_scrape(scrape)
+        self._write_atomic(key + search.SearchIndex.extension, result.as_payload())
+        self._evict()
+
+        return result
+
+    def key(self, filename, scraper_type=scraper.Scraper, engine="regex", source_encoding=None):
+        """
+            Builds the cache key for a given input file. Engines are part of the configuration
+            because they differ in how they cope with malformed registrations.
+        """
+        return "%s-%s" % (self.content_digest(filename), configuration_digest(scraper_type, engine, source_encoding))
+
+    def content_digest(self, filename):
+        filename = os.path.abspath(filename)
+        stat = os.stat(filename)
+
+        stat_index = self._load_stat_index()
+        if (filename in stat_index):
+            size, modification_time, digest = stat_index[filename]
+
+            if (size == stat.st_size and modification_time == stat.st_mtime):
+                return digest
+
+        digest = hashlib.sha1()
+        with open(filename, "rb") as handle:
+            chunk = handle.read(self._hash_chunk_size)
+            while (len(chunk) != 0):
+                digest.update(chunk)
+                chunk = handle.read(self._hash_chunk_size)
+
+        digest = digest.hexdigest()
+        stat_index[filename] = (stat.st_size, stat.st_mtime, digest)
+        self._write_atomic(self._stat_index_name, stat_index)
+
+        return digest
+
+    def load(self, key):
+        packed = self._load_entry(key + self.entry_extension)
+        if (not isinstance(packed, columnar.PackedScrape)):
+            # Older revisions pickled the scraper as it is
+            if (packed is not None):
+                self._remove_entry(key + self.entry_extension)
+            return None
+
+        return packed.unpack()
+
+    def store(self, key, result):
+        self._write_atomic(key + self.entry_extension, columnar.PackedScrape(result))
+        self._evict()
+
+    def invalidate(self, filename=None):
+        """
+            Drops every cached result for the given input file, whatever configuration it was
+            scraped with. If no file is given then the whole cache is cleared.
+        """
+        if (filename is None):
+            for entry_name in os.listdir(self.directory):
+                os.remove(os.path.join(self.directory, entry_name))
+            return
+
+        filename = os.path.abspath(filename)
+
+        stat_index = self._load_stat_index()
+        if (filename not in stat_index):
+            return
+
+        digest = stat_index.pop(filename)[2]
+        self._write_atomic(self._stat_index_name, stat_index)
+
+        for entry_name in self._entry_names():
+            if (entry_name.startswith(digest + "-")):
+                os.remove(os.path.join(self.directory, entry_name))
+
+    # Helper Functions
+    def _load_entry(self, entry_name):
+        entry_path = os.path.join(self.directory, entry_name)
+
+        # The collector would otherwise repeatedly walk the object graph while it is being rebuilt
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            with open(entry_path, "rb") as handle:
+                result = pickle.load(handle)
+        except (IOError, OSError):
+            return None
+        except (EOFError, pickle.UnpicklingError, AttributeError, ImportError, TypeError, ValueError, IndexError, KeyError):
+            # Truncated, or pickled by a revision of the classes that no longer matches them,
+            # so drop it and let the caller scrape again
+            self._remove_entry(entry_name)
+            return None
+        finally:
+            if (gc_enabled):
+                gc.enable()
+
+        # Mark the entry as recently used for eviction purposes
+        os.utime(entry_path, None)
+        return result
+
+    def _remove_entry(self, entry_name):
+        try:
+            os.remove(os.path.join(self.directory, entry_name))
+        except OSError:
+            # Another run may have replaced or removed it already
+            pass
+
+    def _entry_names(self):
+        return [entry_name for entry_name in os.listdir(self.directory) if entry_name.endswith((self.entry_extension, search.SearchIndex.extension))]
+
+    def _evict(self):
+        entries = [ ]
+        for entry_name in self._entry_names():
+            entry_stat = os.stat(os.path.join(self.directory, entry_name))
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry_name))
+
+        # Oldest first, but never evict the only entry we have
+        entries.sort()
+        total_size = sum(entry_size for entry_time, entry_size, entry_name in entries)
+
+        while (total_size > self.max_bytes and len(entries) > 1):
+            entry_time, entry_size, entry_name = entries.pop(0)
+            os.remove(os.path.join(self.directory, entry_name))
+            total_size = total_size - entry_size
+
+    def _load_stat_index(self):
+        try:
+            with open(os.path.join(self.directory, self._stat_index_name), "rb") as handle:
+                return pickle.load(handle)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return { }
+
+    def _write_atomic(self, name, payload):
+        # Write to a temporary file first so concurrent runs never read a partial entry
+        handle, temporary_path = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(handle, "wb") as handle:
+            pickle.dump(payload, handle, pickle.HIGHEST_PROTOCOL)
+
+        os.rename(temporary_path, os.path.join(self.directory, name))
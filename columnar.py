@@ -0,0 +1,344 @@
+"""
+    columnar.py
+
+    A compact, column oriented store for scrape results. Rather than keeping an
+    object per function, global value and datablock property, every field is
+    kept in a column of its own: names are interned, addresses and argument
+    counts are packed into arrays and descriptions share a single string table.
+    The scrape cache stores its entries in this form.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import array
+
+try:
+    from itertools import izip as zip
+except ImportError:
+    pass
+
+try:
+    intern
+except NameError:
+    from sys import intern
+
+import scraper
+
+class Column(object):
+    """
+        Base column type. Values the packed representation of a column can't hold
+        exactly (such as None) are kept in the overflow dictionary by row instead, so
+        every column gives back precisely what was put into it.
+    """
+    overflow = None
+
+    def __init__(self):
+        self.overflow = { }
+
+    def __getitem__(self, row):
+        if (row in self.overflow):
+            return self.overflow[row]
+        return self._unpack(row)
+
+    def __iter__(self):
+        if (len(self.overflow) == 0):
+            return self._iterate()
+        return (self[row] for row in range(len(self)))
+
+    def freeze(self):
+        """
+            Called once all rows have been appended.
+        """
+        pass
+
+    def _iterate(self):
+        return (self._unpack(row) for row in range(len(self)))
+
+class NameColumn(Column):
+    """
+        Names repeat a lot (type names especially) so they're interned and shared.
+    """
+    values = None
+
+    def __init__(self):
+        Column.__init__(self)
+        self.values = [ ]
+
+    def append(self, value):
+        if (isinstance(value, str)):
+            value = intern(value)
+        self.values.append(value)
+
+    def _unpack(self, row):
+        return self.values[row]
+
+    def _iterate(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+class IntegerColumn(Column):
+    values = None
+
+    def __init__(self):
+        Column.__init__(self)
+        self.values = array.array("l")
+
+    def append(self, value):
+        if (type(value) is int):
+            self.values.append(value)
+        else:
+            self.overflow[len(self.values)] = value
+            self.values.append(0)
+
+    def _unpack(self, row):
+        return self.values[row]
+
+    def _iterate(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+class AddressColumn(IntegerColumn):
+    """
+        Addresses are scraped as hexadecimal text but stored as integers. Anything that
+        doesn't come back out as the same text is overflowed.
+    """
+    def __init__(self):
+        Column.__init__(self)
+        self.values = array.array("L")
+
+    def append(self, value):
+        try:
+            packed = int(value, 16)
+            if ("%X" % packed == value):
+                self.values.append(packed)
+                return
+        except (TypeError, ValueError):
+            pass
+
+        self.overflow[len(self.values)] = value
+        self.values.append(0)
+
+    def _unpack(self, row):
+        return "%X" % self.values[row]
+
+    def _iterate(self):
+        return ("%X" % value for value in self.values)
+
+class TextColumn(Column):
+    """
+        Every value is concatenated into one string table, with each row holding the end
+        offset of its value.
+    """
+    text = None
+    offsets = None
+
+    _parts = None
+
+    def __init__(self):
+        Column.__init__(self)
+        self.text = ""
+        self.offsets = array.array("L")
+        self._parts = [ ]
+
+    def append(self, value):
+        if (not isinstance(value, str)):
+            self.overflow[len(self._parts)] = value
+            value = ""
+
+        self._parts.append(value)
+
+    def freeze(self):
+        end = 0
+        for part in self._parts:
+            end = end + len(part)
+            self.offsets.append(end)
+
+        self.text = "".join(self._parts)
+        self._parts = None
+
+    def _unpack(self, row):
+        start = 0
+        if (row != 0):
+            start = self.offsets[row - 1]
+        return self.text[start:self.offsets[row]]
+
+    def __len__(self):
+        if (self._parts is not None):
+            return len(self._parts)
+        return len(self.offsets)
+
+class ColumnTable(object):
+    """
+        A table of rows spread over one column per field.
+    """
+    fields = None
+    columns = None
+
+    def __init__(self, fields):
+        """
+            Fields are a sequence of (name, column type) tuples.
+        """
+        self.fields = tuple(field_name for field_name, column_type in fields)
+        self.columns = tuple(column_type() for field_name, column_type in fields)
+
+    def append(self, row):
+        for column, value in zip(self.columns, row):
+            column.append(value)
+
+    def freeze(self):
+        for column in self.columns:
+            column.freeze()
+
+    def row(self, index):
+        return tuple(column[index] for column in self.columns)
+
+    def rows(self):
+        return zip(*self.columns)
+
+    def column(self, field_name):
+        return self.columns[self.fields.index(field_name)]
+
+    def __len__(self):
+        return len(self.columns[0])
+
+class ColumnarScrape(object):
+    """
+        The results of a scraper held in column tables. Global functions come first in the
+        function table, followed by the type methods grouped by type.
+    """
+    functions = None
+    values = None
+    properties = None
+
+    global_function_rows = 0
+
+    global_function_count = 0
+    type_function_total = 0
+
+    function_fields = (("type_name", NameColumn), ("address", AddressColumn), ("name", NameColumn),
+        ("description", TextColumn), ("min_args", IntegerColumn), ("max_args", IntegerColumn))
+
+    # Global value addresses aren't always scraped as hexadecimal text, so they're kept as plain values
+    value_fields = (("name", NameColumn), ("address", NameColumn), ("type_name", IntegerColumn))
+
+    property_fields = (("datablock", NameColumn), ("name", NameColumn), ("address", AddressColumn), ("type_name", NameColumn))
+
+    def __init__(self):
+        self.functions = ColumnTable(self.function_fields)
+        self.values = ColumnTable(self.value_fields)
+        self.properties = ColumnTable(self.property_fields)
+
+    @classmethod
+    def from_scraper(cls, scrape):
+        result = cls()
+        result.global_function_count = scrape.global_function_count
+        result.type_function_total = scrape.type_function_total
+
+        for global_function in scrape.global_functions:
+            result.functions.append((global_function.type_name, global_function.address, global_function.name,
+                global_function.description, global_function.min_args, global_function.max_args))
+        result.global_function_rows = len(scrape.global_functions)
+
+        # Type methods are already stored as rows in the same layout
+        for type_name in scrape.type_methods:
+            for type_method in scrape.type_methods[type_name]:
+                result.functions.append(type_method)
+
+        for global_value in scrape.global_values:
+            result.values.append((global_value.name, global_value.address, global_value.type_name))
+
+        for datablock_type in scrape.datablocks:
+            for datablock_property in scrape.datablocks[datablock_type].properties.values():
+                result.properties.append((datablock_type, datablock_property.name, datablock_property.address, datablock_property.type_name))
+
+        result.functions.freeze()
+        result.values.freeze()
+        result.properties.freeze()
+
+        return result
+
+    def global_functions(self):
+        """
+            Materializes the global functions back into scraper.Function objects.
+        """
+        function_rows = self.functions.rows()
+
+        for index in range(self.global_function_rows):
+            type_name, address, name, description, min_args, max_args = next(function_rows)
+            yield scraper.Function(name, address, type_name, description, min_args, max_args)
+
+    def type_method_rows(self):
+        """
+            Iterates every type method as a (typename, addr, name, desc, minArgs, maxArgs) tuple,
+            the same layout as Scraper.type_methods uses.
+        """
+        function_rows = self.functions.rows()
+
+        for index in range(self.global_function_rows):
+            next(function_rows)
+
+        return function_rows
+
+    def type_methods(self):
+        result = { }
+        for type_method in self.type_method_rows():
+            result.setdefault(type_method[0], [])
+            result[type_method[0]].append(type_method)
+
+        return result
+
+    def global_values(self):
+        return [scraper.GlobalVariable(name, address, type_name) for name, address, type_name in self.values.rows()]
+
+    def datablocks(self):
+        result = { }
+        for datablock_type, name, address, type_name in self.properties.rows():
+            if (datablock_type not in result):
+                result[datablock_type] = scraper.Datablock(datablock_type)
+
+            result[datablock_type].properties[name] = scraper.Datablock.Property(name, address, type_name)
+
+        return result
+
+class PackedScrape(object):
+    """
+        A scraper with its results held in a ColumnarScrape, which is the form scrapes are
+        cached in. It pickles to about half the size of the scraper with an object per
+        result and is quicker to write out, while reading it back costs about the same.
+    """
+    scraper_type = None
+    columns = None
+    state = None
+    """
+        Everything else the scraper holds, such as its counts, function index and blocks.
+    """
+
+    output_names = ("global_functions", "type_methods", "global_values", "datablocks")
+
+    def __init__(self, scrape):
+        # The buffer of a lazy scrape can't be kept, so finish scanning it first
+        scrape.scrape_all()
+
+        self.scraper_type = type(scrape)
+        self.columns = ColumnarScrape.from_scraper(scrape)
+        self.state = dict((name, value) for name, value in scrape.__dict__.items() if name not in self.output_names)
+
+    def unpack(self):
+        """
+            Rebuilds the scraper the results were packed from.
+        """
+        result = self.scraper_type.__new__(self.scraper_type)
+        result.__dict__.update(self.state)
+
+        result.global_functions = list(self.columns.global_functions())
+        result.type_methods = self.columns.type_methods()
+        result.global_values = self.columns.global_values()
+        result.datablocks = self.columns.datablocks()
+
+        return result
@@ -0,0 +1,449 @@
+"""
+    daemon.py
+
+    A long running query server for editor plugins and script linters, which
+    would otherwise pay for a whole scrape every time they want to know
+    whether a method exists. The scrape and its query indexes are kept in
+    memory and queries are answered over a Unix socket or a localhost TCP
+    port, a thread per connection.
+
+    The input file and the scraper's registry tables, or the registration
+    profile they're loaded from, are watched in the background. When either
+    changes, the scrape is rebuilt in the background
+    thread while queries are still answered from the old one, which is then
+    swapped out for the new one in a single assignment.
+
+    Requests and responses are JSON, one per line. A request is either a
+    single query object or a list of them, answered with a list of results
+    in the same order:
+
+        {"op": "method", "type": "ShapeBase", "name": "getDamageLevel"}
+        {"op": "search", "query": "\"damage level\" get*", "limit": 10}
+
+    A query that is invalid or fails is answered with an "error" of its own,
+    leaving the other queries of the request unaffected.
+
+    Names and descriptions are scraped as bytes. An answer holding any that
+    aren't valid UTF-8 carries a "string_encoding" of latin-1, which they were
+    decoded with; export.native_strings gives back the original bytes.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+try:
+    _string_types = (str, unicode)
+except NameError:
+    _string_types = (str, )
+
+import cache
+import query
+import export
+import search
+import scraper
+import profiles
+
+query_operations = {
+    "named": ("name", ),
+    "at_address": ("address", ),
+    "global_function": ("name", ),
+    "method": ("type", "name"),
+    "methods": ("type", ),
+    "types": ( ),
+    "with_prefix": ("prefix", ),
+    "global_value_at": ("address", ),
+    "search": ("query", ),
+    "status": ( ),
+}
+"""
+    The query operations answered by the daemon and the fields each one requires. They're
+    named after, and answered by, the methods of query.ScrapeQuery. with_prefix also takes
+    an optional "type" to search within. search is a full text search of the names and
+    descriptions, answered by search.SearchIndex, and also takes an optional "limit" and
+    "kind".
+"""
+
+query_string_fields = ("op", "name", "address", "type", "prefix", "query", "kind")
+"""
+    Fields of a query that have to be strings when given. The optional "type" of with_prefix
+    and "kind" of search may also be null, the former searching global functions.
+"""
+
+class QueryIndex(object):
+    """
+        A single generation of the daemon's state: the scrape, its query indexes and what it
+        was built from. These are never modified once built; a rebuild makes a new one.
+    """
+    generation = None
+    scrape = None
+    query = None
+    search = None
+
+    input_signature = None
+    configuration = None
+
+    build_time = None
+    built_at = None
+
+    def __init__(self, generation, scrape, search_index, input_signature, configuration, build_time):
+        self.generation = generation
+        self.scrape = scrape
+        self.query = query.ScrapeQuery(scrape)
+        self.search = search_index
+
+        self.input_signature = input_signature
+        self.configuration = configuration
+
+        self.build_time = build_time
+        self.built_at = time.time()
+
+class QueryDaemon(object):
+    """
+        Holds the current QueryIndex of an input file and answers queries against it. Call
+        load to build the first index, start_watching to rebuild it whenever the input or the
+        registry tables change, and serve to answer queries over a socket.
+    """
+    input_filename = None
+    scraper_type = None
+    profile_filename = None
+    """
+        When set, the scraper type is compiled from the registration profile in this file,
+        which is loaded again on every check so edits to it are picked up.
+    """
+
+    scraper_options = None
+    cache_directory = None
+    watched_files = None
+
+    poll_interval = 1.0
+    """
+        Seconds between checks of the input and the registry tables.
+    """
+
+    index = None
+    """
+        The current QueryIndex. Queries read it once and use that generation throughout, so
+        replacing it never affects a query already underway.
+    """
+
+    last_error = None
+    """
+        The error the last rebuild failed with, if it did. The previous index is kept.
+    """
+
+    _rebuild_lock = None
+    _stopped = None
+    _failed_build = None
+
+    def __init__(self, input_filename, scraper_options=None, cache_directory=None, watched_files=None, scraper_type=scraper.Scraper):
+        """
+            watched_files are any further files whose changes should trigger a rebuild, such as
+            the data files registry tables are loaded from.
+        """
+        self.input_filename = input_filename
+        self.scraper_type = scraper_type
+        self.scraper_options = { } if scraper_options is None else scraper_options
+        self.cache_directory = cache_directory
+        self.watched_files = [ ] if watched_files is None else list(watched_files)
+
+        self._rebuild_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def load(self):
+        """
+            Builds a new index if the input or registry tables changed since the last one, or if
+            there isn't one yet. Returns True if the index was replaced.
+        """
+        with self._rebuild_lock:
+            if (self.profile_filename is not None):
+                self.scraper_type = profiles.scraper_type(self.profile_filename)
+
+            input_signature = self._input_signature()
+            configuration = cache.configuration_digest(self.scraper_type, self.scraper_options.get("engine", "regex"), self.scraper_options.get("source_encoding"))
+
+            current = self.index
+            if (current is not None and current.input_signature == input_signature and current.configuration == configuration):
+                return False
+            if (self._failed_build == (input_signature, configuration)):
+                return False
+
+            start_time = time.time()
+            try:
+                if (self.cache_directory is None):
+                    scrape = self.scraper_type(self.input_filename, **self.scraper_options)
+                    search_index = search.SearchIndex.from_scrape(scrape)
+                else:
+                    scrape_cache = cache.ScrapeCache(self.cache_directory)
+                    scrape = scrape_cache.scrape(self.input_filename, self.scraper_type, **self.scraper_options)
+                    search_index = scrape_cache.search_index(self.input_filename, self.scraper_type, scrape, **self.scraper_options)
+            except Exception:
+                # Don't retry the same build over and over, wait for something to change
+                self._failed_build = (input_signature, configuration)
+                raise
+
+            self._failed_build = None
+
+            generation = 1 if current is None else current.generation + 1
+            self.index = QueryIndex(generation, scrape, search_index, input_signature, configuration, time.time() - start_time)
+            return True
+
+    def start_watching(self):
+        """
+            Starts the background thread rebuilding the index whenever something changed.
+        """
+        watcher = threading.Thread(target=self._watch)
+        watcher.daemon = True
+        watcher.start()
+
+        return watcher
+
+    def stop(self):
+        self._stopped.set()
+
+    def answer(self, request):
+        """
+            Answers a single query or a list of them. Every query is answered by a dictionary
+            holding either its "result" or an "error".
+        """
+        index = self.index
+
+        if (isinstance(request, list)):
+            return [self._answer_query(index, query_request) for query_request in request]
+        return self._answer_query(index, request)
+
+    def serve(self, address):
+        """
+            Answers queries until interrupted. A string address is the path of a Unix socket,
+            a (host, port) tuple a TCP address.
+        """
+        if (isinstance(address, tuple)):
+            server = _TCPQueryServer(address, _QueryHandler)
+        else:
+            if (os.path.exists(address)):
+                os.remove(address)
+            server = _UnixQueryServer(address, _QueryHandler)
+
+        server.query_daemon = self
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if (not isinstance(address, tuple) and os.path.exists(address)):
+                os.remove(address)
+
+    # Helper Functions
+    def _watch(self):
+        while (not self._stopped.wait(self.poll_interval)):
+            try:
+                self.load()
+                self.last_error = None
+            except Exception as error:
+                # Keep answering from the previous index; the next change may well fix it
+                self.last_error = repr(error)
+
+    def _input_signature(self):
+        signature = [ ]
+        for filename in [self.input_filename] + self.watched_files:
+            try:
+                stat = os.stat(filename)
+                signature.append((filename, stat.st_size, stat.st_mtime))
+            except OSError:
+                signature.append((filename, None, None))
+
+        return tuple(signature)
+
+    def _answer_query(self, index, query_request):
+        if (not isinstance(query_request, dict) or not isinstance(query_request.get("op"), _string_types) or query_request["op"] not in query_operations):
+            return { "error": "Unknown query operation" }
+
+        operation = query_request["op"]
+        for field in query_operations[operation]:
+            if (field not in query_request):
+                return { "error": "Query %s requires %s" % (operation, field) }
+
+        for field in query_string_fields:
+            if (field in query_request and not isinstance(query_request[field], _string_types)):
+                if (query_request[field] is not None or field not in ("type", "kind")):
+                    return { "error": "The %s of query %s has to be a string" % (field, operation) }
+
+        limit = query_request.get("limit", 20)
+        if (not isinstance(limit, int) or isinstance(limit, bool)):
+            return { "error": "The limit of query %s has to be an integer" % operation }
+
+        try:
+            return self._run_query(index, operation, query_request)
+        except Exception as error:
+            # Only this query failed, the others of the request and the connection carry on
+            return { "error": "Query %s failed: %s" % (operation, error) }
+
+    def _run_query(self, index, operation, query_request):
+        if (operation == "status"):
+            return { "result": self._status(index) }
+        if (index is None):
+            return { "error": "No scrape has been loaded yet" }
+
+        if (operation == "search"):
+            hits = index.search.search(query_request["query"], query_request.get("limit", 20), query_request.get("kind"))
+            return { "result": [hit.as_dict() for hit in hits] }
+
+        arguments = [query_request[field] for field in query_operations[operation]]
+        if (operation == "with_prefix" and "type" in query_request):
+            arguments.append(query_request["type"])
+
+        return { "result": _serialize(getattr(index.query, operation)(*arguments)) }
+
+    def _status(self, index):
+        result = { "input": self.input_filename, "last_error": self.last_error }
+
+        if (index is not None):
+            result.update({
+                "generation": index.generation,
+                "build_time": index.build_time,
+                "built_at": index.built_at,
+                "functions": len(index.query.functions),
+                "global_values": len(index.query.global_values),
+            })
+
+        return result
+
+def request(address, queries, timeout=None):
+    """
+        Sends a query or a list of queries to a daemon listening at the given address and
+        returns the answer.
+    """
+    if (isinstance(address, tuple)):
+        connection = socket.create_connection(address, timeout)
+    else:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.settimeout(timeout)
+        connection.connect(address)
+
+    try:
+        connection.sendall(json.dumps(queries) + "\n")
+
+        handle = connection.makefile("r")
+        try:
+            return json.loads(handle.readline())
+        finally:
+            handle.close()
+    finally:
+        connection.close()
+
+class _QueryHandler(socketserver.StreamRequestHandler):
+    """
+        Answers every line of a connection until the client closes it, so clients can keep a
+        connection open for as many requests as they like.
+    """
+    def handle(self):
+        for line in self.rfile:
+            if (line.strip() == ""):
+                continue
+
+            # Only the parsing is guarded here, errors answering queries are reported per query
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = { "error": "Malformed request" }
+            else:
+                response = self.server.query_daemon.answer(request)
+
+            try:
+                response_line = json.dumps(_encode_response(response)) + "\n"
+            except (TypeError, ValueError) as error:
+                response_line = json.dumps({ "error": "Couldn't encode the answer: %s" % error }) + "\n"
+
+            try:
+                self.wfile.write(response_line)
+                self.wfile.flush()
+            except (IOError, socket.error):
+                # The client went away, there's nobody left to answer
+                return
+
+class _UnixQueryServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class _TCPQueryServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+def _serialize(result):
+    if (isinstance(result, list)):
+        return [_serialize(entry) for entry in result]
+    elif (isinstance(result, scraper.Function)):
+        return {
+            "name": result.name,
+            "address": result.address,
+            "type_name": result.type_name,
+            "description": result.description,
+            "min_args": result.min_args,
+            "max_args": result.max_args,
+        }
+    elif (isinstance(result, scraper.GlobalVariable)):
+        return { "name": result.name, "address": result.address, "type_name": result.type_name }
+
+    return result
+
+def _encode_response(response):
+    # Answers to a list of queries are encoded one by one, so only those that need it carry an encoding
+    if (isinstance(response, list)):
+        return [_encode_response(entry) for entry in response]
+
+    encoding = export.string_encoding([response])
+
+    result = export.text_strings(response, encoding)
+    if (encoding != "utf-8"):
+        result["string_encoding"] = encoding
+    return result
+
+def _address(arguments):
+    if (arguments.socket is not None):
+        return arguments.socket
+    return ("127.0.0.1", arguments.port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keeps a scrape in memory and answers queries against it over a socket.")
+    parser.add_argument("--socket", help="Listen on, or connect to, this Unix socket.")
+    parser.add_argument("--port", type=int, default=28000, help="Listen on, or connect to, this localhost port when no socket is given.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="Run the daemon.")
+    serve_parser.add_argument("input", help="The decompiled executable to scrape.")
+    serve_parser.add_argument("--engine", choices=scraper.Scraper.scan_engines, default="regex", help="The scan engine to scrape with.")
+    serve_parser.add_argument("--profile", metavar="FILENAME", help="Scrape with the registration tables of this profile rather than those of Tribes 2.")
+    serve_parser.add_argument("--cache", metavar="DIRECTORY", help="Cache scrape results in this directory.")
+    serve_parser.add_argument("--watch", action="append", default=[ ], metavar="FILENAME", help="Also rebuild when this file changes.")
+    serve_parser.add_argument("--poll-interval", type=float, default=QueryDaemon.poll_interval, help="Seconds between checks for changes.")
+
+    query_parser = subparsers.add_parser("query", help="Send a JSON query, or list of queries, to a running daemon.")
+    query_parser.add_argument("queries", help="The JSON to send.")
+    arguments = parser.parse_args()
+
+    if (arguments.command == "serve"):
+        daemon = QueryDaemon(arguments.input, { "engine": arguments.engine }, arguments.cache, arguments.watch)
+        daemon.poll_interval = arguments.poll_interval
+        daemon.profile_filename = arguments.profile
+
+        daemon.load()
+        sys.stderr.write("Loaded %s in %f seconds\n" % (arguments.input, daemon.index.build_time))
+
+        daemon.start_watching()
+        try:
+            daemon.serve(_address(arguments))
+        except KeyboardInterrupt:
+            daemon.stop()
+    else:
+        print(json.dumps(request(_address(arguments), json.loads(arguments.queries)), indent=4, sort_keys=True))
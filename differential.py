@@ -0,0 +1,437 @@
+"""
+    differential.py
+
+    A differential correctness harness for the scan engines and modes. It
+    generates randomised synthetic decompilations, each stressing one
+    adversarial shape of registration call the scrapers have to cope with,
+    scrapes every one of them with the legacy regex Scraper and with every
+    alternative engine and mode, and reports what each found differently
+    along with how long it took compared to the legacy Scraper.
+
+    Engines are allowed to differ from the legacy Scraper where it has to
+    guess: it drops descriptions it can't split, for instance, where the
+    other engines parse them. Those differences are reported but don't fail
+    a run. Modes (mapping, byte reads, lazy scanning, parallel scanning,
+    streaming and block tracking) may never change the results of their
+    engine, so any difference there, or an error the engine didn't raise on
+    its own, fails the run.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import shutil
+import argparse
+import tempfile
+
+import batch
+import scraper
+import benchmark
+
+shapes = (
+    "plain",
+    "uncast_description",
+    "nested_parentheses",
+    "separators",
+    "escaped_quotes",
+    "hexadecimal_counts",
+    "variable_counts",
+    "truncated",
+    "multiline",
+    "sky",
+    "decoys",
+    "unknown_datablock_callers",
+)
+"""
+    The adversarial shapes of registration calls. Every case mixes calls of one shape in
+    with plain ones, so a shape the legacy Scraper can't survive only costs its own cases:
+
+        plain                       registrations as the benchmark writes them
+        uncast_description          descriptions passed without an (int) cast
+        nested_parentheses          descriptions holding nested parentheses
+        separators                  descriptions holding semicolons, commas and braces
+        escaped_quotes              descriptions holding escaped quotes
+        hexadecimal_counts          argument counts written in hexadecimal
+        variable_counts             argument counts held in variables
+        truncated                   calls missing their last arguments
+        multiline                   calls with an argument per line
+        sky                         type and field names passed as (int)&off_7957AC
+        decoys                      registration calls within string literals and comments
+        unknown_datablock_callers   datablock fields registered by unknown initialisers
+"""
+
+class AdversarialGenerator(benchmark.DecompilationGenerator):
+    """
+        Writes out a synthetic decompilation like the benchmark's, with a share of its
+        registration calls bent into the given shape.
+    """
+    shape = None
+
+    shape_share = 0.3
+    """
+        The fraction of registrations written in the shape of the case.
+    """
+
+    def __init__(self, shape, function_count, registration_count, datablock_field_count=None, seed=0):
+        if (shape not in shapes):
+            raise ValueError("Unknown shape: %s" % shape)
+
+        benchmark.DecompilationGenerator.__init__(self, function_count, registration_count, datablock_field_count, seed)
+        self.shape = shape
+
+    # Helper Functions
+    def _datablock_callers(self, generator):
+        callers = benchmark.DecompilationGenerator._datablock_callers(self, generator)
+
+        if (self.shape == "unknown_datablock_callers"):
+            # Somewhere past the generated functions, so they never collide with one
+            callers = callers + ["%X" % (0x800000 + generator.randrange(0x10000) * 0x10) for caller in range(4)]
+        return callers
+
+    def _datablock_registration(self, generator, field):
+        arguments = ["\"field%u\"" % field, "%u" % generator.randrange(12), "%u" % (field * 4), "1", "0"]
+        if (self._shaped(generator) and self.shape in ("sky", "truncated", "multiline", "decoys")):
+            arguments = self._shape_arguments(generator, arguments, None, None)
+
+        return self._call(generator, scraper.Scraper._datablock_property_registry[0], arguments)
+
+    def _registration(self, generator, registrar):
+        name = "%s%s%u" % (generator.choice(self.name_prefixes), generator.choice(self.name_nouns), generator.randrange(100000))
+        implementation = 0x500000 + generator.randrange(0x100000)
+
+        if (registrar in scraper.Scraper._global_function_registry):
+            arguments = ["\"%s\"" % name, "(int)sub_%X" % implementation, "(int)\"%s\"" % (generator.choice(self.description_templates) % name),
+                "1", "%u" % generator.randrange(1, 6)]
+            description_index, count_index = 2, 3
+        elif (registrar in scraper.Scraper._type_function_registry):
+            type_name = generator.choice(sorted(scraper.Scraper.type_name_inheritance.keys()))
+            arguments = ["v1", "\"%s\"" % type_name, "\"%s\"" % name, "(int)sub_%X" % implementation,
+                "(int)\"%s\"" % (generator.choice(self.description_templates) % name), "2", "%u" % generator.randrange(2, 7)]
+            description_index, count_index = 4, 5
+        else:
+            arguments = ["\"%s\"" % name, "%u" % generator.choice([1, 3, 5]), "&dword_%X" % (0x7A0000 + generator.randrange(0x10000) * 4)]
+            description_index, count_index = None, None
+
+        if (self._shaped(generator)):
+            arguments = self._shape_arguments(generator, arguments, description_index, count_index)
+
+        return self._call(generator, registrar, arguments)
+
+    def _shaped(self, generator):
+        return self.shape != "plain" and generator.random() < self.shape_share
+
+    def _shape_arguments(self, generator, arguments, description_index, count_index):
+        arguments = list(arguments)
+        name = arguments[0] if len(arguments) != 7 else arguments[2]
+
+        if (description_index is not None):
+            description = None
+            if (self.shape == "uncast_description"):
+                arguments[description_index] = arguments[description_index].replace("(int)", "", 1)
+            elif (self.shape == "nested_parentheses"):
+                description = "%s(%%obj, (a, (b))) returns (x)" % name.strip("\"")
+            elif (self.shape == "separators"):
+                description = "%s; returns a, b; {c, d}" % name.strip("\"")
+            elif (self.shape == "escaped_quotes"):
+                description = "%s(\\\"a, b\\\"); \\\"quoted\\\"" % name.strip("\"")
+
+            if (description is not None):
+                arguments[description_index] = "(int)\"%s\"" % description
+
+        if (count_index is not None):
+            if (self.shape == "hexadecimal_counts"):
+                arguments[count_index] = "0x%X" % int(arguments[count_index])
+                arguments[count_index + 1] = "0x%X" % int(arguments[count_index + 1])
+            elif (self.shape == "variable_counts"):
+                arguments[count_index + 1] = "v2"
+
+        if (self.shape == "sky"):
+            # Type methods take the type name before the method name, everything else the name first
+            arguments[1 if len(arguments) == 7 else 0] = "(int)&off_7957AC"
+        elif (self.shape == "truncated"):
+            arguments = arguments[:-2]
+
+        return arguments
+
+    def _call(self, generator, registrar, arguments):
+        separator = ", "
+        if (self.shape == "multiline" and generator.random() < self.shape_share):
+            separator = ",\r\n    "
+
+        call = "  sub_%s(%s);" % (registrar, separator.join(arguments))
+        if (self.shape != "decoys" or generator.random() >= self.shape_share):
+            return call
+
+        decoy = call.strip().replace("\\", "\\\\").replace("\"", "\\\"")
+        if (generator.random() < 0.5):
+            return "  sub_%X(v1, \"%s\");\r\n%s" % (0x500000 + generator.randrange(0x10000), decoy, call)
+        return "  // %s\r\n%s" % (call.strip(), call)
+
+class DifferentialHarness(object):
+    """
+        Runs every variant against the legacy Scraper on generated cases. Every variant is a
+        dictionary of Scraper options; the variant scraping with the same engine and no other
+        options is the baseline its mode is held to.
+    """
+    variants = None
+    seeds = None
+    shapes = None
+    function_count = None
+    registration_count = None
+
+    keep_directory = None
+    """
+        When set, the input of every case that failed or differed from the legacy Scraper is
+        copied here, named after its shape and seed, so it can be reproduced.
+    """
+
+    variant_options = {
+        "regex_mmap": { "engine": "regex", "use_mmap": True },
+        "regex_bytes": { "engine": "regex", "use_bytes": True },
+        "regex_lazy": { "engine": "regex", "lazy": True },
+        "regex_parallel": { "engine": "regex", "processes": 2 },
+        "regex_blocks": { "engine": "regex", "track_blocks": True },
+        "regex_stream": { "engine": "regex", "memory_limit": 1 << 20 },
+        "single_pass": { "engine": "single_pass" },
+        "single_pass_mmap": { "engine": "single_pass", "use_mmap": True },
+        "single_pass_bytes": { "engine": "single_pass", "use_bytes": True },
+        "single_pass_lazy": { "engine": "single_pass", "lazy": True },
+        "single_pass_parallel": { "engine": "single_pass", "processes": 2 },
+        "single_pass_stream": { "engine": "single_pass", "memory_limit": 1 << 20 },
+        "call_index": { "engine": "call_index" },
+        "call_index_mmap": { "engine": "call_index", "use_mmap": True },
+        "call_index_bytes": { "engine": "call_index", "use_bytes": True },
+        "call_index_lazy": { "engine": "call_index", "lazy": True },
+        "call_index_parallel": { "engine": "call_index", "processes": 2 },
+        "call_index_stream": { "engine": "call_index", "memory_limit": 1 << 20 },
+    }
+    """
+        Stream variants get a small memory limit so their inputs are actually cut into
+        windows.
+    """
+
+    def __init__(self, variants=None, seeds=(0, ), case_shapes=shapes, function_count=200, registration_count=20):
+        for variant in variants or ():
+            if (variant not in self.variant_options):
+                raise ValueError("Unknown variant: %s" % variant)
+        for shape in case_shapes:
+            if (shape not in shapes):
+                raise ValueError("Unknown shape: %s" % shape)
+
+        self.variants = sorted(self.variant_options.keys()) if variants is None else variants
+        self.seeds = seeds
+        self.shapes = case_shapes
+        self.function_count = function_count
+        self.registration_count = registration_count
+
+    def run(self):
+        """
+            Returns the report of every case, a dictionary holding the shape, seed, the legacy
+            results and, for every variant, its time, speedup over the legacy Scraper, error if
+            it raised one and its differences from both the legacy Scraper and its baseline.
+        """
+        cases = [ ]
+        directory = tempfile.mkdtemp(prefix="t2diff")
+
+        try:
+            input_filename = os.path.join(directory, "case.c")
+
+            for shape in self.shapes:
+                for seed in self.seeds:
+                    AdversarialGenerator(shape, self.function_count, self.registration_count, seed=seed).generate(input_filename)
+
+                    case = self._run_case(input_filename)
+                    case.update({ "shape": shape, "seed": seed, "input_bytes": os.path.getsize(input_filename) })
+                    cases.append(case)
+
+                    if (self.keep_directory is not None and not _is_clean(case)):
+                        if (not os.path.isdir(self.keep_directory)):
+                            os.makedirs(self.keep_directory)
+                        shutil.copyfile(input_filename, os.path.join(self.keep_directory, "%s_%u.c" % (shape, seed)))
+        finally:
+            shutil.rmtree(directory)
+
+        return cases
+
+    # Helper Functions
+    def _run_case(self, input_filename):
+        reference, reference_result = _scrape(input_filename, { "engine": "regex" })
+
+        # Every engine's baseline is scraped even when it isn't a variant itself
+        baselines = { "regex": (reference, reference_result) }
+        for variant in self.variants:
+            engine = self.variant_options[variant]["engine"]
+            if (engine not in baselines):
+                baselines[engine] = _scrape(input_filename, { "engine": engine })
+
+        variant_results = { }
+        for variant in self.variants:
+            options = self.variant_options[variant]
+            baseline, baseline_result = baselines[options["engine"]]
+
+            if (options == { "engine": options["engine"] }):
+                scrape, result = baseline, dict(baseline_result)
+            else:
+                scrape, result = _scrape(input_filename, options)
+
+            result["speedup"] = reference_result["time"] / max(result["time"], 1e-9)
+            result["legacy_differences"] = _differences(reference, scrape)
+            result["mode_differences"] = _differences(baseline, scrape)
+
+            # A mode failing where its engine doesn't is a regression all the same
+            result["mode_error"] = "error" in result and "error" not in baseline_result
+            variant_results[variant] = result
+
+        return { "legacy": reference_result, "variants": variant_results }
+
+def summarize(cases):
+    """
+        Totals the cases of every variant: how many differed from the legacy Scraper, from
+        their baseline or raised errors, and the geometric mean of their speedups.
+    """
+    result = { }
+    for case in cases:
+        for variant, variant_result in case["variants"].items():
+            summary = result.setdefault(variant, { "cases": 0, "legacy_differences": 0, "mode_differences": 0, "errors": 0, "mode_errors": 0,
+                "log_speedup": 0.0, "shapes_differing": [ ] })
+
+            summary["cases"] = summary["cases"] + 1
+            summary["log_speedup"] = summary["log_speedup"] + math.log(max(variant_result["speedup"], 1e-9))
+
+            if (variant_result["legacy_differences"] is not None and len(variant_result["legacy_differences"]) != 0):
+                summary["legacy_differences"] = summary["legacy_differences"] + 1
+                if (case["shape"] not in summary["shapes_differing"]):
+                    summary["shapes_differing"].append(case["shape"])
+            if (variant_result["mode_differences"] is not None and len(variant_result["mode_differences"]) != 0):
+                summary["mode_differences"] = summary["mode_differences"] + 1
+            if ("error" in variant_result):
+                summary["errors"] = summary["errors"] + 1
+            if (variant_result["mode_error"]):
+                summary["mode_errors"] = summary["mode_errors"] + 1
+
+    for summary in result.values():
+        summary["speedup"] = math.exp(summary.pop("log_speedup") / max(1, summary["cases"]))
+
+    return result
+
+def failures(cases):
+    """
+        Returns a description of every case in which a mode changed the results of its engine.
+    """
+    result = [ ]
+    for case in cases:
+        for variant in sorted(case["variants"].keys()):
+            variant_result = case["variants"][variant]
+
+            if (variant_result["mode_error"]):
+                result.append("%s, %s seed %u: %s" % (variant, case["shape"], case["seed"], variant_result["error"]))
+            elif (variant_result["mode_differences"]):
+                result.append("%s, %s seed %u: differs from its engine in %s" % (variant, case["shape"], case["seed"],
+                    ", ".join(sorted(variant_result["mode_differences"].keys()))))
+
+    return result
+
+def report(summaries):
+    lines = ["%-22s %6s %8s %8s %7s %8s  %s" % ("variant", "cases", "legacy", "mode", "errors", "speedup", "shapes differing from legacy")]
+
+    for variant in sorted(summaries.keys()):
+        summary = summaries[variant]
+        lines.append("%-22s %6u %8u %8u %7u %7.2fx  %s" % (variant, summary["cases"], summary["legacy_differences"], summary["mode_differences"],
+            summary["errors"], summary["speedup"], ", ".join(summary["shapes_differing"])))
+
+    return "\n".join(lines)
+
+def _scrape(input_filename, options):
+    """
+        Returns the scrape with the given options, None if it raised, along with a result
+        dictionary holding the time taken and any error.
+    """
+    start_time = time.time()
+    try:
+        scrape = scraper.Scraper(input_filename, **options)
+
+        # Lazy scrapes only scan a category once it's accessed, which belongs to their time
+        for category in scraper.Scraper.scrape_categories:
+            getattr(scrape, category)
+    except Exception as error:
+        return (None, { "time": time.time() - start_time, "error": repr(error) })
+
+    return (scrape, { "time": time.time() - start_time })
+
+def _differences(old, new):
+    """
+        The categories and counters in which two scrapes differ, as a dictionary of category
+        to its added, removed and changed entries. None when either scrape failed.
+    """
+    if (old is None or new is None):
+        return None
+
+    result = { }
+    for category, changes in batch.BuildDiff(old, new).categories.items():
+        changes = dict((change_type, entries) for change_type, entries in changes.items() if len(entries) != 0)
+        if (len(changes) != 0):
+            result[category] = changes
+
+    counters = { }
+    for counter in ("global_function_count", "type_function_total"):
+        if (getattr(old, counter) != getattr(new, counter)):
+            counters[counter] = [getattr(old, counter), getattr(new, counter)]
+
+    # Only the types whose method counts differ, rather than every type there is
+    for type_name in set(old.type_function_counts) | set(new.type_function_counts):
+        old_count = old.type_function_counts.get(type_name, 0)
+        new_count = new.type_function_counts.get(type_name, 0)
+
+        if (old_count != new_count):
+            counters.setdefault("type_function_counts", { })
+            counters["type_function_counts"][type_name] = [old_count, new_count]
+    if (len(counters) != 0):
+        result["counters"] = counters
+
+    return result
+
+def _is_clean(case):
+    if ("error" in case["legacy"]):
+        return False
+
+    for variant_result in case["variants"].values():
+        if ("error" in variant_result or variant_result["legacy_differences"] or variant_result["mode_differences"]):
+            return False
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the scan engines and modes against the legacy Scraper on adversarial synthetic decompilations.")
+    parser.add_argument("--seeds", type=int, default=3, help="Cases to generate of every shape.")
+    parser.add_argument("--shapes", default=",".join(shapes), help="Comma separated shapes of registration calls to generate cases of.")
+    parser.add_argument("--variants", default=",".join(sorted(DifferentialHarness.variant_options.keys())), help="Comma separated engine and mode variants to check.")
+    parser.add_argument("--functions", type=int, default=200, help="Functions in every case.")
+    parser.add_argument("--registrations", type=int, default=20, help="Registration calls per registrar address in every case.")
+    parser.add_argument("--keep", metavar="DIRECTORY", help="Keep the inputs of cases with differences or errors here.")
+    parser.add_argument("--output", help="Write the JSON report of every case here.")
+    arguments = parser.parse_args()
+
+    harness = DifferentialHarness(arguments.variants.split(","), range(arguments.seeds), arguments.shapes.split(","), arguments.functions, arguments.registrations)
+    harness.keep_directory = arguments.keep
+    cases = harness.run()
+
+    if (arguments.output is not None):
+        with open(arguments.output, "w") as handle:
+            json.dump({ "cases": cases, "summary": summarize(cases) }, handle, indent=4, sort_keys=True)
+
+    print(report(summarize(cases)))
+
+    legacy_errors = [case for case in cases if "error" in case["legacy"]]
+    for case in legacy_errors:
+        sys.stderr.write("Legacy scraper failed on %s seed %u: %s\n" % (case["shape"], case["seed"], case["legacy"]["error"]))
+
+    regressions = failures(cases)
+    for regression in regressions:
+        sys.stderr.write("Regression: %s\n" % regression)
+    if (len(regressions) != 0):
+        sys.exit(1)
@@ -0,0 +1,262 @@
+"""
+    discovery.py
+
+    Helps keep the registrar tables of the scraper up to date for new builds.
+    Every sub_XXXX call in a decompilation is indexed once, each call's
+    arguments are classified by kind (string literal, function pointer,
+    global, integer and so on) and the callees are ranked by how many of
+    their calls look like those made to the registrars we already know
+    about. The functions making datablock property registrations are ranked
+    the same way as candidate datablock initialisers.
+
+    Candidates the scraper's tables already hold are marked as known, so new
+    ones stand out.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import re
+import json
+import argparse
+
+import scraper
+
+registrar_patterns = {
+    "global_function": ("string", "function", "string", "int", "int"),
+    "type_method": (None, "string", "string", "function", "string", "int", "int"),
+    "global_value": ("string", "int", "global"),
+    "datablock_property": ("string", "int", "int", "int", "int"),
+}
+"""
+    The argument kinds of a call to every sort of registrar. None matches an argument of
+    any kind.
+"""
+
+registrar_registries = {
+    "global_function": "_global_function_registry",
+    "type_method": "_type_function_registry",
+    "global_value": "_global_value_registry",
+    "datablock_property": "_datablock_property_registry",
+}
+"""
+    The Scraper table holding the known registrars of every sort.
+"""
+
+_cast = r"(?:\(\s*[A-Za-z_][\w ]*\**\s*\)\s*)?"
+
+argument_kinds = (
+    ("string", re.compile(r"^%s\"" % _cast)),
+    ("function", re.compile(r"^%s&?sub_[0-9A-Fa-f]+$" % _cast)),
+    ("global", re.compile(r"^%s(?:&\s*[A-Za-z_]\w*|(?:dword|word|byte|qword|unk|off|flt|dbl|stru|asc)_[0-9A-Fa-f]+)$" % _cast)),
+    ("int", re.compile(r"^%s-?(?:0x[0-9A-Fa-f]+|[0-9]+)(?:[uU]|i64|[lL])*$" % _cast)),
+    ("variable", re.compile(r"^%s[A-Za-z_]\w*$" % _cast)),
+)
+"""
+    Argument kinds in the order they're tried. Anything matching none of them is an
+    expression.
+"""
+
+class RegistrarCandidate(object):
+    """
+        A callee whose calls look like calls to a sort of registrar.
+    """
+    address = None
+    kind = None
+    matching_calls = 0
+    total_calls = 0
+    known = False
+
+    def __init__(self, address, kind, matching_calls, total_calls, known):
+        self.address = address
+        self.kind = kind
+        self.matching_calls = matching_calls
+        self.total_calls = total_calls
+        self.known = known
+
+    @property
+    def share(self):
+        """
+            The fraction of all calls to the callee that match the signature.
+        """
+        return float(self.matching_calls) / max(1, self.total_calls)
+
+    def as_dict(self):
+        return {
+            "address": self.address,
+            "kind": self.kind,
+            "matching_calls": self.matching_calls,
+            "total_calls": self.total_calls,
+            "share": self.share,
+            "known": self.known,
+        }
+
+class InitialiserCandidate(object):
+    """
+        A function making datablock property registrations.
+    """
+    address = None
+    property_count = 0
+    datablock_type = None
+    """
+        The type name the Scraper's datablock table maps the function to, None for functions
+        it doesn't know.
+    """
+
+    def __init__(self, address, property_count, datablock_type):
+        self.address = address
+        self.property_count = property_count
+        self.datablock_type = datablock_type
+
+    def as_dict(self):
+        return {
+            "address": self.address,
+            "property_count": self.property_count,
+            "datablock_type": self.datablock_type,
+        }
+
+class DiscoveryReport(object):
+    """
+        Ranks the callees of a CallSiteIndex as candidate registrars of every sort, and the
+        callers of datablock property registrars as candidate datablock initialisers. Callees
+        with fewer than minimum_calls matching calls aren't considered at all; registrars
+        are called hundreds of times, so the odd helper taking a string and a few ints
+        doesn't drown them out.
+    """
+    index = None
+    scraper_type = None
+    minimum_calls = None
+
+    registrars = None
+    """
+        Dictionary of registrar kind to a list of RegistrarCandidate, best first.
+    """
+
+    initialisers = None
+    """
+        List of InitialiserCandidate, most properties first.
+    """
+
+    def __init__(self, index, scraper_type=scraper.Scraper, minimum_calls=3):
+        self.index = index
+        self.scraper_type = scraper_type
+        self.minimum_calls = minimum_calls
+
+        self.registrars = { }
+        for kind in registrar_patterns:
+            self.registrars[kind] = [ ]
+
+        known_registrars = { }
+        for kind, registry in registrar_registries.items():
+            known_registrars[kind] = set(getattr(scraper_type, registry))
+
+        property_calls = [ ]
+        for address in index.callee_addresses():
+            call_ids = index.call_ids((address, ))
+            signatures = [call_signature(index.arguments(call_id)) for call_id in call_ids]
+
+            for kind, pattern in registrar_patterns.items():
+                matching_ids = [call_id for call_id, signature in zip(call_ids, signatures) if signature_matches(signature, pattern)]
+                known = address in known_registrars[kind]
+
+                if (len(matching_ids) >= minimum_calls or (known and len(matching_ids) != 0)):
+                    self.registrars[kind].append(RegistrarCandidate(address, kind, len(matching_ids), len(call_ids), known))
+
+                    if (kind == "datablock_property"):
+                        property_calls.extend(matching_ids)
+
+        for kind in self.registrars:
+            self.registrars[kind].sort(key=lambda candidate: (-candidate.matching_calls, -candidate.share, candidate.address))
+
+        property_counts = { }
+        for call_id in property_calls:
+            calling_method = index.function(call_id)
+
+            if (calling_method is not None):
+                property_counts[calling_method] = property_counts.get(calling_method, 0) + 1
+
+        self.initialisers = [InitialiserCandidate(address, count, scraper_type._datablock_type_table.get(address)) for address, count in property_counts.items()]
+        self.initialisers.sort(key=lambda candidate: (-candidate.property_count, candidate.address))
+
+    @classmethod
+    def from_file(cls, filename, use_mmap=False, **kwargs):
+        """
+            Loads the file the same way the Scraper does and indexes it.
+        """
+        if (use_mmap):
+            file_buffer, start = scraper.Scraper._map_buffer(filename)
+        else:
+            file_buffer, start = scraper.Scraper._read_buffer(filename), 0
+
+        return cls(scraper.CallSiteIndex.from_buffer(file_buffer, start), **kwargs)
+
+    def new_registrars(self):
+        """
+            Returns the candidates of every kind that the scraper's tables don't hold yet.
+        """
+        return dict((kind, [candidate for candidate in candidates if not candidate.known]) for kind, candidates in self.registrars.items())
+
+    def as_dict(self, limit=None):
+        return {
+            "call_sites": len(self.index),
+            "callees": len(self.index.callee_addresses()),
+            "registrars": dict((kind, [candidate.as_dict() for candidate in candidates[:limit]]) for kind, candidates in self.registrars.items()),
+            "initialisers": [candidate.as_dict() for candidate in self.initialisers[:limit]],
+        }
+
+    def report(self, limit=10):
+        lines = ["%u call sites to %u callees" % (len(self.index), len(self.index.callee_addresses()))]
+
+        for kind in sorted(registrar_patterns.keys()):
+            lines.append("")
+            lines.append("%s registrars: %s" % (kind, ", ".join(argument_kind or "any" for argument_kind in registrar_patterns[kind])))
+
+            for candidate in self.registrars[kind][:limit]:
+                lines.append("    sub_%-10s %8u calls %6.1f%% %s" % (candidate.address, candidate.matching_calls, candidate.share * 100.0, "known" if candidate.known else "NEW"))
+
+        lines.append("")
+        lines.append("Datablock initialisers:")
+        for candidate in self.initialisers[:limit]:
+            lines.append("    %-14s %8u properties %s" % (candidate.address, candidate.property_count, candidate.datablock_type or "NEW"))
+
+        return "\n".join(lines)
+
+def argument_kind(argument):
+    for kind, expression in argument_kinds:
+        if (expression.match(argument) is not None):
+            return kind
+
+    return "expression"
+
+def call_signature(arguments):
+    """
+        Returns a tuple of the kind of every argument in the given CallArguments.
+    """
+    return tuple(argument_kind(arguments.text(index)) for index in range(len(arguments)))
+
+def signature_matches(signature, pattern):
+    if (len(signature) != len(pattern)):
+        return False
+
+    for kind, expected_kind in zip(signature, pattern):
+        if (expected_kind is not None and kind != expected_kind):
+            return False
+
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ranks the subroutines of a decompilation as candidate registrars and datablock initialisers.")
+    parser.add_argument("input", help="The decompiled executable to index.")
+    parser.add_argument("--mmap", action="store_true", help="Map the input into memory rather than reading it.")
+    parser.add_argument("--minimum-calls", type=int, default=3, help="Ignore callees with fewer matching calls than this.")
+    parser.add_argument("--limit", type=int, default=10, help="Candidates to list of every kind.")
+    parser.add_argument("--json", action="store_true", help="Write the report as JSON.")
+    arguments = parser.parse_args()
+
+    discovery = DiscoveryReport.from_file(arguments.input, arguments.mmap, minimum_calls=arguments.minimum_calls)
+
+    if (arguments.json):
+        print(json.dumps(discovery.as_dict(arguments.limit), indent=4, sort_keys=True))
+    else:
+        print(discovery.report(arguments.limit))
@@ -0,0 +1,425 @@
+"""
+    export.py
+
+    Machine readable exports of scrape results for tooling that would rather
+    not re-run the scraper or re-parse the DokuWiki output. Results can be
+    written as JSON Lines, as an indexed SQLite database or, if the msgpack
+    module is installed, as a compact msgpack file.
+
+    Each format has a loader giving back an ExportedScrape, which looks like a
+    Scraper to the code using it. Only the counts are read when an export is
+    loaded; every category of results is read and rebuilt into Function,
+    GlobalVariable and Datablock objects the first time it's accessed.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import json
+import sqlite3
+import itertools
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+import scraper
+
+categories = ("global_functions", "type_methods", "global_values", "datablocks")
+"""
+    The categories of results, in the order they're written.
+"""
+
+category_fields = {
+    "global_functions": ("name", "address", "type_name", "description", "min_args", "max_args"),
+    "type_methods": ("type_name", "address", "name", "description", "min_args", "max_args"),
+    "global_values": ("name", "address", "type_name"),
+    "datablocks": ("datablock", "name", "address", "type_name"),
+}
+"""
+    The fields of a record of every category. Datablocks are exported a record per
+    property.
+"""
+
+format_version = 1
+
+class _LazyCategory(object):
+    """
+        Reads a category of results from the reader of an ExportedScrape when first
+        accessed and stores it on the instance, so that later accesses never come back here.
+    """
+    def __init__(self, category):
+        self.category = category
+
+    def __get__(self, instance, owner):
+        if (instance is None):
+            return self
+
+        result = _build(self.category, instance._reader.records(self.category))
+        instance.__dict__[self.category] = result
+        return result
+
+class ExportedScrape(scraper.Scraper):
+    """
+        Scrape results loaded from an export. The categories of results are attributes
+        named as they are on the Scraper, read from the export on first access. Everything
+        the Scraper derives from its results, such as the inheritance and method tables,
+        works the same way here.
+    """
+    global_functions = _LazyCategory("global_functions")
+    type_methods = _LazyCategory("type_methods")
+    global_values = _LazyCategory("global_values")
+    datablocks = _LazyCategory("datablocks")
+
+    global_function_count = 0
+    type_function_total = 0
+    type_function_counts = None
+
+    _reader = None
+
+    def __init__(self, reader):
+        header = reader.header()
+
+        if (header["format_version"] != format_version):
+            raise ValueError("Unsupported export format version %s" % header["format_version"])
+
+        self.global_function_count = header["global_function_count"]
+        self.type_function_total = header["type_function_total"]
+        self.type_function_counts = native_strings(header["type_function_counts"], header.get("string_encoding", "utf-8"))
+
+        self._reader = reader
+
+    def close(self):
+        self._reader.close()
+
+class JSONLinesExporter(object):
+    """
+        A header line followed by a JSON object per record. Records are written category by
+        category and the header holds the number of records in each, so a loader can skip
+        straight past categories it doesn't need without parsing them.
+
+        Names and descriptions are byte strings and JSON strings are text, so they're
+        written decoded with the string_encoding of the header: UTF-8 where every one of
+        them is valid UTF-8, latin-1 otherwise so that every byte survives the round trip.
+    """
+    extension = ".jsonl"
+
+    def write(self, scrape, filename):
+        header = _header(scrape)
+
+        with open(filename, "w") as handle:
+            handle.write(json.dumps(header, sort_keys=True))
+            handle.write("\n")
+
+            for category in categories:
+                fields = category_fields[category]
+
+                for record in _records(scrape, category):
+                    record = dict(zip(fields, text_strings(record, header["string_encoding"])))
+                    record["kind"] = category
+
+                    handle.write(json.dumps(record, sort_keys=True))
+                    handle.write("\n")
+
+    def load(self, filename):
+        return ExportedScrape(_JSONLinesReader(filename))
+
+class _JSONLinesReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "r") as handle:
+            self._header = json.loads(handle.readline())
+
+        # Exports written before the encoding was recorded hold UTF-8
+        self._encoding = self._header.get("string_encoding", "utf-8")
+
+    def header(self):
+        return self._header
+
+    def records(self, category):
+        skipped = 1
+        for previous_category in categories[:categories.index(category)]:
+            skipped = skipped + self._header["counts"][previous_category]
+
+        fields = category_fields[category]
+        with open(self.filename, "r") as handle:
+            lines = itertools.islice(handle, skipped, skipped + self._header["counts"][category])
+
+            result = [ ]
+            for line in lines:
+                record = json.loads(line)
+                result.append([_native_string(record[field], self._encoding) for field in fields])
+
+            return result
+
+    def close(self):
+        pass
+
+class SQLiteExporter(object):
+    """
+        A table per category with a column per field, indexed for lookups by name and by
+        type name. The counts are kept in a metadata table as JSON.
+    """
+    extension = ".sqlite"
+
+    indexes = {
+        "global_functions": ("name COLLATE NOCASE", "address"),
+        "type_methods": ("type_name COLLATE NOCASE", "name COLLATE NOCASE", "address"),
+        "global_values": ("name COLLATE NOCASE", ),
+        "datablocks": ("datablock COLLATE NOCASE", "name COLLATE NOCASE"),
+    }
+
+    def write(self, scrape, filename):
+        if (os.path.exists(filename)):
+            os.remove(filename)
+
+        connection = _connect(filename)
+        try:
+            connection.execute("CREATE TABLE metadata (key TEXT PRIMARY KEY, value TEXT)")
+            connection.executemany("INSERT INTO metadata VALUES (?, ?)", [(key, json.dumps(value)) for key, value in _header(scrape).items()])
+
+            for category in categories:
+                fields = category_fields[category]
+
+                connection.execute("CREATE TABLE %s (%s)" % (category, ", ".join(fields)))
+                connection.executemany("INSERT INTO %s VALUES (%s)" % (category, ", ".join("?" * len(fields))), _records(scrape, category))
+
+                # Indexes are quicker to build in one go once the table is filled
+                for index, column in enumerate(self.indexes[category]):
+                    connection.execute("CREATE INDEX %s_%u ON %s (%s)" % (category, index, category, column))
+
+            connection.commit()
+        finally:
+            connection.close()
+
+    def load(self, filename):
+        return ExportedScrape(_SQLiteReader(filename))
+
+class _SQLiteReader(object):
+    def __init__(self, filename):
+        self.connection = _connect(filename)
+
+    def header(self):
+        result = { }
+        for key, value in self.connection.execute("SELECT key, value FROM metadata"):
+            result[key] = json.loads(value)
+
+        return result
+
+    def records(self, category):
+        return self.connection.execute("SELECT %s FROM %s ORDER BY rowid" % (", ".join(category_fields[category]), category)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+class MsgpackExporter(object):
+    """
+        A msgpack header map followed by each category packed as one array of record
+        arrays. The header holds the packed size of every category, so a loader can seek
+        straight to the one it needs. Requires the msgpack module.
+    """
+    extension = ".msgpack"
+
+    def write(self, scrape, filename):
+        _require_msgpack()
+
+        packed = [ ]
+        header = _header(scrape)
+        header["sizes"] = { }
+
+        for category in categories:
+            packed.append(msgpack.packb([list(record) for record in _records(scrape, category)], use_bin_type=True))
+            header["sizes"][category] = len(packed[-1])
+
+        with open(filename, "wb") as handle:
+            handle.write(msgpack.packb(header, use_bin_type=True))
+            for category_data in packed:
+                handle.write(category_data)
+
+    def load(self, filename):
+        _require_msgpack()
+        return ExportedScrape(_MsgpackReader(filename))
+
+class _MsgpackReader(object):
+    def __init__(self, filename):
+        self.filename = filename
+
+        with open(filename, "rb") as handle:
+            unpacker = msgpack.Unpacker(handle, raw=False)
+            self._header = unpacker.unpack()
+            self._data_offset = unpacker.tell()
+
+    def header(self):
+        return self._header
+
+    def records(self, category):
+        offset = self._data_offset
+        for previous_category in categories[:categories.index(category)]:
+            offset = offset + self._header["sizes"][previous_category]
+
+        with open(self.filename, "rb") as handle:
+            handle.seek(offset)
+            return msgpack.unpackb(handle.read(self._header["sizes"][category]), raw=False)
+
+    def close(self):
+        pass
+
+exporters = {
+    "jsonl": JSONLinesExporter,
+    "sqlite": SQLiteExporter,
+    "msgpack": MsgpackExporter,
+}
+
+def format_for(filename):
+    """
+        Guesses the export format of a file from its extension.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+
+    for export_format, exporter_type in exporters.items():
+        if (exporter_type.extension == extension):
+            return export_format
+
+    raise ValueError("Unknown export format for %s" % filename)
+
+def export(scrape, filename, export_format=None):
+    if (export_format is None):
+        export_format = format_for(filename)
+    exporters[export_format]().write(scrape, filename)
+
+def load(filename, export_format=None):
+    if (export_format is None):
+        export_format = format_for(filename)
+    return exporters[export_format]().load(filename)
+
+def string_encoding(values):
+    """
+        Returns the encoding to turn the byte strings within the given values into text with
+        before dumping them as JSON: utf-8 if every one of them is valid UTF-8, otherwise
+        latin-1, which maps every byte to a character of its own and back.
+    """
+    try:
+        for value in values:
+            text_strings(value)
+    except UnicodeDecodeError:
+        return "latin-1"
+
+    return "utf-8"
+
+def text_strings(value, encoding="utf-8"):
+    """
+        Decodes the byte strings within a value, which may be nested within lists, tuples
+        and dictionaries, with the given encoding. Tuples come back as lists.
+    """
+    if (isinstance(value, (list, tuple))):
+        return [text_strings(entry, encoding) for entry in value]
+    elif (isinstance(value, dict)):
+        return dict((text_strings(key, encoding), text_strings(entry, encoding)) for key, entry in value.items())
+
+    return _text_string(value, encoding)
+
+def native_strings(value, encoding="utf-8"):
+    """
+        Reverses text_strings given the same encoding, giving back the original byte strings.
+    """
+    if (isinstance(value, list)):
+        return [native_strings(entry, encoding) for entry in value]
+    elif (isinstance(value, dict)):
+        return dict((native_strings(key, encoding), native_strings(entry, encoding)) for key, entry in value.items())
+
+    return _native_string(value, encoding)
+
+# Helper Functions
+try:
+    unicode
+
+    def _native_string(value, encoding="utf-8"):
+        # JSON and SQLite hand back unicode, whereas the scraper works in byte strings
+        if (isinstance(value, unicode)):
+            return value.encode(encoding)
+        return value
+
+    def _text_string(value, encoding="utf-8"):
+        if (isinstance(value, str)):
+            return value.decode(encoding)
+        return value
+except NameError:
+    def _native_string(value, encoding="utf-8"):
+        return value
+
+    def _text_string(value, encoding="utf-8"):
+        return value
+
+def _require_msgpack():
+    if (msgpack is None):
+        raise ImportError("The msgpack format requires the msgpack module")
+
+def _connect(filename):
+    connection = sqlite3.connect(filename)
+
+    # Descriptions are scraped as bytes and aren't guaranteed to be valid UTF-8
+    connection.text_factory = str
+    return connection
+
+def _header(scrape):
+    counts = { }
+    for category in categories:
+        counts[category] = 0
+
+    counts["global_functions"] = len(scrape.global_functions)
+    counts["type_methods"] = sum(len(type_methods) for type_methods in scrape.type_methods.values())
+    counts["global_values"] = len(scrape.global_values)
+    counts["datablocks"] = sum(len(datablock.properties) for datablock in scrape.datablocks.values())
+
+    encoding = string_encoding(itertools.chain(scrape.type_function_counts.keys(), *[_records(scrape, category) for category in categories]))
+
+    return {
+        "format_version": format_version,
+        "global_function_count": scrape.global_function_count,
+        "type_function_total": scrape.type_function_total,
+        "type_function_counts": text_strings(scrape.type_function_counts, encoding),
+        "string_encoding": encoding,
+        "counts": counts,
+    }
+
+def _records(scrape, category):
+    if (category == "global_functions"):
+        return ((global_function.name, global_function.address, global_function.type_name, global_function.description,
+            global_function.min_args, global_function.max_args) for global_function in scrape.global_functions)
+    elif (category == "type_methods"):
+        return (type_method for type_name in sorted(scrape.type_methods.keys()) for type_method in scrape.type_methods[type_name])
+    elif (category == "global_values"):
+        return ((global_value.name, global_value.address, global_value.type_name) for global_value in scrape.global_values)
+
+    return ((datablock_type, datablock_property.name, datablock_property.address, datablock_property.type_name)
+        for datablock_type in sorted(scrape.datablocks.keys()) for datablock_property in scrape.datablocks[datablock_type].properties.values())
+
+def _build(category, records):
+    if (category == "global_functions"):
+        return [scraper.Function(*[_native_string(value) for value in record]) for record in records]
+    elif (category == "type_methods"):
+        result = { }
+        for record in records:
+            record = tuple(_native_string(value) for value in record)
+
+            result.setdefault(record[0], [])
+            result[record[0]].append(record)
+
+        return result
+    elif (category == "global_values"):
+        return [scraper.GlobalVariable(*[_native_string(value) for value in record]) for record in records]
+
+    result = { }
+    for datablock_type, name, address, type_name in records:
+        datablock_type = _native_string(datablock_type)
+
+        if (datablock_type not in result):
+            result[datablock_type] = scraper.Datablock(datablock_type)
+
+        result[datablock_type].properties[_native_string(name)] = scraper.Datablock.Property(_native_string(name), _native_string(address), _native_string(type_name))
+
+    return result
@@ -0,0 +1,305 @@
+"""
+    pages.py
+
+    Writes the engine reference as a tree of separate pages rather than one
+    monolithic document: a page per global function category, one for the
+    global values, one per type and one per datablock, along with an index
+    page linking to all of them. Pages are rendered and written by a pool of
+    worker processes, and pages whose content hasn't changed since the last
+    run are left untouched so that syncing the output only has to push the
+    pages that actually changed.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import re
+import json
+import hashlib
+import tempfile
+import multiprocessing
+
+import render
+
+class PageResults(object):
+    """
+        What a PageWriter did, by page path.
+    """
+    written = None
+    unchanged = None
+    removed = None
+
+    digests = None
+    """
+        Dictionary of page path to the sha1 of its content.
+    """
+
+    names = None
+    """
+        Dictionary of page path to the name of what it documents.
+    """
+
+    bytes_written = 0
+
+    def __init__(self):
+        self.written = [ ]
+        self.unchanged = [ ]
+        self.removed = [ ]
+        self.digests = { }
+        self.names = { }
+
+class ReferencePages(object):
+    """
+        Splits the event stream of a scrape into pages. Every page is a list of events
+        forming a document of its own, so pages can be handed off to other processes.
+
+        Page paths are made from lower cased names with anything unsafe in a filename
+        replaced, so distinct names can come out the same, such as Foo and foo or A-B and
+        A_B. The first of those in sorted order gets the plain path and the rest a numeric
+        suffix, so no page ever overwrites another.
+    """
+    events = None
+
+    index_page = "index"
+
+    names = None
+    """
+        Dictionary of page path to the name of what it documents.
+    """
+
+    _page_paths = None
+
+    def __init__(self, scrape):
+        self.events = render.ReferenceEvents(scrape)
+
+        self.names = { self.index_page: "Index" }
+        self._page_paths = { }
+
+        self._assign_pages("functions", ["general"] + list(self.events.global_function_categories))
+        self._assign_pages("values", ["global"])
+        self._assign_pages("types", scrape.type_methods.keys())
+        self._assign_pages("datablocks", scrape.datablocks.keys())
+
+    def page_links(self):
+        """
+            Returns a dictionary of type name to the page documenting it, for types and
+            datablocks alike. Types take precedence where a name is both.
+        """
+        result = { }
+        for datablock_type in self.events.scrape.datablocks:
+            result[datablock_type] = self._page("datablocks", datablock_type)
+        for type_name in self.events.scrape.type_methods:
+            result[type_name] = self._page("types", type_name)
+
+        return result
+
+    def pages(self):
+        """
+            Yields (page path, events) for every page, the index page last.
+        """
+        scrape = self.events.scrape
+        categories = self.events.categorised_global_functions()
+
+        index = [("begin_document", "document", (self.events.title, self.events.author))]
+
+        index.append(("begin_section", "global_functions", (scrape.global_function_count, )))
+        for category in (None, ) + self.events.global_function_categories:
+            page = self._page("functions", "general" if category is None else category)
+            title = "General" if category is None else category.capitalize()
+
+            index.append(("entry", "page", (render.PageLink(page, title), len(categories[category]))))
+            yield (page, self._document(title, self.events.global_function_events(category, categories[category])))
+        index.append(("end_section", "global_functions", ()))
+
+        index.append(("begin_section", "global_values", (len(scrape.global_values), )))
+        page = self._page("values", "global")
+        index.append(("entry", "page", (render.PageLink(page, "Global Values"), len(scrape.global_values))))
+        yield (page, self._document("Global Values", self.events.global_value_events()))
+        index.append(("end_section", "global_values", ()))
+
+        index.append(("begin_section", "type_methods", (scrape.type_function_total, len(scrape.type_methods))))
+        for type_name in sorted(scrape.type_methods.keys()):
+            page = self._page("types", type_name)
+            index.append(("entry", "page", (render.PageLink(page, type_name), len(scrape.type_methods[type_name]))))
+            yield (page, self._document(type_name, self.events.type_events(type_name)))
+        index.append(("end_section", "type_methods", ()))
+
+        index.append(("begin_section", "datablocks", (len(scrape.datablocks), )))
+        for datablock_type in sorted(scrape.datablocks.keys()):
+            page = self._page("datablocks", datablock_type)
+            index.append(("entry", "page", (render.PageLink(page, datablock_type), len(scrape.datablocks[datablock_type].properties))))
+            yield (page, self._document(datablock_type, self.events.datablock_events(datablock_type)))
+        index.append(("end_section", "datablocks", ()))
+
+        index.append(("end_document", "document", ()))
+        yield (self.index_page, index)
+
+    # Helper Functions
+    _unsafe_characters = re.compile(r"[^a-z0-9_.-]")
+
+    def _page(self, namespace, name):
+        return self._page_paths[(namespace, name)]
+
+    def _assign_pages(self, namespace, names):
+        for name in sorted(names):
+            page = base_page = "%s/%s" % (namespace, self._unsafe_characters.sub("_", name.lower()))
+
+            suffix = 2
+            while (page in self.names):
+                page = "%s_%u" % (base_page, suffix)
+                suffix = suffix + 1
+
+            self.names[page] = name
+            self._page_paths[(namespace, name)] = page
+
+    def _document(self, title, events):
+        result = [("begin_document", "document", ("%s: %s" % (self.events.title, title), self.events.author))]
+        result.extend(events)
+        result.append(("end_document", "document", ()))
+
+        return result
+
+class PageWriter(object):
+    """
+        Writes the pages of a scrape out below a directory in a single output format. A
+        manifest of the content digest and name of every page is kept alongside them for
+        each format, so pages that disappear from the reference are removed on the next run
+        as well, along with any directories that leaves empty.
+    """
+    directory = None
+    output_format = None
+    processes = None
+
+    manifest_template = "%s.manifest.json"
+
+    def __init__(self, directory, output_format="dokuwiki", processes=None):
+        """
+            processes defaults to the number of CPUs.
+        """
+        self.directory = directory
+        self.output_format = output_format
+        self.processes = processes
+
+    def write(self, scrape):
+        """
+            Writes every page of the given scrape and returns the PageResults.
+        """
+        results = PageResults()
+        reference = ReferencePages(scrape)
+        extension = render.renderers[self.output_format].extension
+
+        previous = self._load_manifest()
+
+        pool = multiprocessing.Pool(self.processes, _initialise_worker, (self.directory, self.output_format, reference.page_links()))
+        try:
+            for page, digest, written, size in pool.imap_unordered(_write_page, reference.pages(), 16):
+                results.digests[page] = digest
+
+                if (written):
+                    results.written.append(page)
+                    results.bytes_written = results.bytes_written + size
+                else:
+                    results.unchanged.append(page)
+        finally:
+            pool.close()
+            pool.join()
+
+        for page in sorted(results.digests.keys()):
+            results.names[page] = reference.names[page]
+
+        for page in sorted(previous.keys()):
+            if (page not in results.digests):
+                try:
+                    os.remove(os.path.join(self.directory, page + extension))
+                except OSError:
+                    pass
+                results.removed.append(page)
+
+                self._remove_empty_directories(os.path.dirname(page))
+
+        self._write_manifest(results)
+        return results
+
+    # Helper Functions
+    def _load_manifest(self):
+        try:
+            with open(os.path.join(self.directory, self.manifest_template % self.output_format), "r") as handle:
+                return json.load(handle)
+        except (IOError, OSError, ValueError):
+            return { }
+
+    def _write_manifest(self, results):
+        # Manifests written before names were kept map pages straight to digests, which loads just as well
+        manifest = dict((page, { "digest": digest, "name": results.names[page] }) for page, digest in results.digests.items())
+        _write_atomic(os.path.join(self.directory, self.manifest_template % self.output_format), json.dumps(manifest, indent=4, sort_keys=True))
+
+    def _remove_empty_directories(self, page_directory):
+        # Walk up towards the output directory, stopping at the first directory still holding something
+        while (page_directory != ""):
+            try:
+                os.rmdir(os.path.join(self.directory, page_directory))
+            except OSError:
+                return
+
+            page_directory = os.path.dirname(page_directory)
+
+# Reading the umask means setting it, so it's only done once while importing rather than
+# racing with the worker processes and threads writing pages
+_umask = os.umask(0)
+os.umask(_umask)
+
+def _write_atomic(filename, content):
+    directory = os.path.dirname(filename)
+    if (not os.path.isdir(directory)):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # Another worker may have just created it
+            if (not os.path.isdir(directory)):
+                raise
+
+    handle, temporary_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(handle, "w") as handle:
+        handle.write(content)
+
+    # Temporary files are only readable by us, pages get the permissions open() would give them
+    os.chmod(temporary_path, 0o666 & ~_umask)
+    os.rename(temporary_path, filename)
+
+_worker_settings = None
+
+def _initialise_worker(directory, output_format, page_links):
+    global _worker_settings
+    _worker_settings = (directory, render.renderers[output_format], page_links)
+
+def _write_page(page_events):
+    page, events = page_events
+    directory, renderer_type, page_links = _worker_settings
+
+    parts = [ ]
+    renderer = renderer_type(_PartCollector(parts))
+    renderer.page_links = page_links
+    renderer.page_depth = page.count("/")
+
+    render.render(events, [renderer])
+
+    content = "".join(parts)
+    digest = hashlib.sha1(content).hexdigest()
+    filename = os.path.join(directory, page + renderer_type.extension)
+
+    # Compare against what is actually on disk rather than the manifest, in case the page was touched since
+    try:
+        with open(filename, "r") as handle:
+            if (hashlib.sha1(handle.read()).hexdigest() == digest):
+                return (page, digest, False, 0)
+    except (IOError, OSError):
+        pass
+
+    _write_atomic(filename, content)
+    return (page, digest, True, len(content))
+
+class _PartCollector(object):
+    def __init__(self, parts):
+        self.write = parts.append
@@ -0,0 +1,249 @@
+"""
+    profiles.py
+
+    Registration profiles describe everything the scraper needs to know about
+    a particular Torque title: the addresses of its registrars, the layout of
+    the arguments they take, which initialisers belong to which datablock
+    types and how its script types inherit from one another. Profiles are
+    kept in JSON data files so other titles and builds don't have to be
+    supported by editing the Scraper's tables by hand.
+
+    A profile is compiled into a Scraper subclass holding its tables and the
+    registration expressions built from them, so a registration of any
+    category is still classified in the one pass over the buffer. Compiled
+    profiles are cached by the digest of their contents.
+
+    Profile files hold a JSON object with any of the following, falling back
+    to the Tribes 2 tables of the Scraper for whatever they leave out:
+
+        {
+            "name": "Tribes 2",
+            "registrars": {"global_functions": ["426650"], ...},
+            "argument_layouts": {"global_values": {"count": 3, "type": 1, "address": 2}, ...},
+            "datablock_type_table": {"61E7A0": "ExplosionData", ...},
+            "type_name_inheritance": {"Player": "ShapeBase", ...}
+        }
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import re
+import sys
+import json
+import hashlib
+import argparse
+
+import scraper
+
+registry_attributes = {
+    "global_functions": "_global_function_registry",
+    "type_methods": "_type_function_registry",
+    "global_values": "_global_value_registry",
+    "datablocks": "_datablock_property_registry",
+}
+"""
+    The Scraper table holding the registrars of every category.
+"""
+
+layout_fields = {
+    "global_functions": ("count", "name", "address", "description", "min_args", "max_args"),
+    "type_methods": ("count", "type_name", "name", "address", "description", "min_args", "max_args"),
+    "global_values": ("count", "type", "address"),
+    "datablocks": ("count", "name", "address"),
+}
+"""
+    The fields every argument layout has to give, count being the number of arguments the
+    registrars of the category take and the rest positions among them.
+"""
+
+_address_expression = re.compile("^[0-9A-Fa-f]+$")
+
+_compiled_profiles = { }
+"""
+    Profile digest to the Scraper subclass compiled from it.
+"""
+
+class RegistrationProfile(object):
+    """
+        The registration tables of a Torque title. Tables that aren't given are taken from
+        the Scraper, which holds those of Tribes 2.
+    """
+    name = None
+
+    registrars = None
+    """
+        Dictionary of category to the list of registrar addresses of that category.
+    """
+
+    argument_layouts = None
+    """
+        Dictionary of category to the argument layout of its registrars, as in layout_fields.
+    """
+
+    datablock_type_table = None
+    """
+        Dictionary of datablock initialiser address to datablock type name.
+    """
+
+    type_name_inheritance = None
+    """
+        Dictionary of type name to parent type name.
+    """
+
+    def __init__(self, name=None, registrars=None, argument_layouts=None, datablock_type_table=None, type_name_inheritance=None):
+        self.name = name
+
+        self.registrars = { }
+        for category, attribute in registry_attributes.items():
+            self.registrars[category] = list(getattr(scraper.Scraper, attribute))
+        if (registrars is not None):
+            self.registrars.update(registrars)
+
+        self.argument_layouts = dict((category, dict(layout)) for category, layout in scraper.Scraper._argument_layouts.items())
+        if (argument_layouts is not None):
+            self.argument_layouts.update(argument_layouts)
+
+        self.datablock_type_table = dict(scraper.Scraper._datablock_type_table if datablock_type_table is None else datablock_type_table)
+        self.type_name_inheritance = dict(scraper.Scraper.type_name_inheritance if type_name_inheritance is None else type_name_inheritance)
+
+        self._validate()
+
+    @classmethod
+    def from_scraper(cls, scraper_type=scraper.Scraper, name=None):
+        """
+            Builds the profile holding the tables of the given scraper type.
+        """
+        registrars = dict((category, list(getattr(scraper_type, attribute))) for category, attribute in registry_attributes.items())
+        return cls(name, registrars, scraper_type._argument_layouts, scraper_type._datablock_type_table, scraper_type.type_name_inheritance)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, "r") as handle:
+            data = _native(json.load(handle))
+
+        if (not isinstance(data, dict)):
+            raise ValueError("%s doesn't hold a registration profile" % filename)
+
+        return cls(data.get("name"), data.get("registrars"), data.get("argument_layouts"), data.get("datablock_type_table"),
+            data.get("type_name_inheritance"))
+
+    def save(self, filename):
+        with open(filename, "w") as handle:
+            handle.write(json.dumps(self.as_dict(), indent=4, sort_keys=True))
+            handle.write("\n")
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "registrars": self.registrars,
+            "argument_layouts": self.argument_layouts,
+            "datablock_type_table": self.datablock_type_table,
+            "type_name_inheritance": self.type_name_inheritance,
+        }
+
+    def digest(self):
+        """
+            Digest of the tables of the profile. The name isn't part of it, as it doesn't
+            change what is scraped.
+        """
+        tables = self.as_dict()
+        del tables["name"]
+
+        return hashlib.sha1(json.dumps(tables, sort_keys=True)).hexdigest()
+
+    def scraper_type(self):
+        """
+            Returns the Scraper subclass scraping with the tables of this profile. Subclasses
+            are compiled once per distinct set of tables and shared from then on.
+        """
+        digest = self.digest()
+
+        result = _compiled_profiles.get(digest)
+        if (result is None):
+            result = _compile(self, digest)
+            _compiled_profiles[digest] = result
+
+        return result
+
+    # Helper Functions
+    def _validate(self):
+        for category in registry_attributes:
+            registry = self.registrars.get(category)
+            if (not isinstance(registry, list)):
+                raise ValueError("The %s registrars of a profile have to be a list of addresses" % category)
+
+            for address in registry:
+                if (not isinstance(address, str) or _address_expression.match(address) is None):
+                    raise ValueError("Invalid %s registrar address %r" % (category, address))
+
+            layout = self.argument_layouts.get(category)
+            if (not isinstance(layout, dict)):
+                raise ValueError("Missing %s argument layout" % category)
+
+            for field in layout_fields[category]:
+                if (not isinstance(layout.get(field), int)):
+                    raise ValueError("The %s argument layout has no %s position" % (category, field))
+                if (field != "count" and not 0 <= layout[field] < layout["count"]):
+                    raise ValueError("The %s position of the %s argument layout is out of range" % (field, category))
+
+def scraper_type(filename):
+    """
+        Loads the profile in the given file and returns the Scraper subclass compiled from it.
+    """
+    return RegistrationProfile.load(filename).scraper_type()
+
+# Helper Functions
+def _compile(profile, digest):
+    # Compiled types are published in this module so scrapes made with them can be pickled,
+    # both for process pools and for the scrape cache
+    type_name = "ProfileScraper_%s" % digest[:16]
+
+    attributes = {
+        "__module__": __name__,
+        "_argument_layouts": profile.argument_layouts,
+        "_datablock_type_table": profile.datablock_type_table,
+        "type_name_inheritance": profile.type_name_inheritance,
+    }
+    for category, attribute in registry_attributes.items():
+        attributes[attribute] = profile.registrars[category]
+
+    result = type(type_name, (scraper.Scraper, ), attributes)
+    result.compile_registrations()
+
+    setattr(sys.modules[__name__], type_name, result)
+    return result
+
+try:
+    unicode
+
+    def _native(value):
+        # JSON hands back unicode, whereas the scraper works in byte strings
+        if (isinstance(value, unicode)):
+            return value.encode("utf-8")
+        elif (isinstance(value, list)):
+            return [_native(entry) for entry in value]
+        elif (isinstance(value, dict)):
+            return dict((_native(key), _native(entry)) for key, entry in value.items())
+        return value
+except NameError:
+    def _native(value):
+        return value
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes out the built in Tribes 2 registration profile, or checks a profile file.")
+    parser.add_argument("--check", metavar="FILENAME", help="Load and compile this profile rather than writing out the built in one.")
+    parser.add_argument("-o", "--output", help="Write the profile here rather than to stdout.")
+    arguments = parser.parse_args()
+
+    if (arguments.check is not None):
+        profile = RegistrationProfile.load(arguments.check)
+        profile.scraper_type()
+        print("%s: %s" % (profile.name or arguments.check, profile.digest()))
+    else:
+        profile = RegistrationProfile.from_scraper(name="Tribes 2")
+        if (arguments.output is None):
+            print(json.dumps(profile.as_dict(), indent=4, sort_keys=True))
+        else:
+            profile.save(arguments.output)
@@ -0,0 +1,157 @@
+"""
+    query.py
+
+    Indexed lookups over the results of a scrape, for tooling that needs to
+    cross reference scripts against the engine many times over. The indexes
+    are built once up front; after that lookups by name and address are hash
+    lookups and name prefix lookups are a binary search.
+
+    Names are indexed case insensitively as Torque Script itself doesn't care
+    about case when calling functions.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import bisect
+
+import scraper
+
+class PrefixIndex(object):
+    """
+        A sorted list of lower case names alongside what they refer to, searched with a
+        bisect for everything starting with a given prefix.
+    """
+    names = None
+    entries = None
+
+    def __init__(self, pairs):
+        pairs = sorted(pairs, key=lambda pair: pair[0])
+
+        self.names = [name for name, entry in pairs]
+        self.entries = [entry for name, entry in pairs]
+
+    def find(self, prefix):
+        prefix = prefix.lower()
+
+        result = [ ]
+        index = bisect.bisect_left(self.names, prefix)
+        while (index < len(self.names) and self.names[index].startswith(prefix)):
+            result.append(self.entries[index])
+            index = index + 1
+
+        return result
+
+class ScrapeQuery(object):
+    """
+        Query object built from a Scraper. Type methods are presented as scraper.Function
+        objects with their type_name set, global functions have a type_name of None.
+    """
+    functions = None
+    global_values = None
+
+    _by_name = None
+    _by_address = None
+    _by_type = None
+    _type_names = None
+    _global_values_by_address = None
+
+    _prefixes = None
+
+    def __init__(self, scrape):
+        self.functions = list(scrape.global_functions)
+
+        for type_name in scrape.type_methods:
+            for type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs in scrape.type_methods[type_name]:
+                self.functions.append(scraper.Function(type_method_name, type_method_address, type_method_type, type_method_description, type_method_minargs, type_method_maxargs))
+
+        self.global_values = list(scrape.global_values)
+
+        self._by_name = { }
+        self._by_address = { }
+        self._by_type = { }
+        self._type_names = { }
+
+        scoped_names = { }
+        for function in self.functions:
+            name_key = function.name.lower()
+            type_key = self._type_key(function.type_name)
+
+            self._by_name.setdefault(name_key, [])
+            self._by_name[name_key].append(function)
+
+            self._by_address.setdefault(function.address, [])
+            self._by_address[function.address].append(function)
+
+            self._by_type.setdefault(type_key, { })
+            self._type_names.setdefault(type_key, function.type_name)
+            self._by_type[type_key].setdefault(name_key, function)
+
+            scoped_names.setdefault(type_key, [])
+            scoped_names[type_key].append((name_key, function))
+
+        self._prefixes = { }
+        for type_key in scoped_names:
+            self._prefixes[type_key] = PrefixIndex(scoped_names[type_key])
+        self._prefixes[None] = PrefixIndex([(function.name.lower(), function) for function in self.functions])
+
+        # The scraper keeps the address of a global value in its name, as it always has
+        self._global_values_by_address = { }
+        for global_value in self.global_values:
+            self._global_values_by_address.setdefault(str(global_value.name).upper(), global_value)
+
+    def named(self, name):
+        """
+            Returns every global function and type method with the given name.
+        """
+        return list(self._by_name.get(name.lower(), ()))
+
+    def at_address(self, address):
+        """
+            Returns every function registered with the given implementation address. Several
+            script functions can share one implementation.
+        """
+        return list(self._by_address.get(address.upper(), ()))
+
+    def global_function(self, name):
+        return self._by_type.get("", { }).get(name.lower())
+
+    def method(self, type_name, name):
+        """
+            Returns the method of the given name registered on the given type, or None.
+        """
+        return self._by_type.get(self._type_key(type_name), { }).get(name.lower())
+
+    def methods(self, type_name):
+        return list(self._by_type.get(self._type_key(type_name), { }).values())
+
+    def types(self):
+        return [self._type_names[type_key] for type_key in self._by_type if type_key != ""]
+
+    def with_prefix(self, prefix, type_name=False):
+        """
+            Returns every function whose name starts with the given prefix, sorted by name.
+            Passing a type name (or None, for global functions) restricts the search to it.
+        """
+        if (type_name is False):
+            prefix_index = self._prefixes[None]
+        else:
+            prefix_index = self._prefixes.get(self._type_key(type_name))
+
+        if (prefix_index is None):
+            return [ ]
+        return prefix_index.find(prefix)
+
+    def global_value_at(self, address):
+        """
+            Returns the global value registered at the given address, or None. Global values
+            can't be looked up by script name, as the scraper never records one for them.
+        """
+        return self._global_values_by_address.get(address.upper())
+
+    # Helper Functions
+    def _type_key(self, type_name):
+        if (type_name is None):
+            return ""
+        return type_name.lower()
@@ -0,0 +1,433 @@
+"""
+    render.py
+
+    The rendering pipeline used by t2src. The results of a scrape are turned
+    into a flat stream of events (sections opening and closing, and the
+    entries within them) which is fed to any number of renderer backends at
+    once, so producing several output formats costs a single walk over the
+    scrape. Backends buffer their output and write it out in large chunks.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import re
+
+from xml.sax.saxutils import escape as _escape_html
+
+class ReferenceEvents(object):
+    """
+        Produces the event stream for a scrape. Every event is a tuple of (event, kind,
+        values) where event is one of "begin_document", "end_document", "begin_section",
+        "end_section" or "entry". Values are already adjusted for presentation (argument
+        counts exclude the object or function name, global values carry their $ prefix)
+        but not yet escaped for any particular format.
+
+        Inheritance values are lists of type names, nearest first, or None if the type
+        isn't in the inheritance table.
+    """
+    scrape = None
+
+    title = "Tribes 2 Engine Reference"
+    author = "Robert MacGregor"
+
+    global_function_categories = ("arithmetic", "audio")
+    """
+        Global functions that fall into one of these categories are listed in a section of
+        their own after the rest of the global functions.
+    """
+
+    def __init__(self, scrape):
+        self.scrape = scrape
+
+    def __iter__(self):
+        scrape = self.scrape
+        categories = self.categorised_global_functions()
+
+        yield ("begin_document", "document", (self.title, self.author))
+
+        for category in (None, ) + self.global_function_categories:
+            for event in self.global_function_events(category, categories[category]):
+                yield event
+
+        # Now the type methods
+        yield ("begin_section", "type_methods", (scrape.type_function_total, len(scrape.type_methods)))
+        for type_name in sorted(scrape.type_methods.keys()):
+            for event in self.type_events(type_name):
+                yield event
+        yield ("end_section", "type_methods", ())
+
+        # And global values
+        for event in self.global_value_events():
+            yield event
+
+        # Datablocks
+        yield ("begin_section", "datablocks", (len(scrape.datablocks), ))
+        for datablock_type in sorted(scrape.datablocks.keys()):
+            for event in self.datablock_events(datablock_type):
+                yield event
+        yield ("end_section", "datablocks", ())
+
+        yield ("end_document", "document", ())
+
+    def categorised_global_functions(self):
+        """
+            Sorts the global functions into their categories in one go, rather than removing
+            them from the list. Returns a dictionary of category to global functions, with the
+            general listing under None.
+        """
+        categories = { None: [ ] }
+        for category in self.global_function_categories:
+            categories[category] = [ ]
+
+        for global_function in self.scrape.global_functions:
+            categories[self.categorise(global_function)].append(global_function)
+
+        return categories
+
+    def global_function_events(self, category, global_functions):
+        # The general listing counts every global function, categorised or not
+        if (category is None):
+            kind = "global_functions"
+            count = self.scrape.global_function_count
+        else:
+            kind = category + "_functions"
+            count = len(global_functions)
+
+        yield ("begin_section", kind, (count, ))
+        for global_function in global_functions:
+            yield ("entry", "global_function", (global_function.name, global_function.address, global_function.description, global_function.min_args - 1, global_function.max_args - 1))
+        yield ("end_section", kind, ())
+
+    def type_events(self, type_name):
+        type_methods = self.scrape.type_methods[type_name]
+        yield ("begin_section", "type", (type_name, len(type_methods), self._inheritance(type_name)))
+
+        for type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs in type_methods:
+            yield ("entry", "type_method", (type_method_name, type_method_address, type_method_description, type_method_minargs - 1, type_method_maxargs - 1))
+
+        yield ("end_section", "type", ())
+
+    def global_value_events(self):
+        scrape = self.scrape
+
+        yield ("begin_section", "global_values", (len(scrape.global_values), ))
+        for global_value in scrape.global_values:
+            name = global_value.name
+            if (name[0] != "$"):
+                name = "$" + name
+
+            yield ("entry", "global_value", (name, scrape.primitive_type_mapping[global_value.type_name], global_value.address))
+        yield ("end_section", "global_values", ())
+
+    def datablock_events(self, datablock_type):
+        datablock = self.scrape.datablocks[datablock_type]
+        yield ("begin_section", "datablock", (datablock.name, len(datablock.properties), self._inheritance(datablock_type)))
+
+        # Property dictionaries don't keep the order fields were scraped in, and a scrape loaded from the
+        # cache can iterate them in another order than the scrape it was stored from did
+        for datablock_property in sorted(datablock.properties.values(), key=lambda datablock_property: datablock_property.name):
+            yield ("entry", "datablock_property", (datablock_property.name, datablock_property.address, datablock_property.type_name))
+
+        yield ("end_section", "datablock", ())
+
+    def categorise(self, global_function):
+        """
+            Returns the category a global function is listed under, or None for the general
+            listing.
+        """
+        name = global_function.name
+
+        if (len(name) != 0 and (name[0] == "m" or name.find("Vector") != -1 or name.find("Matrix") != -1)):
+            return "arithmetic"
+        elif (name.find("alx") != -1 or name.find("audio") != -1 or name.find("getAudio") != -1):
+            return "audio"
+        return None
+
+    # Helper Functions
+    def _inheritance(self, type_name):
+        if (type_name in self.scrape.type_name_inheritance):
+            return self.scrape.build_inheritance_tree(type_name)
+        return None
+
+class PageLink(object):
+    """
+        An event value linking to another page, for output split over several pages. Pages
+        are given as paths relative to the root of the output without their extension.
+    """
+    __slots__ = ("page", "title")
+
+    def __init__(self, page, title):
+        self.page = page
+        self.title = title
+
+    def __reduce__(self):
+        return (PageLink, (self.page, self.title))
+
+class Renderer(object):
+    """
+        Base renderer backend. Sections and entries are written out through per kind
+        templates, which subclasses provide along with the escaping rules of their format.
+        Output is collected into a buffer that is only written to the handle once it
+        reaches chunk_size.
+    """
+    handle = None
+    chunk_size = None
+
+    extension = None
+    """
+        File extension used when the output of this renderer is written next to another.
+    """
+
+    section_templates = None
+    """
+        Dictionary of section kind to (opening template, closing template).
+    """
+
+    entry_templates = None
+    """
+        Dictionary of entry kind to template.
+    """
+
+    page_links = None
+    """
+        Dictionary of type name to the page documenting it, set when rendering output split
+        over several pages. Inheritance listings then link to those pages rather than to
+        anchors within the same page.
+    """
+
+    page_depth = 0
+    """
+        How many directories below the root of the output the page being rendered is.
+    """
+
+    unknown_inheritance = None
+    inheritance_separator = None
+
+    _parts = None
+    _buffered = 0
+
+    def __init__(self, handle, chunk_size=1 << 16):
+        self.handle = handle
+        self.chunk_size = chunk_size
+        self._parts = [ ]
+
+    def begin_document(self, kind, values):
+        self.write(self.section_templates[kind][0] % self._format_values(values))
+
+    def end_document(self, kind, values):
+        self.write(self.section_templates[kind][1])
+        self.flush()
+
+    def begin_section(self, kind, values):
+        self.write(self.section_templates[kind][0] % self._format_values(values))
+
+    def end_section(self, kind, values):
+        self.write(self.section_templates[kind][1])
+
+    def entry(self, kind, values):
+        self.write(self.entry_templates[kind] % self._format_values(values))
+
+    def write(self, text):
+        self._parts.append(text)
+        self._buffered = self._buffered + len(text)
+
+        if (self._buffered >= self.chunk_size):
+            self.flush()
+
+    def flush(self):
+        self.handle.write("".join(self._parts))
+        self._parts = [ ]
+        self._buffered = 0
+
+    def escape(self, text):
+        return text
+
+    def format_inheritance(self, inheritance):
+        if (inheritance is None):
+            return self.unknown_inheritance
+
+        links = [ ]
+        for type_name in inheritance:
+            if (self.page_links is None):
+                links.append(self.anchor_link(type_name))
+            elif (type_name in self.page_links):
+                links.append(self.page_link(self.page_links[type_name], type_name))
+            else:
+                links.append(self.escape(type_name))
+
+        return self.inheritance_separator.join(links)
+
+    def anchor_link(self, type_name):
+        raise NotImplementedError()
+
+    def page_link(self, page, title):
+        raise NotImplementedError()
+
+    # Helper Functions
+    def _format_values(self, values):
+        result = [ ]
+        for value in values:
+            if (isinstance(value, str)):
+                value = self.escape(value)
+            elif (isinstance(value, PageLink)):
+                value = self.page_link(value.page, value.title)
+            elif (isinstance(value, list) or value is None):
+                value = self.format_inheritance(value)
+
+            result.append(value)
+
+        return tuple(result)
+
+class DokuWikiRenderer(Renderer):
+    """
+        The reference as it is published on the DokuWiki.
+    """
+    extension = ".txt"
+
+    section_templates = {
+        "document": ("====== %s ======\r\nCompiled by %s\r\n\r\n", ""),
+        "global_functions": ("===== Global Methods (%u total) =====\r\n\r\n", "\r\n"),
+        "arithmetic_functions": ("==== Arithmetic Methods (%u total) ====\r\n\r\n", "\r\n"),
+        "audio_functions": ("==== Audio Methods (%u total) ====\r\n\r\n", "\r\n"),
+        "type_methods": ("===== Type Methods (%u total methods, %u total types) =====\r\n\r\n", ""),
+        "type": ("==== %s ====\r\n%u total native methods\r\n\r\nInheritance: %s\r\n", "\r\n"),
+        "global_values": ("===== Global Values (%u total): =====\r\n\r\n", "\r\n"),
+        "datablocks": ("===== Datablocks (%u total) =====\r\n", ""),
+        "datablock": ("==== %s ====\r\nTotal Properties: %u\r\n\r\nInheritance: %s\r\n", ""),
+    }
+
+    entry_templates = {
+        "global_function": "=== %s ===\r\nAddress in Executable: 0x%s\r\n\r\nDescription: %s\r\n\r\nMinimum Arguments: %u\r\n\r\nMaximum Arguments: %u\r\n",
+        "type_method": "=== %s ===\r\nAddress in Executable: 0x%s\r\n\r\nDescription: %s\r\n\r\nMinimum Arguments: %u\r\n\r\nMaximum Arguments: %u\r\n",
+        "global_value": "=== %s ===\r\nType: %s\r\n\r\nAddress in Executable: 0x%s\r\n\r\n",
+        "datablock_property": "=== %s ===\r\nOffset: %s\r\nType: %s\r\n",
+        "page": "  * %s (%u total)\r\n",
+    }
+
+    unknown_inheritance = "<Unknown>"
+    inheritance_separator = " -> "
+
+    def anchor_link(self, type_name):
+        return "[[#%s]]" % type_name
+
+    def page_link(self, page, title):
+        # Links are relative to the namespace of the page they're on
+        if (self.page_depth == 0):
+            namespace = "."
+        else:
+            namespace = ":".join([".."] * self.page_depth)
+
+        return "[[%s:%s|%s]]" % (namespace, page.replace("/", ":"), title)
+
+class MarkdownRenderer(Renderer):
+    extension = ".md"
+
+    section_templates = {
+        "document": ("# %s\n\nCompiled by %s\n\n", ""),
+        "global_functions": ("## Global Methods (%u total)\n\n", ""),
+        "arithmetic_functions": ("### Arithmetic Methods (%u total)\n\n", ""),
+        "audio_functions": ("### Audio Methods (%u total)\n\n", ""),
+        "type_methods": ("## Type Methods (%u total methods, %u total types)\n\n", ""),
+        "type": ("### %s\n\n%u total native methods\n\nInheritance: %s\n\n", ""),
+        "global_values": ("## Global Values (%u total)\n\n", ""),
+        "datablocks": ("## Datablocks (%u total)\n\n", ""),
+        "datablock": ("### %s\n\nTotal Properties: %u\n\nInheritance: %s\n\n", ""),
+    }
+
+    entry_templates = {
+        "global_function": "#### %s\n\n* Address in Executable: 0x%s\n* Description: %s\n* Minimum Arguments: %u\n* Maximum Arguments: %u\n\n",
+        "type_method": "#### %s\n\n* Address in Executable: 0x%s\n* Description: %s\n* Minimum Arguments: %u\n* Maximum Arguments: %u\n\n",
+        "global_value": "#### %s\n\n* Type: %s\n* Address in Executable: 0x%s\n\n",
+        "datablock_property": "#### %s\n\n* Offset: %s\n* Type: %s\n\n",
+        "page": "* %s (%u total)\n",
+    }
+
+    _special_characters = re.compile(r"([\\`*_\[\]<>#|])")
+
+    def escape(self, text):
+        return self._special_characters.sub(r"\\\1", text)
+
+    unknown_inheritance = "&lt;Unknown&gt;"
+    inheritance_separator = " -> "
+
+    def anchor_link(self, type_name):
+        return "[%s](#%s)" % (self.escape(type_name), type_name.lower())
+
+    def page_link(self, page, title):
+        return "[%s](%s%s%s)" % (self.escape(title), "../" * self.page_depth, page, self.extension)
+
+class HTMLRenderer(Renderer):
+    """
+        A single static HTML page. Types and datablocks are given anchors named after them
+        in lower case, which the inheritance listings link to.
+    """
+    extension = ".html"
+
+    section_templates = {
+        "document": ("<!DOCTYPE html>\n<html>\n<head>\n<meta charset=\"utf-8\">\n<title>%s</title>\n</head>\n<body>\n<h1>%s</h1>\n<p>Compiled by %s</p>\n", "</body>\n</html>\n"),
+        "global_functions": ("<h2>Global Methods (%u total)</h2>\n", ""),
+        "arithmetic_functions": ("<h3>Arithmetic Methods (%u total)</h3>\n", ""),
+        "audio_functions": ("<h3>Audio Methods (%u total)</h3>\n", ""),
+        "type_methods": ("<h2>Type Methods (%u total methods, %u total types)</h2>\n", ""),
+        "type": ("<h3 id=\"%s\">%s</h3>\n<p>%u total native methods</p>\n<p>Inheritance: %s</p>\n", ""),
+        "global_values": ("<h2>Global Values (%u total)</h2>\n", ""),
+        "datablocks": ("<h2>Datablocks (%u total)</h2>\n", ""),
+        "datablock": ("<h3 id=\"%s\">%s</h3>\n<p>Total Properties: %u</p>\n<p>Inheritance: %s</p>\n", ""),
+    }
+
+    entry_templates = {
+        "global_function": "<h4>%s</h4>\n<dl><dt>Address in Executable</dt><dd>0x%s</dd><dt>Description</dt><dd>%s</dd><dt>Minimum Arguments</dt><dd>%u</dd><dt>Maximum Arguments</dt><dd>%u</dd></dl>\n",
+        "type_method": "<h4>%s</h4>\n<dl><dt>Address in Executable</dt><dd>0x%s</dd><dt>Description</dt><dd>%s</dd><dt>Minimum Arguments</dt><dd>%u</dd><dt>Maximum Arguments</dt><dd>%u</dd></dl>\n",
+        "global_value": "<h4>%s</h4>\n<dl><dt>Type</dt><dd>%s</dd><dt>Address in Executable</dt><dd>0x%s</dd></dl>\n",
+        "datablock_property": "<h4>%s</h4>\n<dl><dt>Offset</dt><dd>%s</dd><dt>Type</dt><dd>%s</dd></dl>\n",
+        "page": "<p>%s (%u total)</p>\n",
+    }
+
+    def begin_document(self, kind, values):
+        title, author = self._format_values(values)
+        self.write(self.section_templates[kind][0] % (title, title, author))
+
+    def begin_section(self, kind, values):
+        # Types and datablocks are headed by their name twice over, once as the anchor
+        if (kind == "type" or kind == "datablock"):
+            name, count, inheritance = self._format_values(values)
+            self.write(self.section_templates[kind][0] % (self.escape(values[0].lower()), name, count, inheritance))
+        else:
+            Renderer.begin_section(self, kind, values)
+
+    def escape(self, text):
+        return _escape_html(text, { "\"": "&quot;" })
+
+    unknown_inheritance = "&lt;Unknown&gt;"
+    inheritance_separator = " &rarr; "
+
+    def anchor_link(self, type_name):
+        return "<a href=\"#%s\">%s</a>" % (self.escape(type_name.lower()), self.escape(type_name))
+
+    def page_link(self, page, title):
+        return "<a href=\"%s%s%s\">%s</a>" % ("../" * self.page_depth, self.escape(page), self.extension, self.escape(title))
+
+renderers = {
+    "dokuwiki": DokuWikiRenderer,
+    "markdown": MarkdownRenderer,
+    "html": HTMLRenderer,
+}
+"""
+    Renderer backends by format name. Other backends can be registered here to make them
+    available to t2src.
+"""
+
+def render(events, backends):
+    """
+        Feeds every event to every one of the given renderer backends, in a single pass
+        over the events.
+    """
+    handlers = { }
+    for event in ("begin_document", "end_document", "begin_section", "end_section", "entry"):
+        handlers[event] = [getattr(backend, event) for backend in backends]
+
+    for event, kind, values in events:
+        for handler in handlers[event]:
+            handler(kind, values)
@@ -11,18 +11,31 @@
     Copyright (c) 2016 Robert MacGregor
 """
 
+import os
 import re
+import bz2
+import gzip
+import mmap
+import array
+import bisect
+import codecs
 import string
+import hashlib
+import multiprocessing
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from stats import ScrapeStats
 
 class EngineComponent(object):
     """
         The base representation type for all the data the scraper will be
         pulling from the pseudo source code.
     """
-    name = None
-    address = None
-    type_name = None
-    description = None
+    __slots__ = ("name", "address", "type_name", "description")
 
     def __init__(self, name, address, type_name, description):
         self.name = name
@@ -30,14 +43,17 @@ class EngineComponent(object):
         self.type_name = type_name
         self.description = description
 
+    def __reduce__(self):
+        # Pickle through the constructor, which is a lot more compact than slot state
+        return (self.__class__, (self.name, self.address, self.type_name, self.description))
+
 class Function(EngineComponent):
     """
         The virtual representation of a callable engine function from Torque
         Script. It contains a description, the address, argument information
         and if applicable, the object typename it is bound to.
     """
-    min_args = None
-    max_args = None
+    __slots__ = ("min_args", "max_args")
 
     def __init__(self, name, address, type_name, description, min_args, max_args):
         EngineComponent.__init__(self, name, address, type_name, description)
@@ -45,26 +61,414 @@ class Function(EngineComponent):
         self.min_args = min_args
         self.max_args = max_args
 
+    def __reduce__(self):
+        return (Function, (self.name, self.address, self.type_name, self.description, self.min_args, self.max_args))
+
 class GlobalVariable(EngineComponent):
+    __slots__ = ()
+
     def __init__(self, name, address, type_name):
         EngineComponent.__init__(self, name, address, type_name, None)
 
+    def __reduce__(self):
+        return (GlobalVariable, (self.name, self.address, self.type_name))
+
 class Datablock(EngineComponent):
     """
         The virtual representation of the Torque Game Engine datablock used
         for synchronization of custom simulation parameters across the network.
     """
-    properties = None
+    __slots__ = ("properties",)
 
     class Property(EngineComponent):
+        __slots__ = ()
+
         def __init__(self, name, address, type_name):
             EngineComponent.__init__(self, name, address, type_name, None)
 
+        def __reduce__(self):
+            # Nested classes can't be looked up by pickle, so route through the module
+            return (_datablock_property, (self.name, self.address, self.type_name))
+
     def __init__(self, name):
         EngineComponent.__init__(self, name, None, None, None)
 
         self.properties = { }
 
+    def __reduce__(self):
+        return (Datablock, (self.name,), self.properties)
+
+    def __setstate__(self, properties):
+        self.properties = properties
+
+class FunctionIndex(object):
+    """
+        A sorted index of every decompiled function header in a buffer, used for resolving
+        which function contains a given offset in logarithmic time rather than searching
+        backwards through the buffer for the nearest header.
+    """
+    offsets = None
+    addresses = None
+    end = None
+
+    def __init__(self, end=0):
+        self.offsets = array.array("L")
+        self.addresses = [ ]
+        self.end = end
+
+    @classmethod
+    def from_buffer(cls, file_buffer, start=0):
+        result = cls(len(file_buffer))
+
+        for header in Scraper.function_header_expression.finditer(file_buffer, start):
+            result.add(header.start(), header.group(1))
+
+        return result
+
+    def add(self, offset, address):
+        # Headers have to be added in file order to keep the index sorted
+        self.offsets.append(offset)
+        self.addresses.append(hex(int(address, 16))[2:].upper())
+
+    def find(self, offset):
+        """
+            Returns the address of the function containing the given offset, or None if the
+            offset comes before the first function header. An offset on a function header
+            belongs to the function it starts, as it does for span.
+        """
+        index = bisect.bisect_right(self.offsets, offset) - 1
+
+        if (index < 0):
+            return None
+        return self.addresses[index]
+
+    def span(self, offset):
+        """
+            Returns a (start, end) tuple of the function containing the given offset, or None
+            if the offset comes before the first function header.
+        """
+        index = bisect.bisect_right(self.offsets, offset) - 1
+
+        if (index < 0):
+            return None
+        if (index + 1 < len(self.offsets)):
+            return (self.offsets[index], self.offsets[index + 1])
+        return (self.offsets[index], self.end)
+
+    def __len__(self):
+        return len(self.offsets)
+
+class CallArguments(object):
+    """
+        The arguments of a single call, split on the commas outside of string literals,
+        character literals and parentheses. Arguments are held as (start, end) offsets into
+        the buffer the call was parsed from, so no text is copied out of the buffer until
+        one of them is actually read.
+
+        Parsing stops early at a semicolon or brace outside of a literal, or at an
+        unterminated literal, leaving only the arguments found up to there.
+    """
+    __slots__ = ("buffer", "spans", "end")
+
+    def __init__(self, file_buffer, argument_start, expected_count=None):
+        """
+            argument_start is the offset just past the opening parenthesis. Calls known to
+            take expected_count arguments are split with a single match where possible.
+        """
+        self.buffer = file_buffer
+
+        if (expected_count is not None):
+            argument_list = Scraper.argument_list_expression(expected_count).match(file_buffer, argument_start)
+
+            if (argument_list is not None):
+                self.spans = argument_list.regs[1:]
+                self.end = argument_list.end()
+                return
+
+        self.spans = [ ]
+
+        position = argument_start
+        while (True):
+            argument = Scraper.argument_expression.match(file_buffer, position)
+
+            if (argument is None):
+                self._walk(position)
+                break
+
+            self.spans.append(argument.span(1))
+            position = argument.end()
+
+            if (argument.group(2) == ")"):
+                self.end = position
+                break
+
+        # A call without any arguments shows up as a single empty one
+        if (len(self.spans) == 1 and self.spans[0][0] == self.spans[0][1]):
+            self.spans = [ ]
+
+    def text(self, index):
+        """
+            Returns the text of an argument with surrounding whitespace stripped. Line endings
+            within it are joined away as the buffer may have been mapped rather than read.
+        """
+        start, end = self.spans[index]
+        return self.buffer[start:end].replace("\r\n", " ").strip()
+
+    def string(self, index):
+        """
+            Returns the contents of the string literals making up an argument, casts and
+            escape sequences left as they are. Arguments without any literals in them come
+            back as their plain text.
+        """
+        start, end = self.spans[index]
+        literal = Scraper.string_literal_expression.search(self.buffer, start, end)
+
+        if (literal is None):
+            return self.text(index)
+        elif (self.buffer.find("\"", literal.end(), end) == -1):
+            return literal.group(0)[1:-1]
+
+        # Adjacent literals are concatenated, as the compiler would
+        return "".join(literal.group(0)[1:-1] for literal in Scraper.string_literal_expression.finditer(self.buffer, start, end))
+
+    def integer(self, index):
+        """
+            Returns an argument as an int, raising ValueError if it isn't a decimal integer.
+        """
+        start, end = self.spans[index]
+        return int(self.buffer[start:end])
+
+    def address(self, index):
+        """
+            Returns whatever follows the first underscore in an argument, which is the
+            address of a sub_XXXX or dword_XXXX style reference.
+        """
+        start, end = self.spans[index]
+        text = self.buffer[start:end]
+
+        return text[text.find("_") + 1:].rstrip("\" \r\n\t").lstrip()
+
+    def __len__(self):
+        return len(self.spans)
+
+    # Helper Functions
+    def _walk(self, position):
+        # Nested more deeply than the expression covers, or malformed, so walk it instead
+        depth = 0
+        argument_start = position
+        while (position < len(self.buffer)):
+            character = self.buffer[position]
+
+            if (character == "\"" or character == "'"):
+                literal = Scraper.literal_expression.match(self.buffer, position)
+                if (literal is None):
+                    break
+
+                position = literal.end()
+                continue
+            elif (character == "("):
+                depth = depth + 1
+            elif (character == ")"):
+                if (depth == 0):
+                    self.spans.append((argument_start, position))
+                    self.end = position + 1
+                    return
+
+                depth = depth - 1
+            elif (character == "," and depth == 0):
+                self.spans.append((argument_start, position))
+                argument_start = position + 1
+            elif (character in ";{}"):
+                break
+
+            position = position + 1
+
+        self.end = position
+
+class CallSite(object):
+    """
+        A single sub_XXXX call in a CallSiteIndex. Nothing is read from the buffer until one
+        of the properties is accessed.
+    """
+    __slots__ = ("index", "call_id")
+
+    def __init__(self, index, call_id):
+        self.index = index
+        self.call_id = call_id
+
+    @property
+    def callee(self):
+        return self.index.callees[self.call_id]
+
+    @property
+    def offset(self):
+        return self.index.offsets[self.call_id]
+
+    @property
+    def argument_span(self):
+        """
+            (start, end) offsets of the argument list within the buffer, not including the
+            parentheses.
+        """
+        return (self.index.argument_starts[self.call_id], self.index.argument_ends[self.call_id] - 1)
+
+    @property
+    def argument_text(self):
+        start, end = self.argument_span
+        return self.index.buffer[start:end]
+
+    @property
+    def arguments(self):
+        return self.index.arguments(self.call_id)
+
+    @property
+    def function(self):
+        """
+            Address of the decompiled function making the call.
+        """
+        return self.index.function(self.call_id)
+
+class CallSiteIndex(object):
+    """
+        An index of every sub_XXXX call in a buffer by callee address, built in a single pass.
+        Call sites are numbered in file order and stored in flat arrays: the offset of the
+        call, the start of its argument list and the end of the call (just past the closing
+        parenthesis, or wherever the arguments stopped making sense if it's malformed). Calls
+        nested within the arguments of another call are indexed as well, while anything
+        within string and character literals is skipped over, as are the definitions of the
+        functions themselves.
+    """
+    buffer = None
+    function_index = None
+
+    callees = None
+    offsets = None
+    argument_starts = None
+    argument_ends = None
+
+    _by_callee = None
+
+    def __init__(self, file_buffer):
+        self.buffer = file_buffer
+        self.function_index = FunctionIndex(len(file_buffer))
+
+        self.callees = [ ]
+        self.offsets = array.array("L")
+        self.argument_starts = array.array("L")
+        self.argument_ends = array.array("L")
+
+        self._by_callee = { }
+
+    @classmethod
+    def from_buffer(cls, file_buffer, start=0):
+        result = cls(file_buffer)
+        function_index = result.function_index
+
+        for token in Scraper.call_site_expression.finditer(file_buffer, start):
+            token_type = token.lastindex
+
+            # String and character literals have no groups and are simply skipped
+            if (token_type == 1):
+                function_index.add(token.start(), token.group(1))
+            elif (token_type == 2):
+                argument_end = result._argument_end(token.end())
+
+                if (Scraper.definition_expression.match(file_buffer, argument_end) is None):
+                    result.add(token.group(2), token.start(), token.end(), argument_end)
+
+        return result
+
+    def add(self, callee, offset, argument_start, argument_end):
+        # Calls have to be added in file order so call ids stay sorted by offset
+        callee = callee.upper()
+        call_id = len(self.offsets)
+
+        self.callees.append(callee)
+        self.offsets.append(offset)
+        self.argument_starts.append(argument_start)
+        self.argument_ends.append(argument_end)
+
+        if (callee not in self._by_callee):
+            self._by_callee[callee] = array.array("L")
+        self._by_callee[callee].append(call_id)
+
+    def calls_to(self, address):
+        """
+            Returns a CallSite for every call to the given address, in file order.
+        """
+        return [CallSite(self, call_id) for call_id in self._by_callee.get(address.upper(), ())]
+
+    def call_ids(self, addresses):
+        """
+            Returns the ids of every call to any of the given addresses, in file order.
+        """
+        addresses = set(address.upper() for address in addresses)
+
+        if (len(addresses) == 1):
+            return self._by_callee.get(addresses.pop(), ())
+        return sorted(call_id for address in addresses for call_id in self._by_callee.get(address, ()))
+
+    def call_site(self, call_id):
+        return CallSite(self, call_id)
+
+    def call_count(self, address):
+        return len(self._by_callee.get(address.upper(), ()))
+
+    def callee_addresses(self):
+        return list(self._by_callee.keys())
+
+    def source(self, call_id):
+        """
+            Returns the text of the whole call, from sub_ to the closing parenthesis, with line
+            endings joined away as the buffer may have been mapped rather than read.
+        """
+        return self.buffer[self.offsets[call_id]:self.argument_ends[call_id]].replace("\r\n", " ")
+
+    def arguments(self, call_id, expected_count=None):
+        """
+            Parses the arguments of a call into a CallArguments.
+        """
+        return CallArguments(self.buffer, self.argument_starts[call_id], expected_count)
+
+    def function(self, call_id):
+        return self.function_index.find(self.offsets[call_id])
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return (CallSite(self, call_id) for call_id in range(len(self.offsets)))
+
+    # Helper Functions
+    def _argument_end(self, argument_start):
+        span = Scraper.argument_span_expression.match(self.buffer, argument_start)
+        if (span is not None):
+            return span.end()
+
+        return CallArguments(self.buffer, argument_start).end
+
+def _datablock_property(name, address, type_name):
+    return Datablock.Property(name, address, type_name)
+
+class _LazyOutput(object):
+    """
+        Class level stand-in for one of the outputs of the Scraper. Scrapers assign their
+        outputs as instance attributes, which take precedence over this, except for lazy
+        scrapes which leave them unassigned until the category producing them is first
+        accessed. Anything else gets the default.
+    """
+    def __init__(self, name, category, default=None):
+        self.name = name
+        self.category = category
+        self.default = default
+
+    def __get__(self, instance, owner):
+        if (instance is None or self.category not in instance._pending_categories):
+            return self.default
+
+        instance._scan_category(self.category)
+        return instance.__dict__[self.name]
+
 class Scraper(object):
     """
         The meat and potatoes of the scraper system. This is your primary
@@ -174,18 +578,109 @@ class Scraper(object):
         for a single datablock type.
     """
 
+    _string_literal_template = r'"[^"\\\r\n]*(?:\\.[^"\\\r\n]*)*"'
+    _character_literal_template = r"'[^'\\\r\n]*(?:\\.[^'\\\r\n]*)*'"
+    _function_header_template = r"//----- \(([0-9A-Fa-f]+)\)"
+
+    _single_pass_expression_template = "%s|%s|%s|sub_(?=(?:%%s)(?![0-9A-Fa-f])\\s*\\(([^;{\"']*(?:(?:%s|%s)[^;{\"']*)*;))(?:%%s)(?![0-9A-Fa-f])" % (_string_literal_template,
+        _character_literal_template, _function_header_template, _string_literal_template, _character_literal_template)
+    """
+        Tokenizer expression used by the single pass scan engine. It recognizes string
+        and character literals (so their contents are skipped over), function headers
+        (group 1 being the address of the function) and registration calls. Registrar
+        addresses are an alternation of a named group per category, so the name of the last
+        group matched classifies a registration; group 2 holds everything after its opening
+        parenthesis up to the terminating semicolon, checked ahead of the address so that
+        the category group is always the last to match. It's formatted with every registrar
+        address, so other calls are passed over before their arguments are looked at, and
+        then with the category groups.
+
+        It's compiled without re.IGNORECASE: only then does every alternative start with a
+        plain character, which lets the expression engine skip straight to the next quote,
+        slash or s rather than trying the whole expression at every byte of the buffer.
+        Registrar addresses still match in either case; sub_ has to be lower case, as it
+        does for the call site index.
+    """
+
+    # Call site material
+    _literal_template = "%s|%s" % (_string_literal_template, _character_literal_template)
+    _nested_template = "\\([^()\"';{}]*(?:(?:%s|\\([^()\"';{}]*(?:(?:%s)[^()\"';{}]*)*\\))[^()\"';{}]*)*\\)" % (_literal_template, _literal_template)
+    """
+        Matches a parenthesized expression with up to one further level of parentheses
+        within it. Runs of plain characters are consumed in one go, so the expression engine
+        only has to try the alternatives at literals and parentheses.
+    """
+
+    _argument_span_template = "[^()\"';{}]*(?:(?:%s|%s)[^()\"';{}]*)*\\)" % (_literal_template, _nested_template)
+    """
+        Matches the rest of an argument list up to and including its closing parenthesis,
+        with up to two levels of parentheses within it. C argument lists never contain
+        semicolons or braces outside of literals, so a match never runs past the statement.
+    """
+
+    _argument_body_template = "[^(),\"';{}]*(?:(?:%s|%s)[^(),\"';{}]*)*" % (_literal_template, _nested_template)
+    """
+        Matches a single argument. Commas only split arguments outside of literals and
+        parentheses.
+    """
+
+    _argument_template = "\\s*(%s)([,)])" % _argument_body_template
+    """
+        Matches a single argument along with the comma or closing parenthesis after it, group
+        1 being the argument and group 2 the delimiter.
+    """
+
+    _argument_list_expressions = { }
+    """
+        Compiled argument list expressions by argument count.
+    """
+
+    _argument_layouts = {
+        "global_functions": { "count": 5, "name": 0, "address": 1, "description": 2, "min_args": 3, "max_args": 4 },
+        "type_methods": { "count": 7, "type_name": 1, "name": 2, "address": 3, "description": 4, "min_args": 5, "max_args": 6 },
+        "global_values": { "count": 3, "type": 1, "address": 2 },
+        "datablocks": { "count": 5, "name": 0, "address": 2 },
+    }
+    """
+        The number of arguments taken by the registrars of every category and the position of
+        every field among them. The engines that never mask the buffer read registrations
+        through these, so titles whose registrars take their arguments in another order only
+        need a profile of their own.
+    """
+
+    call_site_expression = re.compile("%s|%s|%s|sub_([0-9A-Fa-f]+)\\s*\\(" % (_string_literal_template, _character_literal_template, _function_header_template))
+    argument_span_expression = re.compile(_argument_span_template)
+    argument_expression = re.compile(_argument_template)
+    literal_expression = re.compile(_literal_template)
+    string_literal_expression = re.compile(_string_literal_template)
+    definition_expression = re.compile(r"\s*\{")
+
     # Hacks
     string_expression = re.compile("\" *\S+\" *")
 
-    # Global method material
-    global_method_add_expression = re.compile(_registration_expression_template % string.join(_global_function_registry, "|"), re.IGNORECASE)
-    type_method_add_expression = re.compile(_registration_expression_template % string.join(_type_function_registry, "|"), re.IGNORECASE)
-    datablock_property_add_expression = re.compile(_registration_expression_template % string.join(_datablock_property_registry, "|"), re.IGNORECASE)
-    global_value_add_expression = re.compile(_registration_expression_template % string.join(_global_value_registry, "|"), re.IGNORECASE)
+    # Registration material, compiled from the registries by compile_registrations
+    global_method_add_expression = None
+    type_method_add_expression = None
+    datablock_property_add_expression = None
+    global_value_add_expression = None
+    single_pass_expression = None
+
+    registrar_expression = None
+    """
+        Matches any registrar address following an underscore. Every registration call any
+        of the engines would handle holds a match, so text without one can't hold a
+        registration and is never scanned when tracking blocks.
+    """
+
+    # Single pass material
+    function_header_expression = re.compile(_function_header_template)
+
+    # Field material
+    non_ascii_expression = re.compile("[\x80-\xff]")
 
-    type_function_total = 0
-    global_function_count = 0
-    type_function_counts = None
+    type_function_total = _LazyOutput("type_function_total", "type_methods", 0)
+    global_function_count = _LazyOutput("global_function_count", "global_functions", 0)
+    type_function_counts = _LazyOutput("type_function_counts", "type_methods")
 
     primitive_type_mapping = [
         "Unknown",
@@ -260,13 +755,737 @@ class Scraper(object):
     }
 
     # Outputs
-    global_functions = None
-    type_methods = None
-    global_values = None
+    global_functions = _LazyOutput("global_functions", "global_functions")
+    type_methods = _LazyOutput("type_methods", "type_methods")
+    global_values = _LazyOutput("global_values", "global_values")
+
+    datablocks = _LazyOutput("datablocks", "datablocks")
+
+    function_index = _LazyOutput("function_index", "datablocks")
+    """
+        FunctionIndex of the function headers in the scanned buffer. Offsets are relative to
+        the buffer the scan engines ran over.
+    """
+
+    blocks = None
+    """
+        When blocks are tracked, a list of (digest, results) tuples for every function block in
+        file order. The results are a scraper holding only the registrations made within that
+        block, or None if it made none.
+    """
+
+    stats = None
+    """
+        ScrapeStats of the phases this scrape went through.
+    """
 
-    datablocks = None
+    _type_ancestry = None
+    _method_tables = None
+    _field_tables = None
 
-    def __init__(self, filename):
+    scanned_block_count = 0
+    reused_block_count = 0
+
+    engine = None
+    configuration = None
+    """
+        The scan engine this scrape was made with and its configuration_digest. Blocks are only
+        reused from a previous scrape with both the same, as results differ between engines.
+    """
+
+    window_prefix = 0
+    """
+        Length of the copied function header a streamed window starts with, if any.
+    """
+
+    _pending_categories = ( )
+    """
+        Categories a lazy scrape has yet to scan, along with the engine and the prepared
+        buffer to scan them from.
+    """
+    _lazy_scan = None
+
+    scan_engines = ("regex", "single_pass", "call_index")
+
+    scrape_categories = ("global_functions", "type_methods", "global_values", "datablocks")
+
+    shards_per_process = 4
+    """
+        How many shards the buffer is cut into per worker process when scraping in parallel.
+        Having a few more shards than processes keeps the pool busy when functions are unevenly
+        distributed throughout the file.
+    """
+
+    window_memory_factor = 8
+    """
+        Streamed scrapes read windows of their memory limit divided by this. A window is
+        held alongside the one before it while being cut, and the regex engine holds a
+        masked copy of it on top, so this leaves room for the scan engines and the results
+        of the window.
+    """
+
+    skipped_line_count = 33350
+
+    default_memory_limit = 256 << 20
+    """
+        Memory limit of compressed inputs scraped without one, as those are always streamed.
+    """
+
+    compressed_extensions = {
+        ".gz": "gzip",
+        ".bz2": "bz2",
+        ".xz": "lzma",
+    }
+    """
+        Compression of input files by extension. Inputs with one of these extensions are
+        decompressed as they're streamed, so the decompressed text is never written to disk
+        or held in memory as a whole.
+    """
+
+    source_encoding = None
+    """
+        The codec the string literals of the input are in, for inputs with names or
+        descriptions that aren't ASCII. Inputs are scanned as bytes whatever it is; only the
+        names and descriptions taken from them are decoded with it, and then stored encoded
+        as UTF-8. Fields that are pure ASCII, nearly all of them, are left alone. When None
+        fields are stored exactly as they appear in the input.
+    """
+
+    def __init__(self, filename, engine="regex", use_mmap=False, processes=None, track_blocks=False, previous=None, stats=None, lazy=False, memory_limit=None,
+        use_bytes=False, source_encoding=None):
+        """
+            Passing the scraper of an earlier decompilation as previous re-scrapes incrementally:
+            only function blocks whose content changed since are scanned again, everything else
+            is taken from the previous results. Incremental scrapes always track their blocks, so
+            the result can be passed as previous in turn. Blocks are only reused from a scrape
+            made with the same engine and configuration_digest; given any other, everything is
+            scanned again.
+
+            Tracking blocks costs more than a plain scrape, as every block with a registration
+            in it is scanned on its own: 1.3 to 2 times as long on the benchmark input,
+            depending on the engine. A re-scrape reusing nearly every block still loads, hashes
+            and merges the whole input, which took about 0.7s there against 2s for a plain
+            scrape with the regex or call_index engines but only 1s with single_pass. Incremental
+            mode pays off for the slower engines when a decompilation is scraped again after
+            small changes; with single_pass a plain scrape is about as quick.
+
+            A ScrapeStats may be passed in to set up profiling of one of the phases, otherwise
+            a fresh one is used.
+
+            Lazy scrapes only prepare the buffer up front. Every category of outputs is then
+            scanned the first time one of its attributes is accessed, so a scrape that only
+            needs the global values never pays for the rest. The buffer is held on to until
+            every category has been scanned. The single_pass engine scans every category on
+            the first access instead, as it finds them all in the same walk over the buffer.
+
+            Passing a memory_limit in bytes streams the file instead of loading it, scanning
+            it a window at a time so the input is never held in memory as a whole. Compressed
+            inputs are always streamed, within default_memory_limit unless given a limit.
+
+            Passing use_bytes reads the input as raw bytes and scans it from the end of the
+            declarations onwards, as mapped inputs are, rather than splitting the whole file
+            into lines and joining them back together first. The results are the same.
+        """
+        self._check_engine(engine)
+        self._check_encoding(source_encoding)
+        if (lazy and (track_blocks or previous is not None or (processes is not None and processes > 1))):
+            raise ValueError("Lazy scrapes can't track blocks or scan in parallel")
+        if (self.compression(filename) is not None):
+            if (use_mmap):
+                raise ValueError("Compressed inputs can't be mapped")
+            if (memory_limit is None):
+                memory_limit = self.default_memory_limit
+
+        if (memory_limit is not None and (use_mmap or lazy or track_blocks or previous is not None or (processes is not None and processes > 1))):
+            raise ValueError("Streamed scrapes can't be mapped, lazy, track blocks or scan in parallel")
+
+        self.stats = ScrapeStats() if stats is None else stats
+        if (source_encoding is not None):
+            self.source_encoding = source_encoding
+
+        self.engine = engine
+        self.configuration = self.configuration_digest(engine, self.source_encoding)
+
+        if (memory_limit is not None):
+            self._reset_outputs()
+            self._scan_stream(engine, filename, memory_limit)
+            return
+
+        with self.stats.phase("load") as phase:
+            if (use_mmap):
+                file_buffer, start = self._map_buffer(filename)
+            elif (use_bytes):
+                file_buffer, start = self._read_bytes(filename)
+            else:
+                file_buffer, start = self._read_buffer(filename), 0
+
+            phase.bytes_scanned = len(file_buffer)
+
+        if (lazy):
+            self._prepare_lazy(engine, file_buffer, start)
+            return
+
+        self._reset_outputs()
+
+        try:
+            if (track_blocks or previous is not None):
+                self._scan_blocks(engine, file_buffer, start, previous)
+            elif (processes is not None and processes > 1):
+                self._scan_parallel(engine, file_buffer, start, processes)
+            else:
+                self._scan(engine, file_buffer, start)
+        finally:
+            if (use_mmap and isinstance(file_buffer, mmap.mmap)):
+                file_buffer.close()
+
+    @classmethod
+    def registries(cls):
+        """
+            Returns (category, registrar addresses) for every category, in scan order.
+        """
+        return (("global_functions", cls._global_function_registry), ("type_methods", cls._type_function_registry),
+            ("global_values", cls._global_value_registry), ("datablocks", cls._datablock_property_registry))
+
+    @classmethod
+    def compile_registrations(cls):
+        """
+            Compiles the registration expressions of the scan engines from the registries of the
+            class. Subclasses with registries of their own, such as those built from profiles,
+            have to call this once they're defined.
+        """
+        expressions = { }
+        for category, registry in cls.registries():
+            # An empty alternation would match every call there is, so make it match none instead
+            expressions[category] = string.join(registry, "|") if len(registry) != 0 else "(?!)"
+
+        cls.global_method_add_expression = re.compile(cls._registration_expression_template % expressions["global_functions"], re.IGNORECASE)
+        cls.type_method_add_expression = re.compile(cls._registration_expression_template % expressions["type_methods"], re.IGNORECASE)
+        cls.datablock_property_add_expression = re.compile(cls._registration_expression_template % expressions["datablocks"], re.IGNORECASE)
+        cls.global_value_add_expression = re.compile(cls._registration_expression_template % expressions["global_values"], re.IGNORECASE)
+
+        for category, registry in cls.registries():
+            if (len(registry) != 0):
+                expressions[category] = string.join([_either_case(address) for address in registry], "|")
+
+        registrars = string.join([expressions[category] for category, registry in cls.registries()], "|")
+        category_groups = string.join(["(?P<%s>%s)" % (category, expressions[category]) for category, registry in cls.registries()], "|")
+        cls.single_pass_expression = re.compile(cls._single_pass_expression_template % (registrars, category_groups))
+        cls.registrar_expression = re.compile("_(?:%s)" % registrars)
+
+    @classmethod
+    def configuration_digest(cls, engine="regex", source_encoding=None):
+        """
+            Digest of everything besides the input that scrape results depend on: the engine and
+            source encoding along with the registry, argument layout and type tables of the class.
+        """
+        configuration = hashlib.sha1(engine)
+
+        # Left out when not given, so results cached before encodings could be given stay valid
+        if (source_encoding is not None):
+            configuration.update(codecs.lookup(source_encoding).name)
+
+        for table in (cls._global_function_registry, cls._type_function_registry, cls._datablock_property_registry, cls._global_value_registry,
+            sorted((category, sorted(layout.items())) for category, layout in cls._argument_layouts.items()),
+            sorted(cls._datablock_type_table.items()), sorted(cls.type_name_inheritance.items())):
+            configuration.update(repr(table))
+
+        return configuration.hexdigest()
+
+    @classmethod
+    def _check_engine(cls, engine):
+        if (engine not in cls.scan_engines):
+            raise ValueError("Unknown scan engine: %s" % engine)
+
+        # The regex engine is kept as it always was and only knows the Tribes 2 argument layouts
+        if (engine == "regex" and cls._argument_layouts != Scraper._argument_layouts):
+            raise ValueError("The regex engine only supports the Tribes 2 argument layouts")
+
+    @classmethod
+    def _check_encoding(cls, source_encoding):
+        if (source_encoding is None):
+            return
+
+        try:
+            codecs.lookup(source_encoding)
+        except LookupError:
+            raise ValueError("Unknown source encoding: %s" % source_encoding)
+
+    @classmethod
+    def argument_list_expression(cls, count):
+        """
+            Returns an expression matching a whole argument list of exactly count arguments up
+            to and including the closing parenthesis, with a group per argument.
+        """
+        if (count not in cls._argument_list_expressions):
+            cls._argument_list_expressions[count] = re.compile(",".join(["\\s*(%s)" % cls._argument_body_template] * count) + "\\)")
+        return cls._argument_list_expressions[count]
+
+    @classmethod
+    def stream(cls, filename, engine="regex", memory_limit=256 << 20, stats=None, source_encoding=None):
+        """
+            Scans the file a window at a time, yielding every registration as it's found as a
+            (category, record) tuple. Records are Function objects for global functions, type
+            method tuples, GlobalVariable objects for global values and (datablock type,
+            Datablock.Property) tuples for datablock properties. Within a window, records are
+            yielded category by category.
+
+            Nothing is kept once it's been yielded, so memory use stays within the limit no
+            matter the size of the input. Match and rejection counts are added to the given
+            ScrapeStats, if any. Names and descriptions are decoded with source_encoding as
+            they are by the Scraper.
+        """
+        cls._check_engine(engine)
+        cls._check_encoding(source_encoding)
+
+        with cls._open_stream(filename) as handle:
+            for window_start, window_scraper in cls._scan_windows(engine, handle, memory_limit // cls.window_memory_factor, source_encoding):
+                if (stats is not None):
+                    stats.merge(window_scraper.stats)
+
+                for global_function in window_scraper.global_functions:
+                    yield ("global_functions", global_function)
+                for type_name in sorted(window_scraper.type_methods.keys()):
+                    for type_method in window_scraper.type_methods[type_name]:
+                        yield ("type_methods", type_method)
+                for global_value in window_scraper.global_values:
+                    yield ("global_values", global_value)
+                for datablock_type in sorted(window_scraper.datablocks.keys()):
+                    for datablock_property in window_scraper.datablocks[datablock_type].properties.values():
+                        yield ("datablocks", (datablock_type, datablock_property))
+
+    @classmethod
+    def compression(cls, filename):
+        """
+            Returns the name of the compression module the given input needs, None if it isn't
+            compressed.
+        """
+        return cls.compressed_extensions.get(os.path.splitext(filename)[1].lower())
+
+    def build_inheritance_tree(self, typename):
+        return list(self.type_ancestry(typename))
+
+    def type_ancestry(self, typename):
+        """
+            Returns a tuple of the given type followed by all of its ancestors, nearest first.
+        """
+        if (self._type_ancestry is None):
+            self._flatten_inheritance()
+
+        if (typename in self._type_ancestry):
+            return self._type_ancestry[typename]
+        return (typename, )
+
+    def method_table(self, typename):
+        """
+            Returns every method callable on the given type, including inherited ones, as a
+            dictionary of lower case method name to (declaring type, type method tuple). Methods
+            redeclared further down the hierarchy hide the ones they override.
+        """
+        if (self._method_tables is None):
+            self._flatten_inheritance()
+        return self._method_tables.get(typename, { })
+
+    def field_table(self, typename):
+        """
+            Returns every field of the given datablock type, including inherited ones, as a
+            dictionary of field name to (declaring datablock type, Datablock.Property).
+        """
+        if (self._field_tables is None):
+            self._flatten_inheritance()
+        return self._field_tables.get(typename, { })
+
+    def scrape_all(self):
+        """
+            Scans every category a lazy scrape hasn't yet. Does nothing for other scrapes.
+        """
+        # Scanning one category may scan others along with it, as the single pass engine does
+        while (len(self._pending_categories) != 0):
+            self._scan_category(self._pending_categories[0])
+
+    def find_function(self, offset):
+        """
+            Returns the address of the decompiled function containing the given buffer offset.
+        """
+        return self.function_index.find(offset)
+
+    def __getstate__(self):
+        # The buffer of a lazy scrape can't be pickled, so finish scanning it first
+        self.scrape_all()
+        return self.__dict__
+
+    def _reset_outputs(self, categories=None):
+        if (categories is None):
+            categories = self.scrape_categories
+
+        if ("global_functions" in categories):
+            # A list of tuples with the following structure: (addr, name, desc, minArgs, maxArgs)
+            self.global_functions = [ ]
+            self.global_function_count = 0
+
+        if ("type_methods" in categories):
+            # A dictionary of classname to tuples with the following structure: (typename, addr, name, desc, minArgs, maxArgs)
+            self.type_methods = { }
+            self.type_function_counts = { }
+            self.type_function_total = 0
+
+        if ("global_values" in categories):
+            self.global_values = [ ]
+
+        if ("datablocks" in categories):
+            self.datablocks = { }
+            self.function_index = FunctionIndex()
+
+        self._type_ancestry = None
+        self._method_tables = None
+        self._field_tables = None
+
+    def _merge(self, other):
+        """
+            Appends the results of another scrape to this one as if its buffer had followed ours,
+            so merging shards in file order gives the same results as scanning serially.
+        """
+        self._type_ancestry = None
+        self._method_tables = None
+        self._field_tables = None
+
+        if (other.stats is not None):
+            self.stats.merge(other.stats)
+
+        self.global_functions.extend(other.global_functions)
+        self.global_function_count = self.global_function_count + other.global_function_count
+
+        for type_name, type_methods in other.type_methods.items():
+            self.type_methods.setdefault(type_name, [])
+            self.type_methods[type_name].extend(type_methods)
+
+        for type_name, type_function_count in other.type_function_counts.items():
+            self.type_function_counts.setdefault(type_name, 0)
+            self.type_function_counts[type_name] = self.type_function_counts[type_name] + type_function_count
+
+        self.type_function_total = self.type_function_total + other.type_function_total
+
+        self.global_values.extend(other.global_values)
+
+        # Never adopt the other datablocks directly, the other results may be reused later on
+        for datablock_type, datablock in other.datablocks.items():
+            if (datablock_type not in self.datablocks):
+                self.datablocks[datablock_type] = Datablock(datablock_type)
+
+            self.datablocks[datablock_type].properties.update(datablock.properties)
+
+    def _is_empty(self):
+        return len(self.global_functions) == 0 and len(self.type_methods) == 0 and len(self.global_values) == 0 and len(self.datablocks) == 0
+
+    def _prepare_lazy(self, engine, file_buffer, start):
+        # Masking applies to every category alike, so it's done once up front
+        if (engine == "regex"):
+            file_buffer = self._mask_strings(file_buffer, start)
+        elif (engine == "call_index"):
+            file_buffer = self._index_call_sites(file_buffer, start)
+
+        self._lazy_scan = (engine, file_buffer, start)
+        self._pending_categories = list(self.scrape_categories)
+
+    def _scan_category(self, category):
+        engine, file_buffer, start = self._lazy_scan
+
+        # The single pass engine finds every category in the one walk over the buffer it takes
+        # anyway, so scanning them one at a time would only walk it again for each
+        categories = (category, )
+        if (engine == "single_pass"):
+            categories = tuple(self._pending_categories)
+
+        for category in categories:
+            self._pending_categories.remove(category)
+        self._reset_outputs(categories)
+
+        if (engine == "regex"):
+            self._scan_masked(file_buffer, start, categories)
+        elif (engine == "call_index"):
+            self._scan_call_sites(file_buffer, categories)
+        else:
+            self._scan_single_pass(file_buffer, start, categories)
+
+        if (len(self._pending_categories) == 0):
+            if (engine == "call_index"):
+                file_buffer = file_buffer.buffer
+            if (isinstance(file_buffer, mmap.mmap)):
+                file_buffer.close()
+
+            del self._pending_categories
+            del self._lazy_scan
+
+    # Scan Engines
+    def _scan(self, engine, file_buffer, start=0):
+        if (engine == "regex"):
+            self._scan_regex(file_buffer, start)
+        elif (engine == "call_index"):
+            self._scan_call_index(file_buffer, start)
+        else:
+            self._scan_single_pass(file_buffer, start)
+
+    def _scan_stream(self, engine, filename, memory_limit):
+        """
+            Scans the file a window at a time, merging the results of every window in file order.
+            Function index offsets are those of the file itself, as they would be if it was
+            mapped.
+        """
+        self.function_index = FunctionIndex()
+
+        with self.stats.phase("stream") as phase:
+            with self._open_stream(filename) as handle:
+                for window_start, window_scraper in self._scan_windows(engine, handle, memory_limit // self.window_memory_factor, self.source_encoding):
+                    for header_offset, address in zip(window_scraper.function_index.offsets, window_scraper.function_index.addresses):
+                        # Windows cut within a function start with a copy of its header, which isn't part of the file
+                        if (header_offset >= window_scraper.window_prefix):
+                            self.function_index.add(window_start + header_offset - window_scraper.window_prefix, address)
+
+                    self.function_index.end = window_start + window_scraper.function_index.end - window_scraper.window_prefix
+                    self._merge(window_scraper)
+
+            phase.bytes_scanned = self.function_index.end
+
+    @classmethod
+    def _scan_windows(cls, engine, handle, window_size, source_encoding=None):
+        """
+            Reads the handle a window at a time and scans every window, yielding the file offset
+            of its start along with a scraper of its results. Windows end just before the last
+            function header in them where there is one, so the next one starts on it. Windows
+            within functions too big to fit end after the last complete statement instead, and
+            the next one gets a copy of the function header as a prefix, so datablock properties
+            still resolve their callers; the length of that prefix is kept as window_prefix.
+
+            Whatever follows the end of a window is carried over to the start of the next, so
+            no registration call is ever split between windows or scanned twice.
+        """
+        window_size = max(1, window_size)
+        carried, window_start = cls._skip_stream_lines(handle, cls.skipped_line_count, window_size)
+        if (carried is None):
+            return
+
+        prefix = ""
+        exhausted = False
+        while (not exhausted):
+            chunk = handle.read(window_size)
+            exhausted = len(chunk) == 0
+
+            window = prefix + carried + chunk
+            chunk = None
+
+            if (exhausted):
+                window_end = len(window)
+            else:
+                window_end = cls._window_end(window, len(prefix))
+
+                if (window_end is None):
+                    # No statement ends in this window, so keep reading until one does
+                    carried = window[len(prefix):]
+                    continue
+
+            window_scraper = _scan_shard((cls, engine, window[:window_end], source_encoding))
+            window_scraper.window_prefix = len(prefix)
+            yield (window_start, window_scraper)
+
+            window_start = window_start + window_end - len(prefix)
+            carried = window[window_end:]
+
+            prefix = ""
+            header_offset = window.rfind("//----- (", 0, window_end)
+            if (header_offset != -1 and not carried.startswith("//----- (")):
+                header = cls.function_header_expression.match(window, header_offset)
+                if (header is not None):
+                    prefix = header.group(0) + "\r\n"
+
+    @classmethod
+    def _window_end(cls, window, start):
+        header_offset = window.rfind("\r\n//----- (", start + 1)
+        if (header_offset != -1):
+            return header_offset + 2
+
+        statement_end = max(window.rfind(";\r\n", start), window.rfind("{\r\n", start), window.rfind("}\r\n", start))
+        if (statement_end != -1):
+            return statement_end + 3
+
+        return None
+
+    @classmethod
+    def _skip_stream_lines(cls, handle, line_count, chunk_size):
+        """
+            Reads past the first line_count lines of the handle, returning what was read beyond
+            them along with its offset in the file. Returns None for the remainder if the file
+            doesn't have that many lines.
+        """
+        offset = 0
+        remainder = ""
+        while (True):
+            chunk = handle.read(chunk_size)
+            if (len(chunk) == 0):
+                return None, offset
+
+            # A line ending may have been split across the previous chunk and this one
+            remainder = remainder + chunk
+            position = 0
+            while (line_count > 0):
+                line_end = remainder.find("\r\n", position)
+                if (line_end == -1):
+                    break
+
+                position = line_end + 2
+                line_count = line_count - 1
+
+            if (line_count == 0):
+                return remainder[position:], offset + position
+
+            offset = offset + len(remainder) - 1
+            remainder = remainder[-1:]
+
+    @classmethod
+    def _open_stream(cls, filename):
+        compression = cls.compression(filename)
+
+        if (compression == "gzip"):
+            return gzip.GzipFile(filename, "rb")
+        elif (compression == "bz2"):
+            return bz2.BZ2File(filename, "rb")
+        elif (compression == "lzma"):
+            if (lzma is None):
+                raise ImportError("Reading %s requires the lzma module" % filename)
+            return lzma.open(filename, "rb")
+
+        return open(filename, "rb")
+
+    def _scan_parallel(self, engine, file_buffer, start, processes):
+        """
+            Cuts the buffer into shards at function headers and scans them in a process pool.
+            Each worker produces a scraper of its own which is merged back in file order.
+        """
+        self.function_index = FunctionIndex.from_buffer(file_buffer, start)
+
+        shards = self._plan_shards(file_buffer, start, processes * self.shards_per_process)
+        shard_jobs = ((type(self), engine, file_buffer[shard_start:shard_end], self.source_encoding) for shard_start, shard_end in shards)
+
+        with self.stats.phase("parallel", len(file_buffer) - start):
+            pool = multiprocessing.Pool(processes)
+            try:
+                for shard_scraper in pool.imap(_scan_shard, shard_jobs):
+                    self._merge(shard_scraper)
+            finally:
+                pool.close()
+                pool.join()
+
+    def _scan_blocks(self, engine, file_buffer, start, previous):
+        """
+            Scans the buffer one function block at a time, keeping a content digest of every
+            block. Blocks with a digest found in the previous scrape reuse its results instead
+            of being scanned; blocks that no longer exist simply aren't carried over. Blocks
+            without a registrar address in them have nothing to scan, so they're only hashed.
+        """
+        self.function_index = FunctionIndex.from_buffer(file_buffer, start)
+
+        # Results of another engine or configuration would be taken over as they are
+        previous_blocks = { }
+        if (previous is not None and previous.blocks is not None and previous.engine == self.engine and previous.configuration == self.configuration):
+            previous_blocks = dict(previous.blocks)
+
+        block_starts = [start] + [header_offset for header_offset in self.function_index.offsets if header_offset != start]
+        block_ends = block_starts[1:] + [len(file_buffer)]
+
+        self.blocks = [ ]
+        with self.stats.phase("blocks", len(file_buffer) - start):
+            registration_blocks = set(bisect.bisect_right(block_starts, registrar.start()) - 1 for registrar in self.registrar_expression.finditer(file_buffer, start))
+
+            for block_number, (block_start, block_end) in enumerate(zip(block_starts, block_ends)):
+                block = file_buffer[block_start:block_end]
+                digest = hashlib.sha1(block).digest()
+
+                if (digest in previous_blocks):
+                    block_results = previous_blocks[digest]
+                    self.reused_block_count = self.reused_block_count + 1
+                elif (block_number not in registration_blocks):
+                    block_results = None
+                    self.scanned_block_count = self.scanned_block_count + 1
+                else:
+                    block_results = _scan_shard((type(self), engine, block, self.source_encoding))
+                    self.stats.merge(block_results.stats)
+
+                    # Stored block results only need to hold their registrations
+                    block_results.function_index = None
+                    block_results.stats = None
+                    self.scanned_block_count = self.scanned_block_count + 1
+
+                    if (block_results._is_empty()):
+                        block_results = None
+
+                self.blocks.append((digest, block_results))
+                if (block_results is not None):
+                    self._merge(block_results)
+
+    def _flatten_inheritance(self):
+        """
+            One pass over every type we know of to work out its full ancestry, then the flattened
+            method and field tables along those ancestries.
+        """
+        type_names = set(self.type_name_inheritance.keys()) | set(self.type_name_inheritance.values())
+        type_names = type_names | set(self.type_methods.keys()) | set(self.datablocks.keys())
+
+        self._type_ancestry = { }
+        for type_name in type_names:
+            self._resolve_ancestry(type_name, ( ))
+
+        self._method_tables = { }
+        self._field_tables = { }
+        for type_name in type_names:
+            method_table = { }
+            field_table = { }
+
+            # Walk from the root down so nearer declarations replace those of their ancestors
+            for ancestor in reversed(self._type_ancestry[type_name]):
+                for type_method in self.type_methods.get(ancestor, ( )):
+                    method_table[type_method[2].lower()] = (ancestor, type_method)
+
+                if (ancestor in self.datablocks):
+                    for datablock_property in self.datablocks[ancestor].properties.values():
+                        field_table[datablock_property.name] = (ancestor, datablock_property)
+
+            if (len(method_table) != 0):
+                self._method_tables[type_name] = method_table
+            if (len(field_table) != 0):
+                self._field_tables[type_name] = field_table
+
+    def _resolve_ancestry(self, type_name, descendants):
+        if (type_name in self._type_ancestry):
+            return self._type_ancestry[type_name]
+
+        # Guard against cycles in the inheritance map rather than recursing forever
+        parent = self.type_name_inheritance.get(type_name)
+        if (parent is None or parent in descendants or parent == type_name):
+            result = (type_name, )
+        else:
+            result = (type_name, ) + self._resolve_ancestry(parent, descendants + (type_name, ))
+
+        self._type_ancestry[type_name] = result
+        return result
+
+    def _plan_shards(self, file_buffer, start, shard_count):
+        """
+            Produces a list of (start, end) tuples covering the buffer from start onwards. Every
+            shard but the first begins on a function header so no registration call or string
+            literal is ever split between two shards.
+        """
+        shard_size = max(1, (len(file_buffer) - start) // max(1, shard_count))
+
+        shards = [ ]
+        shard_start = start
+        for header_offset in self.function_index.offsets:
+            if (header_offset - shard_start >= shard_size):
+                shards.append((shard_start, header_offset))
+                shard_start = header_offset
+
+        shards.append((shard_start, len(file_buffer)))
+        return shards
+
+    @classmethod
+    def _read_buffer(cls, filename):
         file_buffer = ""
         with open(filename, "r") as handle:
              file_buffer = handle.read()
@@ -276,8 +1495,53 @@ class Scraper(object):
         chopped_lines = file_buffer.split("\r\n")
         chopped_lines = chopped_lines[33350:len(chopped_lines)]
 
-        file_buffer = string.join(chopped_lines)
+        return string.join(chopped_lines)
+
+    @classmethod
+    def _read_bytes(cls, filename):
+        """
+            Reads the input as it is on disk and finds the offset past the leading declarations
+            the way _map_buffer does, so the only copy of the input ever made is the one read.
+        """
+        with open(filename, "rb") as handle:
+            file_buffer = handle.read()
+
+        return file_buffer, cls._skip_lines(file_buffer, cls.skipped_line_count)
 
+    @classmethod
+    def _map_buffer(cls, filename):
+        """
+            Maps the input file into memory rather than reading it, so the buffer is never
+            split, joined or copied. Instead of chopping the leading declarations off we
+            count line endings to find the offset the scan engines should start at. The
+            mapping is copy on write, which lets the regex engine mask semicolons in place
+            without ever touching the file itself.
+        """
+        with open(filename, "rb") as handle:
+            try:
+                file_buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_COPY)
+            except ValueError:
+                # Empty files can't be mapped
+                return "", 0
+
+        return file_buffer, cls._skip_lines(file_buffer, cls.skipped_line_count)
+
+    @classmethod
+    def _skip_lines(cls, file_buffer, line_count):
+        offset = 0
+        for line in range(line_count):
+            offset = file_buffer.find("\r\n", offset)
+            if (offset == -1):
+                return len(file_buffer)
+
+            offset = offset + 2
+
+        return offset
+
+    def _scan_regex(self, file_buffer, start=0):
+        self._scan_masked(self._mask_strings(file_buffer, start), start)
+
+    def _mask_strings(self, file_buffer, start=0):
         """
             Now we perform a bit of a hack here because of unnecessary immutable
             memory bullshit: Strings in Python are immutable and due to the way
@@ -285,155 +1549,355 @@ class Scraper(object):
             methods that have a semicolon in their description (most do) will cause
             the regex to match up until that semicolon, not the one that actually
             delineates the entire method. So as a quick hack, we create a mutable
-            memory buffer (just a list) to do single character replacements of ;
+            memory buffer (a bytearray) to do single character replacements of ;
             with ~ within the context of strings. We can't simply use replace or any
             of the regular string modification methods because they create copies of
             the string memory which bogs down the system massively at this point: times
             went down from an absolute unknown to merely ~2sec to run the entirety of this
             software using this work around.
         """
-        mutable_buffer = list(file_buffer)
+        scanned_bytes = len(file_buffer) - start
 
-        string_search = re.finditer(self.string_expression, file_buffer)
-        for string_occurrence in string_search:
-            string_text = string_occurrence.group(0)
+        with self.stats.phase("mask", scanned_bytes):
+            if (isinstance(file_buffer, mmap.mmap)):
+                # Copy on write mappings are already mutable, so we mask in place
+                mutable_buffer = file_buffer
+            else:
+                mutable_buffer = bytearray(file_buffer)
 
-            for semi_occurrence in range(string_text.count(";")):
-                semi_location = string_text.find(";", semi_occurrence)
-                mutable_buffer[string_occurrence.start() + semi_location] = "~"
+            string_search = self.string_expression.finditer(file_buffer, start)
+            for string_occurrence in string_search:
+                string_text = string_occurrence.group(0)
 
-        # Implode the list together using "" as a delineator, so it just reassembles the payload
-        file_buffer = string.join(mutable_buffer, "")
+                for semi_occurrence in range(string_text.count(";")):
+                    semi_location = string_text.find(";", semi_occurrence)
+                    mutable_buffer[string_occurrence.start() + semi_location] = "~"
 
-        # A list of tuples with the following structure: (addr, name, desc, minArgs, maxArgs)
-        self.global_functions = [ ]
+            # Turn the masked bytes back into a string for the registration expressions
+            if (mutable_buffer is not file_buffer):
+                file_buffer = bytes(mutable_buffer)
 
-        global_method_add_search = re.finditer(self.global_method_add_expression, file_buffer)
-        for global_function in global_method_add_search:
-            global_function_source = global_function.group(0)
+        return file_buffer
 
-            opening_index = global_function_source.find("(")
-            closing_index = global_function_source.rfind(")", global_function_source.count(")") - 1)
+    def _scan_masked(self, file_buffer, start=0, categories=None):
+        """
+            Runs the registration regexes of the given categories, all of them by default, over
+            a buffer that has already been masked.
+        """
+        if (categories is None):
+            categories = self.scrape_categories
 
-            global_function_source = global_function_source[opening_index + 1:closing_index]
+        scanned_bytes = len(file_buffer) - start
 
-            # Extract the description first; this is a huge hack due to the commas in the desc
-            global_function_source, global_method_description = self._extract_description(global_function_source)
-            global_method_arguments = global_function_source.split(",")
+        if ("global_functions" in categories):
+            with self.stats.phase("global_functions", scanned_bytes):
+                global_method_add_search = self.global_method_add_expression.finditer(file_buffer, start)
+                for global_function in global_method_add_search:
+                    self._add_global_function(self._call_source(global_function))
 
-            # Strip out the global method info
-            global_method_name = self._extract_name(global_method_arguments, 0)
+        if ("type_methods" in categories):
+            with self.stats.phase("type_methods", scanned_bytes):
+                type_method_add_search = self.type_method_add_expression.finditer(file_buffer, start)
+                for type_method in type_method_add_search:
+                    self._add_type_method(self._call_source(type_method))
 
-            try:
-                global_method_address = self._extract_address(global_method_arguments, 1)
-                global_method_minargs = int(global_method_arguments[3])
-                global_method_maxargs = int(global_method_arguments[4])
+        if ("global_values" in categories):
+            with self.stats.phase("global_values", scanned_bytes):
+                global_value_add_search = self.global_value_add_expression.finditer(file_buffer, start)
+                for global_value in global_value_add_search:
+                    self._add_global_value(self._call_source(global_value))
 
-                self.global_function_count = self.global_function_count + 1
+        if ("datablocks" not in categories):
+            return
 
-                global_function = Function(global_method_name, global_method_address, None, global_method_description, global_method_minargs, global_method_maxargs)
-                self.global_functions.append(global_function)
-            except ValueError:
-                pass
+        # Extract the datablock properties now
+        with self.stats.phase("function_index", scanned_bytes):
+            self.function_index = FunctionIndex.from_buffer(file_buffer, start)
+
+        with self.stats.phase("datablocks", scanned_bytes):
+            datablock_property_add_search = self.datablock_property_add_expression.finditer(file_buffer, start)
+            for datablock_property in datablock_property_add_search:
+                """
+                    Here we don't have to worry about anything with their own scopes
+                    sitting above our declarations in the input file this was built for,
+                    so the function header nearest before the call is always the one
+                    declaring the caller, which the function index resolves for us.
+                """
+                calling_method = self.function_index.find(datablock_property.start())
+
+                if (calling_method is None):
+                    self.stats.record_rejection("datablocks")
+                else:
+                    self._add_datablock_property(self._call_source(datablock_property), calling_method)
+
+    def _scan_single_pass(self, file_buffer, start=0, categories=None):
+        """
+            Walks the buffer exactly once with the single pass tokenizer. String literals
+            are consumed as whole tokens so any semicolons within them never terminate a
+            registration call, which means the ; to ~ masking pass isn't necessary here.
+            Function headers are added to the function index as we go, so the most
+            recent one resolves datablock property callers.
+
+            Registrations outside of the given categories, all of them by default, are
+            skipped over.
+        """
+        if (categories is None):
+            categories = self.scrape_categories
+
+        registration_handlers = { }
+        for category, registration_handler in (("global_functions", self._register_global_function), ("type_methods", self._register_type_method),
+            ("global_values", self._register_global_value)):
+            if (category in categories):
+                registration_handlers[category] = (registration_handler, self._argument_layouts[category]["count"])
+
+        scan_datablocks = "datablocks" in categories
+        datablock_argument_count = self._argument_layouts["datablocks"]["count"]
+
+        function_index = FunctionIndex(len(file_buffer))
+        if (scan_datablocks):
+            self.function_index = function_index
+
+        with self.stats.phase("single_pass", len(file_buffer) - start):
+            token_search = self.single_pass_expression.search
+            position = start
+
+            while (True):
+                token = token_search(file_buffer, position)
+                if (token is None):
+                    break
+
+                category = token.lastgroup
+                position = token.end()
+
+                # String and character literals have no groups and are simply skipped
+                if (category is None):
+                    if (token.lastindex == 1):
+                        function_index.add(token.start(), token.group(1))
+                    continue
+
+                # Registrations are skipped over as a whole, whether they're handled or not
+                position = token.end(2)
+
+                if (category in registration_handlers):
+                    registration_handler, argument_count = registration_handlers[category]
+                    registration_handler(CallArguments(file_buffer, token.start(2), argument_count))
+                elif (category != "datablocks" or not scan_datablocks):
+                    continue
+                elif (len(function_index) != 0):
+                    self._register_datablock_property(CallArguments(file_buffer, token.start(2), datablock_argument_count), function_index.addresses[-1])
+                else:
+                    self.stats.record_rejection("datablocks")
+
+    def _scan_call_index(self, file_buffer, start=0):
+        self._scan_call_sites(self._index_call_sites(file_buffer, start))
+
+    def _index_call_sites(self, file_buffer, start=0):
+        with self.stats.phase("call_index", len(file_buffer) - start):
+            return CallSiteIndex.from_buffer(file_buffer, start)
+
+    def _scan_call_sites(self, call_index, categories=None):
+        """
+            Looks registrations up by registrar address in a call site index rather than
+            searching the buffer for them, so once the index is built every category costs
+            no more than handling its own calls. The index knows where every argument list
+            ends, which makes masking unnecessary here as well.
+        """
+        if (categories is None):
+            categories = self.scrape_categories
 
-        # A dictionary of classname to tuples with the following structure: (typename, addr, name, desc, minArgs, maxArgs)
-        self.type_methods = { }
-        self.type_function_counts = { }
+        for category, registry, registration_handler in (("global_functions", self._global_function_registry, self._register_global_function),
+            ("type_methods", self._type_function_registry, self._register_type_method), ("global_values", self._global_value_registry, self._register_global_value)):
+            if (category not in categories):
+                continue
 
-        type_method_add_search = re.finditer(self.type_method_add_expression, file_buffer)
-        for type_method in type_method_add_search:
-            type_method_source = type_method.group(0)
+            with self.stats.phase(category):
+                for call_id in call_index.call_ids(registry):
+                    registration_handler(call_index.arguments(call_id, self._argument_layouts[category]["count"]))
 
-            opening_index = type_method_source.find("(")
-            closing_index = type_method_source.rfind(")")
+        if ("datablocks" not in categories):
+            return
 
-            type_method_source = type_method_source[opening_index + 1:closing_index]
+        self.function_index = call_index.function_index
+        with self.stats.phase("datablocks"):
+            for call_id in call_index.call_ids(self._datablock_property_registry):
+                calling_method = call_index.function(call_id)
 
-            # Extract the description first; this is a huge hack due to the commas in the desc
-            type_method_source, type_method_description = self._extract_description(type_method_source)
-            type_method_arguments = type_method_source.split(",")
+                if (calling_method is None):
+                    self.stats.record_rejection("datablocks")
+                else:
+                    self._register_datablock_property(call_index.arguments(call_id, self._argument_layouts["datablocks"]["count"]), calling_method)
 
-            # Strip out the type method info
-            type_method_type = self._extract_name(type_method_arguments, 1)
-            type_method_name = self._extract_name(type_method_arguments, 2)
-            type_method_address = self._extract_address(type_method_arguments, 3)
+    # Registration Handlers
+    def _add_global_function(self, global_function_source):
+        opening_index = global_function_source.find("(")
+        closing_index = global_function_source.rfind(")", global_function_source.count(")") - 1)
 
-            try:
-                type_method_minargs = int(type_method_arguments[5])
-                type_method_maxargs = int(type_method_arguments[6])
+        global_function_source = global_function_source[opening_index + 1:closing_index]
 
-                self.type_methods.setdefault(type_method_type, [])
-                self.type_function_counts.setdefault(type_method_type, 0)
+        # Extract the description first; this is a huge hack due to the commas in the desc
+        global_function_source, global_method_description = self._extract_description(global_function_source)
+        global_method_arguments = global_function_source.split(",")
 
-                self.type_function_total = self.type_function_total + 1
-                self.type_function_counts[type_method_type] = self.type_function_counts[type_method_type] + 1
+        # Strip out the global method info
+        global_method_name = self._extract_name(global_method_arguments, 0)
 
-                self.type_methods[type_method_type] .append((type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs))
-            except ValueError:
-                continue
+        try:
+            global_method_address = self._extract_address(global_method_arguments, 1)
+            global_method_minargs = int(global_method_arguments[3])
+            global_method_maxargs = int(global_method_arguments[4])
 
-        self.global_values = [ ]
+            self.global_function_count = self.global_function_count + 1
 
-        global_value_add_search = re.finditer(self.global_value_add_expression, file_buffer)
-        for global_value in global_value_add_search:
-            global_value_source = global_value.group(0)
+            global_function = Function(global_method_name, global_method_address, None, global_method_description, global_method_minargs, global_method_maxargs)
+            self.global_functions.append(global_function)
+            self.stats.record_match("global_functions")
+        except ValueError:
+            self.stats.record_rejection("global_functions")
 
-            opening_index = global_value_source.find("(")
-            closing_index = global_value_source.rfind(")")
+    def _add_type_method(self, type_method_source):
+        opening_index = type_method_source.find("(")
+        closing_index = type_method_source.rfind(")")
 
-            global_value_source = global_value_source[opening_index + 1:closing_index]
-            global_value_arguments = global_value_source.split(",")
+        type_method_source = type_method_source[opening_index + 1:closing_index]
 
-            # Strip out the global value info
-            global_value_name = self._extract_name(global_value_arguments, 0)
-            global_value_address = self._extract_address(global_value_arguments, 2)
+        # Extract the description first; this is a huge hack due to the commas in the desc
+        type_method_source, type_method_description = self._extract_description(type_method_source)
+        type_method_arguments = type_method_source.split(",")
 
-            global_value_type = int(global_value_arguments[1])
-            self.global_values.append(GlobalVariable(global_value_address, global_value_type, 0))
+        # Strip out the type method info
+        type_method_type = self._extract_name(type_method_arguments, 1)
+        type_method_name = self._extract_name(type_method_arguments, 2)
+        type_method_address = self._extract_address(type_method_arguments, 3)
 
-        # Extract the datablock properties now
-        self.datablocks = { }
-
-        datablock_property_add_search = re.finditer(self.datablock_property_add_expression, file_buffer)
-        for datablock_property in datablock_property_add_search:
-            datablock_property_source = datablock_property.group(0)
-
-            """
-                Here we don't have to worry about anything with their own scopes
-                sitting above our declarations in the input file this was built for,
-                so we just search backwards for the type declaration (Which is always an int)
-                and use that to copy out the declaration source.
-            """
-            declaration_start = file_buffer.rfind("//----- ", 0, datablock_property.start())
-            declaration_end = file_buffer.rfind("-", declaration_start,  datablock_property.start())
-            declaration_source = file_buffer[declaration_start:declaration_end]
-
-            calling_method = self._extract_caller(declaration_source)
-
-            # If we don't know what it is, just add a default value and resolve it this way
-            self._datablock_type_table.setdefault(calling_method, calling_method)
-            datablock_type = self._datablock_type_table[calling_method]
-            self.datablocks.setdefault(datablock_type, Datablock(datablock_type))
-
-            # Pull the datablock property information now
-            datablock_arguments = datablock_property_source.split(",")
-            datablock_property_name = self._extract_name(datablock_arguments, 0)
-            datablock_property_address = self._extract_address(datablock_arguments, 2)
-
-            # Write it out and we should be fine.
-            current_datablock = self.datablocks[datablock_type]
-            current_datablock.properties[datablock_property_name] = Datablock.Property(datablock_property_name, datablock_property_address, "Bla")
+        try:
+            type_method_minargs = int(type_method_arguments[5])
+            type_method_maxargs = int(type_method_arguments[6])
 
-    def build_inheritance_tree(self, typename):
-        result = [ typename ]
+            self.type_methods.setdefault(type_method_type, [])
+            self.type_function_counts.setdefault(type_method_type, 0)
 
-        while (typename in self.type_name_inheritance.keys()):
-            typename = self.type_name_inheritance[typename]
-            result.append(typename)
+            self.type_function_total = self.type_function_total + 1
+            self.type_function_counts[type_method_type] = self.type_function_counts[type_method_type] + 1
 
-        return result
+            self.type_methods[type_method_type] .append((type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs))
+            self.stats.record_match("type_methods")
+        except ValueError:
+            self.stats.record_rejection("type_methods")
+
+    def _add_global_value(self, global_value_source):
+        opening_index = global_value_source.find("(")
+        closing_index = global_value_source.rfind(")")
+
+        global_value_source = global_value_source[opening_index + 1:closing_index]
+        global_value_arguments = global_value_source.split(",")
+
+        # Strip out the global value info
+        global_value_name = self._extract_name(global_value_arguments, 0)
+        global_value_address = self._extract_address(global_value_arguments, 2)
+
+        global_value_type = int(global_value_arguments[1])
+        self.global_values.append(GlobalVariable(global_value_address, global_value_type, 0))
+        self.stats.record_match("global_values")
+
+    def _add_datablock_property(self, datablock_property_source, calling_method):
+        # If we don't know what it is, just use the calling method as the type name
+        datablock_type = self._datablock_type_table.get(calling_method, calling_method)
+        if (datablock_type not in self.datablocks):
+            self.datablocks[datablock_type] = Datablock(datablock_type)
+
+        # Pull the datablock property information now
+        datablock_arguments = datablock_property_source.split(",")
+        datablock_property_name = self._extract_name(datablock_arguments, 0)
+        datablock_property_address = self._extract_address(datablock_arguments, 2)
+
+        # Write it out and we should be fine.
+        current_datablock = self.datablocks[datablock_type]
+        current_datablock.properties[datablock_property_name] = Datablock.Property(datablock_property_name, datablock_property_address, "Bla")
+        self.stats.record_match("datablocks")
+
+    # Argument Handlers
+    """
+        The scan engines that never mask the buffer hand registrations over as CallArguments
+        rather than text, so fields are read straight from their spans in the buffer.
+    """
+    def _register_global_function(self, arguments):
+        layout = self._argument_layouts["global_functions"]
+
+        try:
+            global_function = Function(self._decode_field(arguments.string(layout["name"])), arguments.address(layout["address"]), None,
+                self._decode_field(arguments.string(layout["description"])), arguments.integer(layout["min_args"]), arguments.integer(layout["max_args"]))
+        except (IndexError, ValueError):
+            self.stats.record_rejection("global_functions")
+            return
+
+        self.global_function_count = self.global_function_count + 1
+        self.global_functions.append(global_function)
+        self.stats.record_match("global_functions")
+
+    def _register_type_method(self, arguments):
+        layout = self._argument_layouts["type_methods"]
+
+        try:
+            type_method_type = self._sky_hack(self._decode_field(arguments.string(layout["type_name"])))
+            type_method = (type_method_type, arguments.address(layout["address"]), self._sky_hack(self._decode_field(arguments.string(layout["name"]))),
+                self._decode_field(arguments.string(layout["description"])), arguments.integer(layout["min_args"]), arguments.integer(layout["max_args"]))
+        except (IndexError, ValueError):
+            self.stats.record_rejection("type_methods")
+            return
+
+        self.type_methods.setdefault(type_method_type, [])
+        self.type_function_counts.setdefault(type_method_type, 0)
+
+        self.type_function_total = self.type_function_total + 1
+        self.type_function_counts[type_method_type] = self.type_function_counts[type_method_type] + 1
+
+        self.type_methods[type_method_type].append(type_method)
+        self.stats.record_match("type_methods")
+
+    def _register_global_value(self, arguments):
+        layout = self._argument_layouts["global_values"]
+
+        try:
+            global_value = GlobalVariable(arguments.address(layout["address"]), arguments.integer(layout["type"]), 0)
+        except (IndexError, ValueError):
+            self.stats.record_rejection("global_values")
+            return
+
+        self.global_values.append(global_value)
+        self.stats.record_match("global_values")
+
+    def _register_datablock_property(self, arguments, calling_method):
+        layout = self._argument_layouts["datablocks"]
+
+        try:
+            datablock_property_name = self._sky_hack(self._decode_field(arguments.string(layout["name"])))
+            datablock_property_address = arguments.address(layout["address"])
+        except IndexError:
+            self.stats.record_rejection("datablocks")
+            return
+
+        # If we don't know what it is, just use the calling method as the type name
+        datablock_type = self._datablock_type_table.get(calling_method, calling_method)
+        if (datablock_type not in self.datablocks):
+            self.datablocks[datablock_type] = Datablock(datablock_type)
+
+        self.datablocks[datablock_type].properties[datablock_property_name] = Datablock.Property(datablock_property_name, datablock_property_address, "Bla")
+        self.stats.record_match("datablocks")
 
     # Helper Functions
+    def _decode_field(self, field):
+        """
+            Re-encodes a name or description from the source encoding as UTF-8. Fields are
+            only decoded at all if they hold a byte outside of ASCII.
+        """
+        if (self.source_encoding is None or self.non_ascii_expression.search(field) is None):
+            return field
+        return field.decode(self.source_encoding, "replace").encode("utf-8")
+
+    def _sky_hack(self, name):
+        # Hack fix for the way the engine registers functions for the Sky type
+        return name.replace("(int)&off_7957AC", "Sky")
+
     def _extract_description(self, source):
             desc_end = source.rfind("\"")
 
@@ -456,7 +1920,11 @@ class Scraper(object):
             source = source[0:desc_begin] + source[desc_end:len(source)]
             desc = desc.replace("~", ";")
 
-            return source, desc
+            return source, self._decode_field(desc)
+
+    def _call_source(self, match):
+        # Line endings are only joined away when the buffer was read rather than mapped
+        return match.group(0).replace("\r\n", " ")
 
     def _extract_name(self, source, index):
         name = source[index].lstrip()
@@ -465,7 +1933,7 @@ class Scraper(object):
         # Hack fix for the way the engine registers functions for the Sky type
         name = name.replace("(int)&off_7957AC", "Sky")
 
-        return name
+        return self._decode_field(name)
 
     def _extract_address(self, source, index):
         address = source[index]
@@ -473,9 +1941,24 @@ class Scraper(object):
 
         return address.lstrip()
 
-    def _extract_caller(self, source):
-        start = source.find("(")
-        end = source.find(")", start)
+def _either_case(address):
+    # Matches the address whatever the case of its letters, without needing re.IGNORECASE
+    return string.join(["[%s%s]" % (character.upper(), character.lower()) if character.isalpha() else character for character in address], "")
+
+Scraper.compile_registrations()
+
+def _scan_shard(shard):
+    """
+        Process pool entry point for parallel scraping. This has to live at the module level
+        so the pool can pickle it. Shards are scanned by the scraper type of the scrape they
+        belong to, so its registries apply.
+    """
+    scraper_type, engine, shard_buffer, source_encoding = shard
+
+    shard_scraper = scraper_type.__new__(scraper_type)
+    shard_scraper.source_encoding = source_encoding
+    shard_scraper.stats = ScrapeStats()
+    shard_scraper._reset_outputs()
+    shard_scraper._scan(engine, shard_buffer)
 
-        result = int(source[start + 1:end],16)
-        return hex(result)[2:].upper()
+    return shard_scraper
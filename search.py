@@ -0,0 +1,450 @@
+"""
+    search.py
+
+    Full text search over the names and descriptions of the global functions,
+    type methods and datablock properties of a scrape. Names and descriptions
+    are tokenised once into an inverted index of term to the positions it
+    occurs at in every entry, which is saved next to the scrape so searching
+    never has to tokenise anything but the query.
+
+    Queries are a list of clauses, all of which an entry has to match:
+
+        damage              a term
+        "damage level"      a phrase, the terms in this order
+        getdam*             every term starting with the prefix
+
+    Matching entries are ranked with BM25, with matches in names counting
+    for more than matches in descriptions. Names are tokenised whole as well
+    as split at their camel case humps, so getDamageLevel is found by both
+    getdamagelevel and "damage level".
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import re
+import gc
+import math
+import heapq
+import array
+import bisect
+import argparse
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+document_kinds = ("global_function", "type_method", "datablock_property")
+
+format_version = 1
+
+_token_expression = re.compile("[A-Za-z0-9]+")
+_escape_expression = re.compile(r"\\[abfnrtv\\]")
+_hump_expression = re.compile("[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+")
+_clause_expression = re.compile("\"([^\"]*)\"?|(\\S+)")
+
+class SearchHit(object):
+    """
+        An entry matching a search. Scope is the type name of type methods and the datablock
+        type of datablock properties, None for global functions. Datablock properties have
+        no description.
+    """
+    score = None
+    kind = None
+    scope = None
+    name = None
+    address = None
+    description = None
+
+    def __init__(self, score, kind, scope, name, address, description):
+        self.score = score
+        self.kind = kind
+        self.scope = scope
+        self.name = name
+        self.address = address
+        self.description = description
+
+    def as_dict(self):
+        return {
+            "score": self.score,
+            "kind": self.kind,
+            "scope": self.scope,
+            "name": self.name,
+            "address": self.address,
+            "description": self.description,
+        }
+
+class SearchIndex(object):
+    """
+        Inverted index over the entries of a scrape. Every entry is a document whose tokens
+        are the terms of its name followed by those of its description, with a gap between
+        the two so phrases never match across them.
+    """
+    extension = ".search"
+
+    name_weight = 3.0
+    """
+        How many description matches a match in the name of an entry counts for.
+    """
+
+    term_saturation = 1.2
+    length_normalisation = 0.75
+    """
+        The k1 and b parameters of BM25.
+    """
+
+    documents = None
+    """
+        List of (kind, scope, name, address, description) of every entry.
+    """
+
+    terms = None
+    """
+        Every term in the index, sorted so terms are found with a bisect and prefix searches
+        are a range of them.
+    """
+
+    postings = None
+    """
+        Array of the postings of every term in the order of the terms. The postings of a term
+        are every document holding it one after the other, each as its document number, the
+        number of positions of the term in it and the positions themselves. A few arrays
+        pickle in no time, whereas a list or dictionary per term or document would make
+        saving and loading the index crawl.
+    """
+
+    term_offsets = None
+    """
+        Where the postings of every term start, followed by the end of the last.
+    """
+
+    name_lengths = None
+    """
+        The number of name tokens of every document; positions below it are in the name.
+    """
+
+    document_lengths = None
+    average_length = None
+
+    decoded_term_limit = 4096
+    """
+        How many terms are kept unpacked after being searched for, so that common searches
+        don't have to unpack their postings every time.
+    """
+
+    _decoded_postings = None
+    _document_normalisations = None
+    _field_gap = 2
+
+    def __init__(self, documents, terms, postings, term_offsets, name_lengths, document_lengths):
+        self.documents = documents
+        self.terms = terms
+        self.postings = postings
+        self.term_offsets = term_offsets
+        self.name_lengths = name_lengths
+        self.document_lengths = document_lengths
+
+        self.average_length = float(sum(document_lengths)) / max(1, len(document_lengths))
+
+        self._decoded_postings = { }
+
+    @classmethod
+    def from_scrape(cls, scrape):
+        documents = [ ]
+        for global_function in scrape.global_functions:
+            documents.append(("global_function", None, global_function.name, global_function.address, global_function.description))
+
+        for type_name in sorted(scrape.type_methods.keys()):
+            for type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs in scrape.type_methods[type_name]:
+                documents.append(("type_method", type_method_type, type_method_name, type_method_address, type_method_description))
+
+        for datablock_type in sorted(scrape.datablocks.keys()):
+            for datablock_property in scrape.datablocks[datablock_type].properties.values():
+                documents.append(("datablock_property", datablock_type, datablock_property.name, datablock_property.address, None))
+
+        term_postings = { }
+        name_lengths = array.array("L")
+        document_lengths = array.array("L")
+
+        for document_number, document in enumerate(documents):
+            name_terms = name_tokens(document[2])
+            description_terms = tokenize(document[4])
+
+            document_positions = { }
+            for position, term in enumerate(name_terms):
+                document_positions.setdefault(term, [ ])
+                document_positions[term].append(position)
+            for position, term in enumerate(description_terms, len(name_terms) + cls._field_gap):
+                document_positions.setdefault(term, [ ])
+                document_positions[term].append(position)
+
+            # Documents are added in order, so every term's postings stay sorted by document
+            for term, positions in document_positions.items():
+                if (term not in term_postings):
+                    term_postings[term] = array.array("L")
+
+                packed = term_postings[term]
+                packed.append(document_number)
+                packed.append(len(positions))
+                packed.extend(positions)
+
+            name_lengths.append(len(name_terms))
+            document_lengths.append(len(name_terms) + len(description_terms))
+
+        terms = sorted(term_postings.keys())
+        postings = array.array("L")
+        term_offsets = array.array("L")
+
+        for term in terms:
+            term_offsets.append(len(postings))
+            postings.extend(term_postings[term])
+        term_offsets.append(len(postings))
+
+        return cls(documents, terms, postings, term_offsets, name_lengths, document_lengths)
+
+    @classmethod
+    def load(cls, filename):
+        # The collector would otherwise repeatedly walk the postings while they're rebuilt
+        gc_enabled = gc.isenabled()
+        gc.disable()
+
+        try:
+            with open(filename, "rb") as handle:
+                payload = pickle.load(handle)
+        finally:
+            if (gc_enabled):
+                gc.enable()
+
+        return cls.from_payload(payload)
+
+    @classmethod
+    def from_payload(cls, payload):
+        if (payload.get("format_version") != format_version):
+            raise ValueError("Unsupported search index format version %s" % payload.get("format_version"))
+
+        return cls(payload["documents"], payload["terms"], payload["postings"], payload["term_offsets"], payload["name_lengths"], payload["document_lengths"])
+
+    def save(self, filename):
+        with open(filename, "wb") as handle:
+            pickle.dump(self.as_payload(), handle, pickle.HIGHEST_PROTOCOL)
+
+    def as_payload(self):
+        """
+            The picklable contents of the index.
+        """
+        return {
+            "format_version": format_version,
+            "documents": self.documents,
+            "terms": self.terms,
+            "postings": self.postings,
+            "term_offsets": self.term_offsets,
+            "name_lengths": self.name_lengths,
+            "document_lengths": self.document_lengths,
+        }
+
+    def search(self, query, limit=20, kind=None):
+        """
+            Returns up to limit SearchHits for the entries matching every clause of the query,
+            best first. Passing a kind from document_kinds only searches entries of that kind.
+        """
+        clauses = parse_query(query)
+        if (len(clauses) == 0):
+            return [ ]
+
+        scores = None
+        for clause_type, clause in clauses:
+            if (clause_type == "term"):
+                clause_scores = self._score_postings([self._term_postings(clause)])
+            elif (clause_type == "prefix"):
+                clause_scores = self._score_postings([self._term_postings(term) for term in self._terms_with_prefix(clause)])
+            else:
+                clause_scores = self._score_postings([self._phrase_postings(clause)])
+
+            if (scores is None):
+                scores = clause_scores
+            else:
+                scores = dict((document_number, score + clause_scores[document_number]) for document_number, score in scores.items() if document_number in clause_scores)
+
+            if (len(scores) == 0):
+                return [ ]
+
+        if (kind is not None):
+            scores = dict((document_number, score) for document_number, score in scores.items() if self.documents[document_number][0] == kind)
+
+        if (limit is None):
+            ranked = sorted(scores.items(), key=self._rank_key)
+        else:
+            ranked = heapq.nsmallest(limit, scores.items(), key=self._rank_key)
+
+        return [SearchHit(score, *self.documents[document_number]) for document_number, score in ranked]
+
+    def __len__(self):
+        return len(self.documents)
+
+    # Helper Functions
+    @staticmethod
+    def _rank_key(pair):
+        # Best score first, ties in the order the entries were scraped
+        return (-pair[1], pair[0])
+
+    def _term_postings(self, term):
+        """
+            Returns the postings of a term unpacked into a dictionary of document number to
+            the positions of the term in that document.
+        """
+        result = self._decoded_postings.get(term)
+        if (result is not None):
+            return result
+
+        result = { }
+
+        term_index = bisect.bisect_left(self.terms, term)
+        if (term_index < len(self.terms) and self.terms[term_index] == term):
+            postings = self.postings
+            index = self.term_offsets[term_index]
+            end = self.term_offsets[term_index + 1]
+
+            while (index < end):
+                position_count = postings[index + 1]
+                result[postings[index]] = postings[index + 2:index + 2 + position_count]
+                index = index + 2 + position_count
+
+        if (len(self._decoded_postings) >= self.decoded_term_limit):
+            self._decoded_postings.clear()
+        self._decoded_postings[term] = result
+
+        return result
+
+    def _terms_with_prefix(self, prefix):
+        result = [ ]
+
+        index = bisect.bisect_left(self.terms, prefix)
+        while (index < len(self.terms) and self.terms[index].startswith(prefix)):
+            result.append(self.terms[index])
+            index = index + 1
+
+        return result
+
+    def _phrase_postings(self, phrase_terms):
+        """
+            Builds postings for a phrase as though it were a single term, positioned where
+            the phrase starts.
+        """
+        term_postings = [self._term_postings(term) for term in phrase_terms]
+        if (len(term_postings) == 1):
+            return term_postings[0]
+
+        # Only documents holding the rarest term can match at all
+        candidates = set(min(term_postings, key=len))
+        for postings in term_postings:
+            candidates.intersection_update(postings)
+
+        result = { }
+        for document_number in candidates:
+            starts = set(term_postings[0][document_number])
+            for offset, postings in enumerate(term_postings[1:]):
+                starts.intersection_update(position - offset - 1 for position in postings[document_number])
+
+            if (len(starts) != 0):
+                result[document_number] = sorted(starts)
+
+        return result
+
+    def _score_postings(self, postings_list):
+        """
+            BM25 scores of every document in the given postings, which are scored as a whole.
+            Prefix clauses pass the postings of every term they expand to.
+        """
+        document_count = len(self.documents)
+        name_lengths = self.name_lengths
+        normalisations = self._normalisations()
+        name_weight = self.name_weight
+        saturation = self.term_saturation + 1.0
+
+        result = { }
+        for postings in postings_list:
+            frequency = len(postings)
+            inverse_frequency = math.log(1.0 + (document_count - frequency + 0.5) / (frequency + 0.5))
+
+            for document_number, positions in postings.items():
+                # Positions are sorted and those of the name come first
+                name_matches = bisect.bisect_left(positions, name_lengths[document_number])
+                term_frequency = name_weight * name_matches + (len(positions) - name_matches)
+
+                score = inverse_frequency * term_frequency * saturation / (term_frequency + normalisations[document_number])
+                result[document_number] = result.get(document_number, 0.0) + score
+
+        return result
+
+    def _normalisations(self):
+        """
+            The BM25 length normalisation of every document, worked out on the first search.
+        """
+        if (self._document_normalisations is None):
+            self._document_normalisations = [self.term_saturation * (1.0 - self.length_normalisation + self.length_normalisation * length / self.average_length)
+                for length in self.document_lengths]
+
+        return self._document_normalisations
+
+def tokenize(text):
+    """
+        Splits text into lower case terms of letters and digits. Escape sequences such as \\n
+        are left out rather than running into the word following them.
+    """
+    if (text is None):
+        return [ ]
+    return [token.lower() for token in _token_expression.findall(_escape_expression.sub(" ", text))]
+
+def name_tokens(name):
+    """
+        The terms of a name: every word of it whole, followed by the camel case humps of any
+        word made of several.
+    """
+    words = _token_expression.findall(name)
+
+    result = [word.lower() for word in words]
+    for word in words:
+        humps = _hump_expression.findall(word)
+        if (len(humps) > 1):
+            result.extend(hump.lower() for hump in humps)
+
+    return result
+
+def parse_query(query):
+    """
+        Returns the clauses of a query as (clause type, clause) tuples, where the clause is a
+        term or prefix for "term" and "prefix" clauses and a list of terms for "phrase"
+        clauses.
+    """
+    result = [ ]
+    for phrase, word in _clause_expression.findall(query):
+        if (phrase != "" or word.startswith("\"")):
+            phrase_terms = tokenize(phrase)
+            if (len(phrase_terms) != 0):
+                result.append(("phrase", phrase_terms))
+            continue
+
+        if (word.endswith("*")):
+            prefix_terms = tokenize(word[:-1])
+            result.extend(("term", term) for term in prefix_terms[:-1])
+            if (len(prefix_terms) != 0):
+                result.append(("prefix", prefix_terms[-1]))
+            continue
+
+        result.extend(("term", term) for term in tokenize(word))
+
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Searches the names and descriptions in a saved search index.")
+    parser.add_argument("index", help="The search index to search, as written by t2src.py --search-index.")
+    parser.add_argument("query", help="Terms, \"quoted phrases\" and prefix* clauses, all of which have to match.")
+    parser.add_argument("--kind", choices=document_kinds, help="Only search entries of this kind.")
+    parser.add_argument("--limit", type=int, default=20, help="The number of results to list.")
+    arguments = parser.parse_args()
+
+    for hit in SearchIndex.load(arguments.index).search(arguments.query, arguments.limit, arguments.kind):
+        scope = "" if hit.scope is None else hit.scope + "::"
+        print("%8.3f %s%s (%s)" % (hit.score, scope, hit.name, hit.description or hit.kind))
@@ -0,0 +1,187 @@
+"""
+    stats.py
+
+    Phase level instrumentation for the scraper and the renderers. Every phase
+    records its wall and CPU time, how many bytes it went over, how many
+    registrations it matched and the peak memory of the process once it was
+    done. Registrations the scraper had to throw away are counted as well,
+    per category. A single phase can additionally be run under cProfile or,
+    where available, tracemalloc.
+
+    This software is licensed under the MIT license. Refer to LICENSE.txt for
+    details.
+    Copyright (c) 2016 Robert MacGregor
+"""
+
+import os
+import time
+import pstats
+import cProfile
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+class PhaseStats(object):
+    """
+        The measurements of a single phase. Peak memory is in kilobytes and is the peak of
+        the whole process up to the end of this phase, unless the phase was traced with
+        tracemalloc in which case it's the peak allocated during the phase alone.
+    """
+    name = None
+    wall_time = 0.0
+    cpu_time = 0.0
+    bytes_scanned = 0
+    matches = 0
+    rejected = 0
+    peak_memory = None
+
+    def __init__(self, name, bytes_scanned=0):
+        self.name = name
+        self.bytes_scanned = bytes_scanned
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "cpu_time": self.cpu_time,
+            "bytes_scanned": self.bytes_scanned,
+            "matches": self.matches,
+            "rejected": self.rejected,
+            "peak_memory": self.peak_memory,
+        }
+
+class ScrapeStats(object):
+    """
+        Collects the phases of a scrape (or a render) in the order they ran, along with match
+        and rejection counts by registration category.
+    """
+    phases = None
+    matches = None
+    rejected = None
+
+    profile_phase = None
+    trace_memory_phase = None
+
+    profile = None
+    """
+        pstats.Stats of the profiled phase once it has run.
+    """
+
+    def __init__(self, profile_phase=None, trace_memory_phase=None):
+        if (trace_memory_phase is not None and tracemalloc is None):
+            raise ValueError("tracemalloc is not available in this version of Python")
+
+        self.phases = [ ]
+        self.matches = { }
+        self.rejected = { }
+
+        self.profile_phase = profile_phase
+        self.trace_memory_phase = trace_memory_phase
+
+    def phase(self, name, bytes_scanned=0):
+        """
+            Returns a context manager measuring everything that happens within it as the
+            named phase.
+        """
+        return _PhaseContext(self, PhaseStats(name, bytes_scanned))
+
+    def record_match(self, category):
+        self.matches[category] = self.matches.get(category, 0) + 1
+
+    def record_rejection(self, category):
+        self.rejected[category] = self.rejected.get(category, 0) + 1
+
+    def merge(self, other):
+        """
+            Adds the match and rejection counts of another set of stats to ours. Phases are
+            not merged, so worker processes don't show up as phases of their own.
+        """
+        for category, count in other.matches.items():
+            self.matches[category] = self.matches.get(category, 0) + count
+        for category, count in other.rejected.items():
+            self.rejected[category] = self.rejected.get(category, 0) + count
+
+    def find_phase(self, name):
+        for phase in self.phases:
+            if (phase.name == name):
+                return phase
+        return None
+
+    def as_dict(self):
+        return {
+            "phases": [phase.as_dict() for phase in self.phases],
+            "matches": dict(self.matches),
+            "rejected": dict(self.rejected),
+        }
+
+    def report(self):
+        """
+            Formats the stats as a human readable table.
+        """
+        lines = ["%-18s %10s %10s %12s %9s %9s %12s" % ("Phase", "Wall (s)", "CPU (s)", "Bytes", "Matches", "Rejected", "Peak (KB)")]
+
+        for phase in self.phases:
+            peak_memory = "-" if phase.peak_memory is None else "%u" % phase.peak_memory
+            lines.append("%-18s %10.3f %10.3f %12u %9u %9u %12s" % (phase.name, phase.wall_time, phase.cpu_time,
+                phase.bytes_scanned, phase.matches, phase.rejected, peak_memory))
+
+        for category in sorted(set(self.matches.keys()) | set(self.rejected.keys())):
+            lines.append("%s: %u matched, %u rejected" % (category, self.matches.get(category, 0), self.rejected.get(category, 0)))
+
+        return "\n".join(lines)
+
+    # Helper Functions
+    def _total_matches(self):
+        return sum(self.matches.values())
+
+    def _total_rejected(self):
+        return sum(self.rejected.values())
+
+class _PhaseContext(object):
+    def __init__(self, stats, phase):
+        self.stats = stats
+        self.phase = phase
+
+        self.profiler = None
+        self.tracing = False
+
+    def __enter__(self):
+        if (self.phase.name == self.stats.profile_phase):
+            self.profiler = cProfile.Profile()
+        if (self.phase.name == self.stats.trace_memory_phase and not tracemalloc.is_tracing()):
+            tracemalloc.start()
+            self.tracing = True
+
+        self.matches = self.stats._total_matches()
+        self.rejected = self.stats._total_rejected()
+        self.wall_time = time.time()
+        self.cpu_time = sum(os.times()[0:2])
+
+        if (self.profiler is not None):
+            self.profiler.enable()
+        return self.phase
+
+    def __exit__(self, exception_type, exception, traceback):
+        if (self.profiler is not None):
+            self.profiler.disable()
+            self.stats.profile = pstats.Stats(self.profiler)
+
+        self.phase.wall_time = time.time() - self.wall_time
+        self.phase.cpu_time = sum(os.times()[0:2]) - self.cpu_time
+        self.phase.matches = self.stats._total_matches() - self.matches
+        self.phase.rejected = self.stats._total_rejected() - self.rejected
+
+        if (self.tracing):
+            self.phase.peak_memory = tracemalloc.get_traced_memory()[1] // 1024
+            tracemalloc.stop()
+        elif (resource is not None):
+            self.phase.peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        self.stats.phases.append(self.phase)
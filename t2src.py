@@ -10,135 +10,221 @@
     Copyright (c) 2016 Robert MacGregor
 """
 
+import os
 import re
 import time
 import string
-
+import argparse
+
+import cache
+import pages
+import profiles
+import export
+import render
+import search
 import scraper
 
+from stats import ScrapeStats
+
 # Main App
 class Application(object):
-    global_method_heading = "===== Global Methods (%u total) =====\r\n"
-    global_method_arith_heading = "==== Arithmetic Methods (%u total) ====\r\n"
-    global_method_alx_heading = "==== Audio Methods (%u total) ====\r\n"
-    global_method_template = "=== %s ===\r\nAddress in Executable: 0x%s\r\n\r\nDescription: %s\r\n\r\nMinimum Arguments: %u\r\n\r\nMaximum Arguments: %u\r\n"
-
-    global_value_heading = "===== Global Values (%u total): =====\r\n"
-    global_value_template = "=== %s ===\r\nType: %s\r\n\r\nAddress in Executable: 0x%s\r\n\r\n"
-
-    type_method_heading = "===== Type Methods (%u total methods, %u total types) =====\r\n"
-    type_name_template = "==== %s ====\r\n%u total native methods\r\n\r\nInheritance: %s\r\n"
-    type_method_template = "=== %s ===\r\nAddress in Executable: 0x%s\r\n\r\nDescription: %s\r\n\r\nMinimum Arguments: %u\r\n\r\nMaximum Arguments: %u\r\n"
-
-    datablock_list_heading =  "===== Datablocks (%u total) =====\r\n"
-    datablock_heading = "==== %s ====\r\nTotal Properties: %u\r\n\r\nInheritance: %s\r\n"
-    datablock_property_template = "=== %s ===\r\nOffset: %s\r\nType: %s\r\n"
-
-    def main(self):
-            scrape = scraper.Scraper("Tribes2.c")
-
-            # Now build a ref file with our compiled information
-            with open("out.txt", "w") as handle:
-                handle.write("====== Tribes 2 Engine Reference ======\r\n")
-                handle.write("Compiled by Robert MacGregor\r\n\r\n")
-
-                # Collect specific types of global methods
-                global_arith_functions = [ ]
-                global_alx_functions = [ ]
-
-                for index, global_function in enumerate(scrape.global_functions):
-                    if (len(global_function.name) != 0 and (global_function.name[0] == "m" or global_function.name.find("Vector") != -1 or global_function.name.find("Matrix") != -1)):
-                        global_arith_functions.append(scrape.global_functions.pop(index))
-                    elif (global_function.name.find("alx") != -1 or global_function.name.find("audio") != -1 or global_function.name.find("getAudio") != -1):
-                        global_alx_functions.append(scrape.global_functions.pop(index))
-
-                # Write the Global Method Listing
-                handle.write(self.global_method_heading % scrape.global_function_count)
-                handle.write("\r\n")
-
-                for global_function in scrape.global_functions:
-                    handle.write(self.global_method_template % (global_function.name, global_function.address, global_function.description, global_function.min_args - 1, global_function.max_args - 1))
-
-                handle.write("\r\n")
-
-                # Arithmetic Global Methods
-                handle.write(self.global_method_arith_heading % len(global_arith_functions))
-                handle.write("\r\n")
-
-                for global_arith_function in global_arith_functions:
-                    handle.write(self.global_method_template % (global_arith_function.name, global_arith_function.address, global_arith_function.address, global_arith_function.min_args - 1, global_arith_function.max_args - 1))
-
-                handle.write("\r\n")
-
-                # Audio Global Methods
-                handle.write(self.global_method_alx_heading % len(global_alx_functions))
-                handle.write("\r\n")
-
-                for global_alx_function in global_alx_functions:
-                    handle.write(self.global_method_template % (global_alx_function.name, global_alx_function.address, global_alx_function.description, global_alx_function.min_args - 1, global_alx_function.max_args - 1))
-
-                handle.write("\r\n")
-
-                # Write out the known types
-                #handle.write("
-
-                # Now the type methods
-                handle.write(self.type_method_heading % (scrape.type_function_total, len(scrape.type_methods.keys())))
-                handle.write("\r\n")
-
-                for type_name in scrape.type_methods.keys():
-                    inheritance_tree = "<Unknown>"
-                    if (type_name in scrape.type_name_inheritance.keys()):
-                        inheritance_tree = self.build_inheritance_tree(scrape.build_inheritance_tree(type_name))
-
-                    handle.write(self.type_name_template % (type_name, len(scrape.type_methods[type_name]), inheritance_tree))
-
-                    # Native Methods First
-                    for type_method_type, type_method_address, type_method_name, type_method_description, type_method_minargs, type_method_maxargs in scrape.type_methods[type_name]:
-                        handle.write(self.type_method_template % (type_method_name, type_method_address, type_method_description, type_method_minargs - 1, type_method_maxargs - 1))
-
-                    handle.write("\r\n")
-
-                # And Global Values
-                handle.write(self.global_value_heading % len(scrape.global_values))
-                handle.write("\r\n")
-
-                for global_value in scrape.global_values:
-                    if (global_value.name[0] != "$"):
-                        global_value.name = "%s%s" % ("$", global_value.name)
-
-                    handle.write(self.global_value_template % (global_value.name, scrape.primitive_type_mapping[global_value.type_name], global_value.address))
-
-                handle.write("\r\n")
-
-                # Write datablocks
-                handle.write(self.datablock_list_heading  % len(scrape.datablocks.keys()))
-
-                for datablock_type in scrape.datablocks.keys():
-                    inheritance_tree = "<Unknown>"
-                    if (datablock_type in scrape.type_name_inheritance.keys()):
-                        inheritance_tree = self.build_inheritance_tree(scrape.build_inheritance_tree(datablock_type))
-
-                    datablock = scrape.datablocks[datablock_type]
-                    handle.write(self.datablock_heading % (datablock.name, len(datablock.properties.keys()), inheritance_tree))
-
-                    for datablock_property_name in datablock.properties.keys():
-                        datablock_property = datablock.properties[datablock_property_name]
-
-                        handle.write(self.datablock_property_template % (datablock_property.name, datablock_property.address, datablock_property.type_name))
-
-    def build_inheritance_tree(self, tree):
-        result = ""
-
-        for tree_element in tree:
-            result += "[[#%s]] -> " % tree_element
-
-        result = result.rstrip(" -> ")
-        return result
+    output_formats = None
+    """
+        Names of the render backends to write, from render.renderers. The first format is
+        written to the output filename, any others next to it with their own extension. Each
+        format may only be given once, and no two formats may end up in the same file.
+    """
+
+    pages_directory = None
+    """
+        When set, the reference is written as separate pages below this directory in the
+        first output format rather than as a single document.
+    """
+
+    page_results = None
+    """
+        pages.PageResults of the last run that wrote pages.
+    """
+
+    export_filenames = None
+    """
+        Files to export the scrape results to, in the format given by their extension.
+    """
+
+    search_index_filename = None
+    """
+        When set, the search index of the names and descriptions of the scrape is written here.
+    """
+
+    cache_directory = ".scrape_cache"
+    """
+        Where scrape results are cached between runs. Set to None to always scrape from scratch.
+    """
+
+    scraper_options = None
+    """
+        Keyword arguments passed on to the scraper, such as the scan engine to use.
+    """
+
+    scraper_type = scraper.Scraper
+    """
+        The scraper to scrape with, which may be compiled from a registration profile to
+        scrape other titles.
+    """
+
+    stats = None
+    """
+        ScrapeStats shared with the scraper, so it holds the scraper phases followed by our own.
+    """
+
+    def __init__(self, scraper_options=None, stats=None, output_formats=None):
+        self.scraper_options = { } if scraper_options is None else scraper_options
+        self.stats = ScrapeStats() if stats is None else stats
+        self.output_formats = ["dokuwiki"] if output_formats is None else output_formats
+        self.export_filenames = [ ]
+
+    def main(self, input_filename="Tribes2.c", output_filename="out.txt"):
+            # Check the output filenames up front rather than after scraping
+            if (self.pages_directory is None):
+                self.output_filenames(output_filename)
+
+            with self.stats.phase("scrape", os.path.getsize(input_filename)):
+                scrape = self.scrape(input_filename)
+
+            if (len(self.export_filenames) != 0):
+                with self.stats.phase("export") as phase:
+                    for export_filename in self.export_filenames:
+                        export.export(scrape, export_filename)
+
+                phase.bytes_scanned = sum(os.path.getsize(export_filename) for export_filename in self.export_filenames)
+
+            if (self.search_index_filename is not None):
+                with self.stats.phase("search_index") as phase:
+                    self.search_index(input_filename, scrape).save(self.search_index_filename)
+
+                phase.bytes_scanned = os.path.getsize(self.search_index_filename)
+
+            with self.stats.phase("render") as phase:
+                if (self.pages_directory is None):
+                    output_filenames = self.render(scrape, output_filename)
+                    phase.bytes_scanned = sum(os.path.getsize(filename) for filename in output_filenames)
+                else:
+                    self.page_results = self.render_pages(scrape, self.pages_directory)
+                    phase.bytes_scanned = self.page_results.bytes_written
+
+    def scrape(self, input_filename):
+            if (self.cache_directory is None):
+                return self.scraper_type(input_filename, stats=self.stats, **self.scraper_options)
+            return cache.ScrapeCache(self.cache_directory).scrape(input_filename, self.scraper_type, stats=self.stats, **self.scraper_options)
+
+    def search_index(self, input_filename, scrape):
+            if (self.cache_directory is None):
+                return search.SearchIndex.from_scrape(scrape)
+            return cache.ScrapeCache(self.cache_directory).search_index(input_filename, self.scraper_type, scrape, **self.scraper_options)
+
+    def render(self, scrape, output_filename):
+            """
+                Renders the scrape in every output format at once and returns the names of the
+                files written.
+            """
+            output_filenames = self.output_filenames(output_filename)
+            handles = [ ]
+            backends = [ ]
+
+            try:
+                for output_format, filename in zip(self.output_formats, output_filenames):
+                    handles.append(open(filename, "w"))
+                    backends.append(render.renderers[output_format](handles[-1]))
+
+                render.render(render.ReferenceEvents(scrape), backends)
+            finally:
+                for handle in handles:
+                    handle.close()
+
+            return output_filenames
+
+    def output_filenames(self, output_filename):
+            """
+                Names the file every output format is written to. Raises a ValueError if a format
+                is given more than once or two formats would be written to the same file.
+            """
+            result = [ ]
+            for output_format in self.output_formats:
+                if (self.output_formats.count(output_format) != 1):
+                    raise ValueError("The %s output format is given more than once" % output_format)
+
+                filename = output_filename
+                if (len(result) != 0):
+                    filename = os.path.splitext(output_filename)[0] + render.renderers[output_format].extension
+
+                for other_format, other_filename in zip(self.output_formats, result):
+                    if (os.path.abspath(filename) == os.path.abspath(other_filename)):
+                        raise ValueError("The %s and %s output formats would both be written to %s" % (other_format, output_format, filename))
+
+                result.append(filename)
+
+            return result
+
+    def render_pages(self, scrape, directory):
+            processes = self.scraper_options.get("processes")
+            return pages.PageWriter(directory, self.output_formats[0], processes).write(scrape)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Builds the DokuWiki engine reference from a decompiled Tribes 2 executable.")
+    parser.add_argument("input", nargs="?", default="Tribes2.c", help="The decompiled executable to scrape, which may be compressed with gzip (.gz), bzip2 (.bz2) or xz (.xz).")
+    parser.add_argument("-o", "--output", default="out.txt", help="Where to write the reference page.")
+    parser.add_argument("--engine", choices=scraper.Scraper.scan_engines, default="regex", help="The scan engine to scrape with.")
+    parser.add_argument("--mmap", action="store_true", help="Map the input into memory rather than reading it.")
+    parser.add_argument("--bytes", action="store_true", help="Read and scan the input as raw bytes rather than splitting it into lines.")
+    parser.add_argument("--encoding", help="Codec of the names and descriptions in the input, which are written out as UTF-8. Left as they are by default.")
+    parser.add_argument("--profile", metavar="FILENAME", help="Scrape with the registration tables of this profile rather than those of Tribes 2.")
+    parser.add_argument("--memory-limit", type=int, metavar="MB", help="Stream the input in windows rather than loading it, keeping memory use within this many megabytes.")
+    parser.add_argument("--processes", type=int, help="Scrape in parallel with this many worker processes. Also the number of processes writing pages, which defaults to one per CPU.")
+    parser.add_argument("-f", "--format", action="append", choices=sorted(render.renderers.keys()), help="Output format to write, may be given several times. Defaults to dokuwiki.")
+    parser.add_argument("--pages", metavar="DIRECTORY", help="Write a page per type, datablock and function category below this directory instead of a single document.")
+    parser.add_argument("-e", "--export", action="append", default=[ ], metavar="FILENAME", help="Also export the results for other tools, as JSON Lines (.jsonl), SQLite (.sqlite) or msgpack (.msgpack).")
+    parser.add_argument("--search-index", metavar="FILENAME", help="Also write a full text search index of the names and descriptions, for search.py.")
+    parser.add_argument("--no-cache", action="store_true", help="Always scrape from scratch rather than using cached results.")
+    parser.add_argument("--stats", action="store_true", help="Print the time, throughput and memory of every phase.")
+    parser.add_argument("--profile-phase", help="Run the named phase under cProfile and print the results.")
+    parser.add_argument("--trace-memory-phase", help="Trace the allocations of the named phase with tracemalloc.")
+    arguments = parser.parse_args()
+
+    memory_limit = None if arguments.memory_limit is None else arguments.memory_limit << 20
+    application = Application({ "engine": arguments.engine, "use_mmap": arguments.mmap, "use_bytes": arguments.bytes, "source_encoding": arguments.encoding,
+        "processes": arguments.processes, "memory_limit": memory_limit },
+        ScrapeStats(arguments.profile_phase, arguments.trace_memory_phase), arguments.format)
+
+    # Cached results would hide the scraper phases from profiling entirely
+    if (arguments.no_cache or arguments.profile_phase is not None or arguments.trace_memory_phase is not None):
+        application.cache_directory = None
+
+    if (arguments.profile is not None):
+        application.scraper_type = profiles.scraper_type(arguments.profile)
+
+    application.pages_directory = arguments.pages
+    application.export_filenames = arguments.export
+    application.search_index_filename = arguments.search_index
+
+    if (application.pages_directory is None):
+        try:
+            application.output_filenames(arguments.output)
+        except ValueError as error:
+            parser.error(str(error))
+
     time_before = time.time()
-    Application().main()
+    application.main(arguments.input, arguments.output)
     time_after = time.time()
 
+    if (arguments.stats):
+        print(application.stats.report())
+        if (application.stats.find_phase("cache_hit") is not None):
+            print("Scrape results were loaded from the cache, so no scraper phases ran; pass --no-cache to measure them.")
+    if (application.stats.profile is not None):
+        application.stats.profile.sort_stats("cumulative").print_stats(25)
+
+    if (application.page_results is not None):
+        results = application.page_results
+        print("%u pages written, %u unchanged, %u removed" % (len(results.written), len(results.unchanged), len(results.removed)))
+
     print("Processed in %f seconds" % (time_after - time_before))